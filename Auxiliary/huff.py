@@ -7,6 +7,10 @@ import os
 import marshal
 import cPickle
 import array
+import struct
+from cStringIO import StringIO
+from collections import defaultdict
+import numpy as np
 
 
 
@@ -65,14 +69,229 @@ def _gen_huffman_code(node, dict_codes, buffer_stack=[]):
     _gen_huffman_code(node.R, dict_codes, buffer_stack)
     buffer_stack.pop()
 
+def _code_lengths(node, lengths, depth=0):
+    # Fills lengths with the code length of every leaf below node
+    if not node.L and not node.R:
+        # A lonely root still needs one bit per symbol
+        lengths[node.c] = max(depth, 1)
+        return
+    _code_lengths(node.L, lengths, depth+1)
+    _code_lengths(node.R, lengths, depth+1)
+
+def _canonical_codes(lengths):
+    # Canonical Huffman codes: the symbols, sorted by (length, symbol), get
+    # consecutive codes. The code lengths are then enough to rebuild them.
+    codes = {}
+    code, prev_length = 0, 0
+    for ch, length in sorted(lengths.iteritems(), key=lambda x: (x[1], x[0])):
+        code <<= length - prev_length
+        codes[ch] = bin(code)[2:].zfill(length)
+        code, prev_length = code + 1, length
+    return codes
+
+def _tree_from_codes(codes):
+    # Rebuilds the decoding tree from the code of every symbol
+    root = HuffmanNode(fq=0)
+    for ch, code in codes.iteritems():
+        node = root
+        for bit in code:
+            if bit == '1':
+                if not node.R:
+                    node.R = HuffmanNode(fq=0, parent=node)
+                node = node.R
+            else:
+                if not node.L:
+                    node.L = HuffmanNode(fq=0, parent=node)
+                node = node.L
+        node.c = ch
+    return root
+
+# Globals a legacy (pickled) tree may refer to. Anything else is refused,
+# so an old file cannot run arbitrary code when it is read.
+def _find_legacy_global(module, name):
+    import copy_reg
+    if name == 'HuffmanNode':
+        return HuffmanNode
+    if (module, name) == ('copy_reg', '_reconstructor'):
+        return copy_reg._reconstructor
+    if (module, name) == ('__builtin__', 'object'):
+        return object
+    raise cPickle.UnpicklingError('global %s.%s is not allowed' % (module, name))
+
+def _load_legacy_tree(pickled_root):
+    unpickler = cPickle.Unpickler(StringIO(pickled_root))
+    unpickler.find_global = _find_legacy_global
+    return unpickler.load()
+
+def _build_decode_table(codes):
+    # Table indexed by the next TABLE_BITS bits of the payload. first_sym and
+    # first_bits give the symbol whose code starts those bits and its length
+    # (0 when the code is longer than TABLE_BITS). The main table gives the
+    # (symbols, bits) of every code which fits whole in those bits.
+    size = 1 << TABLE_BITS
+    mask = size - 1
+    first_sym = [''] * size
+    first_bits = [0] * size
+    long_codes = {}
+    for ch, code in codes.iteritems():
+        length = len(code)
+        if length > TABLE_BITS:
+            long_codes[(length, int(code, 2))] = ch
+            continue
+        start = int(code, 2) << (TABLE_BITS - length)
+        for p in xrange(start, start + (1 << (TABLE_BITS - length))):
+            first_sym[p] = ch
+            first_bits[p] = length
+
+    syms = list(first_sym)
+    bits = list(first_bits)
+    for p in xrange(size):
+        used = first_bits[p]
+        if not used:
+            continue
+        decoded = [first_sym[p]]
+        while True:
+            q = (p << used) & mask
+            length = first_bits[q]
+            if not length or used + length > TABLE_BITS:
+                break
+            decoded.append(first_sym[q])
+            used += length
+        syms[p] = ''.join(decoded)
+        bits[p] = used
+    return zip(syms, bits), first_sym, first_bits, long_codes
+
+def _decode_table(codes):
+    # The tables only depend on the codes, and the blocks of a file often
+    # share them, so the last ones are kept
+    key = tuple(sorted(codes.iteritems()))
+    table = _decode_tables.get(key)
+    if table is None:
+        if len(_decode_tables) >= MAX_DECODE_TABLES:
+            _decode_tables.clear()
+        table = _decode_tables[key] = _build_decode_table(codes)
+    return table
+
+def _decode_long(buf, nbits, long_codes, max_length):
+    # Symbol (and length) of a code longer than TABLE_BITS, at the top of
+    # the nbits bits of buf (nbits >= max_length)
+    for length in xrange(TABLE_BITS + 1, max_length + 1):
+        code = (buf >> (nbits - length)) & ((1 << length) - 1)
+        ch = long_codes.get((length, code))
+        if ch is not None:
+            return ch, length
+    raise ValueError('bad Huffman code')
+
+def _as_bytes(long_str):
+    # The symbols of a string, array or buffer as an array of bytes
+    if isinstance(long_str, np.ndarray):
+        return long_str.view(np.uint8).ravel()
+    return np.frombuffer(long_str, np.uint8)
+
+class _Counter(object):
+    # Counts the symbols of one or several chunks. They go into the
+    # dictionary in order of appearance (as if they were counted one by
+    # one), as the tree depends on the dictionary order.
+    def __init__(self):
+        self.counts = np.zeros(256, np.int64)
+        self.order = []
+
+    def update(self, sym):
+        chunk = np.bincount(sym, minlength=256)
+        data = sym.tostring()
+        new = map(chr, np.flatnonzero((chunk > 0) & (self.counts == 0)))
+        self.order.extend(sorted(new, key=data.find))
+        self.counts += chunk
+
+    def freq(self):
+        d = defaultdict(int)
+        for ch in self.order:
+            d[ch] = int(self.counts[ord(ch)])
+        return d
+
 def _cal_freq(long_str):
-    from collections import defaultdict
-    d = defaultdict(int)
-    for c in long_str:
-        d[c] += 1
-    return d
+    counter = _Counter()
+    counter.update(_as_bytes(long_str))
+    return counter.freq()
+
+def _freq_lengths(freq):
+    # Code length of every symbol of a Huffman code for freq
+    lengths = {}
+    _code_lengths(_build_tree(
+        [HuffmanNode(ch=ch, fq=int(fq)) for ch, fq in freq.iteritems()]
+        ), lengths)
+    return lengths
+
+def _pack(codes, lengths, buff, length):
+    # Packs the codes (uint64 arrays of codes and lengths) after the length
+    # bits of buff. Returns the completed bytes and the bits left for the
+    # last incomplete byte (buff, length).
+    if length:
+        # The bits left by the previous chunk go first, as one more code
+        codes = np.concatenate(([buff], codes)).astype(np.uint64)
+        lengths = np.concatenate(([length], lengths)).astype(np.uint64)
+    if len(codes) == 0:
+        return '', 0, 0
+
+    # Every code goes into the 64 bits word where it starts, and the
+    # codes which do not fit spill their last bits into the next word.
+    # Codes never overlap, so the words are just the sums of their parts.
+    ends = np.cumsum(lengths)
+    total = int(ends[-1])
+    starts = ends - lengths
+    word = (starts >> np.uint64(6)).astype(np.intp)
+    room = np.uint64(WORD_BITS) - (starts & np.uint64(WORD_BITS - 1))
+    fits = lengths <= room
+    spill = ~fits
+    parts = np.where(fits,
+        codes << np.where(fits, room - lengths, 0).astype(np.uint64),
+        codes >> np.where(fits, 0, lengths - room).astype(np.uint64))
+
+    words = np.zeros((total + WORD_BITS - 1) / WORD_BITS + 1, np.uint64)
+    first = np.flatnonzero(np.r_[True, word[1:] != word[:-1]])
+    words[word[first]] = np.add.reduceat(parts, first)
+    excess = (lengths - room)[spill]
+    words[word[spill] + 1] |= codes[spill] << (np.uint64(WORD_BITS) - excess)
+
+    data = words.astype('>u8').tostring()
+    n_bytes = total / MAX_BITS
+    length = total % MAX_BITS
+    return data[:n_bytes], ord(data[n_bytes]) >> (MAX_BITS - length), length
+
+def _contexts(sym, prev, prev2, small):
+    # Context of every symbol of sym (uint8 array), given the two symbols
+    # before the first one: the symbol before it and whether the one before
+    # that is a small one (small is 1 for them, by byte value)
+    ext = np.r_[np.array([prev2, prev], np.uint8), sym]
+    return ext[1:-1].astype(np.intp) * 2 + small[ext[:-2]]
+
+def _small_table(small):
+    table = np.zeros(256, np.intp)
+    for ch in small:
+        table[ord(ch)] = 1
+    return table
 
 MAX_BITS = 8
+WORD_BITS = 64 # Bits of the words the encoder packs the codes in
+
+# First byte of the canonical format. It is followed by the number of
+# symbols minus one (1 byte), a (symbol, code length) pair of bytes per
+# symbol and the number of bits of the codes ('<Q'). The old format, a
+# marshal tuple with the pickled tree, always starts with '('.
+CANONICAL = 'C'
+LEGACY = '('
+CONTEXT = 'K' # A code per context (see ContextEncoder)
+# First byte of a payload with a fixed code (see StaticEncoder). It is
+# followed by the table number (1 byte) and the number of bits of the
+# codes ('<Q', at STATIC_BITS, so it can be written after the codes).
+STATIC = 'S'
+STATIC_BITS = 2
+STATIC_HEADER = 10
+
+# Bits looked up at once by the decoder, and number of decoding tables kept
+TABLE_BITS = 12
+MAX_DECODE_TABLES = 64
+_decode_tables = {}
 
 class Encoder(object):
     bitslen=0
@@ -90,63 +309,119 @@ class Encoder(object):
         return self._long_str
     def __set_long_str(self, s):
         self._long_str = s
-        if s:
+        if s is not None and len(s) > 0:
             self.root = self._get_tree_root()
             self.code_map = self._get_code_map()
-            self.array_codes, self.code_length = self._encode()
+            self.array_codes, self.code_length, self.bps = self._encode()
     long_str = property(__get_long_str, __set_long_str)
     
     def _get_tree_root(self):
         d = _cal_freq(self.long_str)
+        self.freq = d
         return _build_tree(
             [HuffmanNode(ch=ch, fq=int(fq)) for ch, fq in d.iteritems()]
             )
 
     def _get_code_map(self):
-        a_dict={}
-        _gen_huffman_code(self.root, a_dict)
+        # Only the code lengths come from the tree: the codes themselves are
+        # the canonical ones, so the header just needs the lengths. Every
+        # symbol gets an (integer code, length) pair, which encode_chunk
+        # looks up by byte value in _codes and _lengths.
+        self.lengths = {}
+        _code_lengths(self.root, self.lengths)
+        if max(self.lengths.itervalues()) > WORD_BITS:
+            raise ValueError('codes longer than %d bits' % WORD_BITS)
+        code_map = {}
+        self._codes = np.zeros(256, np.uint64)
+        self._lengths = np.zeros(256, np.uint64)
+        for ch, code in _canonical_codes(self.lengths).iteritems():
+            code_map[ch] = (int(code, 2), len(code))
+            self._codes[ord(ch)] = int(code, 2)
+            self._lengths[ord(ch)] = len(code)
         #print "tabla de codigos huffman:"
         #print a_dict  # este es el diccionario, la tabla de codigos
-        return a_dict
+        return code_map
         
     def _encode(self):
-        array_codes = array.array('B')
+        self._buff, self._length = 0, 0
+        array_codes = array.array('B', self.encode_chunk(self.long_str) + self.flush())
         code_length = 0
-        buff, length = 0, 0
-        for ch in self.long_str:
-            code = self.code_map[ch]        
-            for bit in list(code):
-                if bit=='1':
-                    buff = (buff << 1) | 0x01
-                else: # bit == '0'
-                    buff = (buff << 1)
-                length += 1
-                if length == MAX_BITS:
-                    array_codes.extend([buff])
-                    buff, length = 0, 0
-
-            code_length += len(code)
-            
-        if length != 0:
-            array_codes.extend([buff << (MAX_BITS-length)])
+        for ch, fq in self.freq.iteritems():
+            code_length += fq * self.code_map[ch][1]
         bps=float(code_length)/float(len(self.long_str))
         
         #print "el fichero comprimido ocupa ", code_length," bits -->bits/simbolo=",float(bps)
         self.bitslen=code_length
-        return array_codes, code_length
+        return array_codes, code_length, bps
+
+    def count_chunk(self, long_str):
+        # Counts the symbols of a chunk, for set_freq
+        if getattr(self, '_counter', None) is None:
+            self._counter = _Counter()
+        self._counter.update(_as_bytes(long_str))
+
+    def set_freq(self, freq=None):
+        # Builds the code from the symbol frequencies ({symbol: count}, the
+        # ones of the chunks given to count_chunk by default), when the
+        # whole string is not in memory. The codes are then given by
+        # encode_chunk, and the header by dumps_header.
+        self._long_str = None
+        if freq is None:
+            freq = self._counter.freq()
+        self.freq = freq
+        self.root = _build_tree(
+            [HuffmanNode(ch=ch, fq=int(fq)) for ch, fq in freq.iteritems()]
+            )
+        self.code_map = self._get_code_map()
+        self.code_length = 0
+        for ch, fq in freq.iteritems():
+            self.code_length += fq * self.code_map[ch][1]
+        self.bitslen = self.code_length
+        n_sym = sum(freq.itervalues())
+        self.bps = float(self.code_length) / n_sym if n_sym else 0.0
+        self._buff, self._length = 0, 0
+
+    def encode_chunk(self, long_str):
+        # Returns the bytes completed with the codes of long_str (a string,
+        # or an array of bytes). The bits of the last incomplete byte are
+        # kept for the next chunk (or flush).
+        sym = _as_bytes(long_str)
+        data, self._buff, self._length = _pack(self._codes[sym],
+            self._lengths[sym], self._buff, self._length)
+        return data
+
+    def flush(self):
+        # Returns the last incomplete byte, padded with zeros
+        buff, length = self._buff, self._length
+        self._buff, self._length = 0, 0
+        if length != 0:
+            return chr(buff << (MAX_BITS-length))
+        return ''
+
+    def dumps_header(self):
+        # Returns what dumps writes before the codes: the codes can then be
+        # written chunk by chunk with encode_chunk and flush
+        if max(self.lengths.itervalues()) > 255:
+            raise ValueError('code too long for the header')
+        pairs = sorted(self.lengths.iteritems())
+        return ''.join([CANONICAL, chr(len(pairs) - 1)] +
+            [ch + chr(length) for ch, length in pairs] +
+            [struct.pack('<Q', self.code_length)])
 
     def encode(self, filename):
         fp = open(filename, 'rb')
         self.long_str = fp.read()
         fp.close()
 
+    def dumps(self):
+        # la cabecera con la tabla de codigos ocupa. no es gratis (2 bytes
+        # por simbolo)
+        return self.dumps_header() + self.array_codes.tostring()
+
     def write(self, filename):
-        if self._long_str:
+        if self._long_str is not None and len(self._long_str) > 0:
             fcompressed = open(filename, 'wb')
-            # la cabecera con la tabla de codigos ocupa. no es gratis
-            marshal.dump(
-                (cPickle.dumps(self.root), self.code_length, self.array_codes),
-                fcompressed)
+            fcompressed.write(self.dumps())
             #marshal.dump(
             #    ( self.array_codes),
             #    fcompressed)
@@ -155,6 +430,195 @@ class Encoder(object):
         else:
             print "You haven't set 'long_str' attribute."
 
+class ContextEncoder(Encoder):
+    # Huffman encoder with a code per context. The context of a symbol is
+    # the symbol before it and whether the one before that is in small
+    # (both are chr(0) for the first symbol).
+    def __init__(self, small=''):
+        self.small = small
+        self._small = _small_table(small)
+        self._long_str = None
+
+    def __set_long_str(self, s):
+        self._long_str = s
+        if s is not None and len(s) > 0:
+            self._cprev = self._cprev2 = 0
+            self._context_counts = None
+            self.count_chunk(s)
+            self.set_freq()
+            self.array_codes = array.array('B', self.encode_chunk(s) + self.flush())
+    long_str = property(Encoder.long_str.fget, __set_long_str)
+
+    def count_chunk(self, long_str):
+        # Counts the symbols of a chunk in every context, for set_freq
+        sym = _as_bytes(long_str)
+        if getattr(self, '_context_counts', None) is None:
+            self._context_counts = np.zeros(512 * 256, np.int64)
+            self._cprev = self._cprev2 = 0
+        if len(sym) == 0:
+            return
+        ctx = _contexts(sym, self._cprev, self._cprev2, self._small)
+        self._context_counts += np.bincount(ctx * 256 + sym, minlength=512 * 256)
+        self._cprev2 = sym[-2] if len(sym) > 1 else self._cprev
+        self._cprev = sym[-1]
+
+    def set_freq(self, freq=None):
+        # freq is {context: {symbol: count}} (the counts of count_chunk by
+        # default), and every context gets its own canonical code
+        self._long_str = None
+        if freq is None:
+            counts = self._context_counts.reshape(512, 256)
+            freq = {}
+            for ctx in np.flatnonzero(counts.sum(axis=1)):
+                freq[ctx] = defaultdict(int)
+                for c in np.flatnonzero(counts[ctx]):
+                    freq[ctx][chr(c)] = int(counts[ctx, c])
+        self.freq = freq
+        self.context_lengths = {}
+        self._codes = np.zeros((512, 256), np.uint64)
+        self._lengths = np.zeros((512, 256), np.uint64)
+        self.code_length = 0
+        for ctx, ctx_freq in freq.iteritems():
+            lengths = self.context_lengths[ctx] = _freq_lengths(ctx_freq)
+            if max(lengths.itervalues()) > WORD_BITS:
+                raise ValueError('codes longer than %d bits' % WORD_BITS)
+            for ch, code in _canonical_codes(lengths).iteritems():
+                self._codes[ctx, ord(ch)] = int(code, 2)
+                self._lengths[ctx, ord(ch)] = len(code)
+                self.code_length += ctx_freq[ch] * len(code)
+        self.bitslen = self.code_length
+        n_sym = sum(sum(f.itervalues()) for f in freq.itervalues())
+        self.bps = float(self.code_length) / n_sym if n_sym else 0.0
+        self._buff, self._length = 0, 0
+        self._prev = self._prev2 = 0
+
+    def encode_chunk(self, long_str):
+        sym = _as_bytes(long_str)
+        if len(sym) == 0:
+            return ''
+        ctx = _contexts(sym, self._prev, self._prev2, self._small)
+        self._prev2 = sym[-2] if len(sym) > 1 else self._prev
+        self._prev = sym[-1]
+        data, self._buff, self._length = _pack(self._codes[ctx, sym],
+            self._lengths[ctx, sym], self._buff, self._length)
+        return data
+
+    def dumps_header(self):
+        # 'K', the small symbols, the number of contexts and, for every
+        # one, its number ('<H') and code lengths (as in the basic header)
+        header = [CONTEXT, chr(len(self.small)), self.small,
+            struct.pack('<H', len(self.context_lengths))]
+        for ctx, lengths in sorted(self.context_lengths.iteritems()):
+            if max(lengths.itervalues()) > 255:
+                raise ValueError('code too long for the header')
+            pairs = sorted(lengths.iteritems())
+            header.append(struct.pack('<H', ctx) + chr(len(pairs) - 1))
+            header.extend([ch + chr(length) for ch, length in pairs])
+        header.append(struct.pack('<Q', self.code_length))
+        return ''.join(header)
+
+    def dumps(self):
+        return self.dumps_header() + self.array_codes.tostring()
+
+class StaticEncoder(Encoder):
+    # Huffman encoder with a fixed code: one of some tables of code lengths
+    # ({symbol: length}, trained once) which the decoder also has, so the
+    # header only needs the table number. set_freq takes the table which
+    # gives the fewest bits for the symbols, or the code of the symbols
+    # themselves (a basic payload) if it is smaller, header included and
+    # fallback allowed. set_table takes a table before any symbol is known,
+    # so the codes can be written in a single pass (code_length then grows
+    # with every chunk, and is written last).
+    def __init__(self, tables, fallback=True):
+        self.tables = tables
+        self.fallback = fallback
+        self.table = None
+        self._long_str = None
+
+    def __set_long_str(self, s):
+        self._long_str = s
+        if s is not None and len(s) > 0:
+            self.set_freq(_cal_freq(s))
+            self._long_str = s
+            self.array_codes = array.array('B', self.encode_chunk(s) + self.flush())
+    long_str = property(Encoder.long_str.fget, __set_long_str)
+
+    def table_bits(self, freq):
+        # Bits of the codes of freq with every table (None for the tables
+        # without a code for one of its symbols)
+        bits = []
+        for lengths in self.tables:
+            if all(ch in lengths for ch, fq in freq.iteritems() if fq):
+                bits.append(sum(fq * lengths.get(ch, 0) for ch, fq in freq.iteritems()))
+            else:
+                bits.append(None)
+        return bits
+
+    def best_table(self, long_str):
+        # Number of the table which gives the fewest bits for the symbols of
+        # long_str (all of them, or a prefix of them for set_table)
+        bits = self.table_bits(_cal_freq(long_str))
+        candidates = [(n, table) for table, n in enumerate(bits) if n is not None]
+        if not candidates:
+            raise ValueError('no Huffman table has a code for every symbol')
+        return min(candidates)[1]
+
+    def set_table(self, table):
+        # Takes the code of a table for the next chunks
+        self._long_str = None
+        self.table = table
+        self.lengths = dict(self.tables[table])
+        self.code_map = {}
+        self._codes = np.zeros(256, np.uint64)
+        self._lengths = np.zeros(256, np.uint64)
+        for ch, code in _canonical_codes(self.lengths).iteritems():
+            self.code_map[ch] = (int(code, 2), len(code))
+            self._codes[ord(ch)] = int(code, 2)
+            self._lengths[ord(ch)] = len(code)
+        self.code_length = self.bitslen = 0
+        self._count = True # Bits counted chunk by chunk
+        self._buff, self._length = 0, 0
+
+    def set_freq(self, freq=None):
+        if freq is None:
+            freq = self._counter.freq()
+        bits = self.table_bits(freq)
+        candidates = [(n, table) for table, n in enumerate(bits) if n is not None]
+        if self.fallback or not candidates:
+            Encoder.set_freq(self, freq)
+            own = self.code_length + 8 * len(Encoder.dumps_header(self))
+            if not candidates or own < min(candidates)[0] + 8 * STATIC_HEADER:
+                self.table = None
+                self._count = False
+                return
+        self.set_table(min(candidates)[1])
+        self.freq = freq
+        self.code_length = self.bitslen = min(candidates)[0]
+        n_sym = sum(freq.itervalues())
+        self.bps = float(self.code_length) / n_sym if n_sym else 0.0
+        self._count = False
+
+    def encode_chunk(self, long_str):
+        sym = _as_bytes(long_str)
+        if self.table is not None and len(sym) and not self._lengths[sym].all():
+            raise ValueError('symbol without code in Huffman table %d' % self.table)
+        if self._count:
+            self.code_length += int(self._lengths[sym].sum())
+            self.bitslen = self.code_length
+        return Encoder.encode_chunk(self, sym)
+
+    def dumps_header(self):
+        if self.table is None:
+            return Encoder.dumps_header(self)
+        return STATIC + chr(self.table) + struct.pack('<Q', self.code_length)
+
+def encode(long_str):
+    # Encodes a whole string (or array of bytes) in one call. Returns what
+    # Encoder.dumps writes and the bits per symbol of the codes.
+    enc = Encoder()
+    enc.long_str = long_str
+    return enc.dumps(), enc.bps
+
 class Decoder(object):
     def __init__(self, filename_or_raw_str=None):
         if filename_or_raw_str:
@@ -163,48 +627,223 @@ class Decoder(object):
                 self.read(filename)            
             else:
                 print '[Decoder] take \'%s\' as raw string' % filename_or_raw_str
-                raw_string = filename_or_raw_str
-                unpickled_root, length, array_codes = marshal.loads(raw_string)
-                self.root = cPickle.loads(unpickled_root)
-                self.code_length = length        
-                self.array_codes = array.array('B', array_codes)
+                self.loads(filename_or_raw_str)
 
     def _decode(self):
+        if self.code_length > 8 * len(self.array_codes):
+            raise ValueError('truncated Huffman codes')
+        if not self.root.L and not self.root.R:
+            # Only one symbol, one bit per symbol
+            return self.root.c * self.code_length
+
+        table, first_sym, first_bits, long_codes = _decode_table(self.codes)
+        max_length = max(len(code) for code in self.codes.itervalues())
+        k = TABLE_BITS
+        mask = (1 << k) - 1
+
+        # The payload is read in 32 bits words, which go into a bit buffer
+        # of at most 64 bits (more only for codes longer than 32 bits).
+        # Zeros are added at the end, so the last codes can always be peeked.
+        data = self.array_codes.tostring()
+        n_words = (len(data) + 3) / 4 + (max(k, max_length) + 31) / 32 + 1
+        words = struct.unpack('>%dI' % n_words, data + '\0' * (4*n_words - len(data)))
+
         string_buf = []
-        total_length = 0    
-        node = self.root
-        for code in self.array_codes:
-            buf_length = 0
-            while (buf_length < MAX_BITS and total_length != self.code_length):
-                buf_length += 1
-                total_length += 1            
-                if code >> (MAX_BITS - buf_length) & 1:
-                    node = node.R
-                    if node.c:
-                        string_buf.append(node.c)
-                        node = self.root
-                else:
-                    node = node.L
-                    if node.c:
-                        string_buf.append(node.c)
-                        node = self.root
-
-        return ''.join(string_buf)        
+        append = string_buf.append
+        buf, nbits, w = 0, 0, 0
+        left = self.code_length
+
+        # Several symbols per lookup while TABLE_BITS bits are left
+        while left >= k:
+            if nbits < k:
+                buf = ((buf & ((1 << nbits) - 1)) << 32) | words[w]
+                w += 1
+                nbits += 32
+            ch, n = table[(buf >> (nbits - k)) & mask]
+            if n:
+                append(ch)
+            else:
+                while nbits < max_length:
+                    buf = ((buf & ((1 << nbits) - 1)) << 32) | words[w]
+                    w += 1
+                    nbits += 32
+                ch, n = _decode_long(buf, nbits, long_codes, max_length)
+                append(ch)
+            nbits -= n
+            left -= n
+
+        # Then one by one, as the last bits may only be padding
+        while left > 0:
+            while nbits < max(k, max_length):
+                buf = ((buf & ((1 << nbits) - 1)) << 32) | words[w]
+                w += 1
+                nbits += 32
+            p = (buf >> (nbits - k)) & mask
+            n = first_bits[p]
+            if n:
+                ch = first_sym[p]
+            else:
+                ch, n = _decode_long(buf, nbits, long_codes, max_length)
+            if n > left:
+                raise ValueError('truncated Huffman codes')
+            append(ch)
+            nbits -= n
+            left -= n
+
+        return ''.join(string_buf)
+
+    def loads(self, raw_string):
+        if raw_string[:1] == CANONICAL:
+            n_symbols = ord(raw_string[1]) + 1
+            end = 2 + 2*n_symbols
+            pairs = raw_string[2:end]
+            lengths = dict((pairs[i], ord(pairs[i+1]))
+                for i in xrange(0, len(pairs), 2))
+            if len(lengths) != n_symbols or min(lengths.itervalues()) == 0:
+                raise ValueError('bad canonical Huffman header')
+            self.codes = _canonical_codes(lengths)
+            self.root = _tree_from_codes(self.codes)
+            self.code_length = struct.unpack('<Q', raw_string[end:end+8])[0]
+            self.array_codes = array.array('B', raw_string[end+8:])
+        elif raw_string[:1] == LEGACY:
+            # Files written before the canonical header: the tree is pickled
+            unpickled_root, length, array_codes = marshal.loads(raw_string)
+            self.root = _load_legacy_tree(unpickled_root)
+            self.codes = {}
+            if self.root.L or self.root.R:
+                _gen_huffman_code(self.root, self.codes, [])
+            self.code_length = length
+            self.array_codes = array.array('B', array_codes)
+        else:
+            raise ValueError('unknown Huffman format')
 
     def read(self, filename):
         fp = open(filename, 'rb')
-        unpickled_root, length, array_codes = marshal.load(fp)        
-        self.root = cPickle.loads(unpickled_root)
-        self.code_length = length        
-        self.array_codes = array.array('B', array_codes)
+        self.loads(fp.read())
         fp.close()
 
+    def decode(self):
+        return self._decode()
+
+    def decode_codes(self, codes, code_length):
+        # Decodes code_length bits of other codes with the same code, as
+        # a fixed code is loaded once for several payloads
+        self.array_codes = array.array('B', codes)
+        self.code_length = code_length
+        return self._decode()
+
     def decode_as(self, filename):
         decoded = self._decode()
         fout = open(filename, 'wb')
         fout.write(decoded)
         fout.close()
 
+class StaticDecoder(Decoder):
+    # Decodes the payloads of a StaticEncoder with the same tables
+    def __init__(self, tables):
+        self.tables = tables
+
+    def loads(self, raw_string):
+        if raw_string[:1] != STATIC:
+            raise ValueError('not a static Huffman payload')
+        table = ord(raw_string[1])
+        if table >= len(self.tables):
+            raise ValueError('unknown Huffman table %d' % table)
+        self.codes = _canonical_codes(self.tables[table])
+        self.root = _tree_from_codes(self.codes)
+        self.code_length = struct.unpack('<Q', raw_string[STATIC_BITS:STATIC_HEADER])[0]
+        self.array_codes = array.array('B', raw_string[STATIC_HEADER:])
+
+class ContextDecoder(Decoder):
+    def loads(self, raw_string):
+        if raw_string[:1] != CONTEXT:
+            raise ValueError('not a context Huffman payload')
+        n_small = ord(raw_string[1])
+        self.small = raw_string[2:2 + n_small]
+        pos = 2 + n_small
+        n_contexts = struct.unpack('<H', raw_string[pos:pos + 2])[0]
+        pos += 2
+        self.context_codes = {}
+        for k in xrange(n_contexts):
+            ctx = struct.unpack('<H', raw_string[pos:pos + 2])[0]
+            n_symbols = ord(raw_string[pos + 2]) + 1
+            pairs = raw_string[pos + 3:pos + 3 + 2*n_symbols]
+            lengths = dict((pairs[i], ord(pairs[i+1]))
+                for i in xrange(0, len(pairs), 2))
+            if len(lengths) != n_symbols or min(lengths.itervalues()) == 0:
+                raise ValueError('bad context Huffman header')
+            self.context_codes[ctx] = _canonical_codes(lengths)
+            pos += 3 + 2*n_symbols
+        self.code_length = struct.unpack('<Q', raw_string[pos:pos + 8])[0]
+        self.array_codes = array.array('B', raw_string[pos + 8:])
+
+    def _decode(self):
+        if not self.context_codes:
+            return ''
+        small = _small_table(self.small).tolist()
+        max_length = max(len(code) for codes in self.context_codes.itervalues()
+            for code in codes.itervalues())
+        k = TABLE_BITS
+        mask = (1 << k) - 1
+
+        # A table per context, indexed by the next TABLE_BITS bits. Every
+        # entry gives the symbol, its length and the table of the context of
+        # the next symbol. Codes longer than TABLE_BITS give (context, 0,
+        # None) and are found in long_codes.
+        tables = dict((ctx, [None] * (1 << k)) for ctx in self.context_codes)
+        long_codes = {}
+        for ctx, codes in self.context_codes.iteritems():
+            table = tables[ctx]
+            long_codes[ctx] = {}
+            for ch, code in codes.iteritems():
+                length = len(code)
+                if length > k:
+                    long_codes[ctx][(length, int(code, 2))] = ch
+                    start = int(code[:k], 2)
+                    table[start] = (ctx, 0, None)
+                    continue
+                next_table = tables.get(ord(ch) * 2 + small[ctx >> 1])
+                start = int(code, 2) << (k - length)
+                table[start:start + (1 << (k - length))] = \
+                    [(ch, length, next_table)] * (1 << (k - length))
+
+        data = self.array_codes.tostring()
+        n_words = (len(data) + 3) / 4 + (max(k, max_length) + 31) / 32 + 1
+        words = struct.unpack('>%dI' % n_words, data + '\0' * (4*n_words - len(data)))
+
+        string_buf = []
+        append = string_buf.append
+        buf, nbits, w = 0, 0, 0
+        left = self.code_length
+        table = tables.get(small[0])
+
+        try:
+            while left > 0:
+                if nbits < k:
+                    buf = ((buf & ((1 << nbits) - 1)) << 32) | words[w]
+                    w += 1
+                    nbits += 32
+                ch, n, next_table = table[(buf >> (nbits - k)) & mask]
+                if not n:
+                    ctx = ch
+                    while nbits < max_length:
+                        buf = ((buf & ((1 << nbits) - 1)) << 32) | words[w]
+                        w += 1
+                        nbits += 32
+                    ch, n = _decode_long(buf, nbits, long_codes[ctx], max_length)
+                    next_table = tables.get(ord(ch) * 2 + small[ctx >> 1])
+                if n > left:
+                    raise ValueError('truncated Huffman codes')
+                append(ch)
+                nbits -= n
+                left -= n
+                table = next_table
+        except TypeError:
+            # A context or a code which is not in the header
+            raise ValueError('bad Huffman code')
+
+        return ''.join(string_buf)
+
 if __name__=='__main__':
     original_file = 'filename.txt'
     compressed_file = 'compressed.scw'
@@ -0,0 +1,289 @@
+"""
+
+This module measures the quality of a decoded audio against the original
+one: PSNR, SNR, segmental SNR and maximum absolute error. The functions
+take both whole signals; a QualityMeter takes them chunk by chunk, so
+long audios can be measured (for instance, while they are encoded)
+without keeping them in memory:
+
+  meter = QualityMeter()
+  for decoded, original in chunks:
+      meter.update(decoded, original)
+  print meter.psnr(), meter.segmentalSNR()
+
+Both give the same values for the same samples, however they are split.
+
+"""
+# LHE Codec for Audio
+
+import array, math
+import numpy as np
+
+# Peak value of the PSNR: 16+16 bits for every amplitude value (positive and negative)
+PEAK = 65535
+
+# Samples per segment of the segmental SNR
+SEGMENT_SIZE = 1024
+
+# Every segment SNR is clamped to this range (dB), so silent or perfect
+# segments do not take over the mean
+MIN_SEGMENT_SNR = -10.0
+MAX_SEGMENT_SNR = 35.0
+
+
+def _asSamples(samples):
+	"""Returns the samples of a list, array, array.array or string of
+	signed 16 bits little endian integers as a flat int64 numpy array."""
+
+	if isinstance(samples, (str, buffer, bytearray)):
+		samples = np.frombuffer(samples, "<i2")
+	elif isinstance(samples, array.array):
+		samples = np.frombuffer(samples, samples.typecode)
+
+	return np.asarray(samples).ravel().astype(np.int64)
+
+
+def _errors(decoded, original):
+	"""Returns the original samples and the errors of the decoded ones
+	(int64 arrays). Raises a ValueError if their sizes are different."""
+
+	decoded, original = _asSamples(decoded), _asSamples(original)
+	if (decoded.size != original.size):
+		raise ValueError("%d decoded samples, %d original samples" % (decoded.size, original.size))
+
+	return original, decoded - original
+
+
+def _ratio(signal, noise):
+	"""Returns 10*log10(signal/noise), inf if there is no noise."""
+
+	if (noise == 0):
+		return float("inf")
+	if (signal == 0):
+		return float("-inf")
+
+	return 10 * math.log10(float(signal) / noise)
+
+
+def _segmentSNRs(signal, noise):
+	"""Returns the clamped SNR of every segment, given the signal and noise
+	energy of each one (numpy arrays)."""
+
+	signal, noise = signal.astype(np.float64), noise.astype(np.float64)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		snr = 10 * np.log10(signal / noise)
+	snr[noise == 0] = MAX_SEGMENT_SNR # Perfect segments (silent ones too)
+	snr[(signal == 0) & (noise != 0)] = MIN_SEGMENT_SNR
+
+	return np.clip(snr, MIN_SEGMENT_SNR, MAX_SEGMENT_SNR)
+
+
+def _psnr(squared_error, n_samples):
+	"""Returns the PSNR given the sum of the squared errors."""
+
+	if (squared_error == 0):
+		return float("inf") # Ideal case
+
+	return 10 * math.log10(float(PEAK) * PEAK * n_samples / squared_error)
+
+
+#*******************************************************************************#
+#	Function getPSNR: This calculates the Peak Signal to Noise Ratio (PSNR) of  #
+#	a decoded audio, comparing it to the original one.                          #
+#	Input: Decoded and original samples                                         #
+#	Output: PSNR (dB)                                                           #
+#*******************************************************************************#
+
+def getPSNR(decoded, original):
+	"""Returns the PSNR (dB) of the decoded samples, inf if they are the
+	original ones.
+
+	Parameters: Decoded and original samples (signed 16 bits integers:
+	lists, numpy arrays of any shape, array.array or little endian strings).
+
+	Exceptions: This function will throw a ValueError if both audios do not
+	have the same number of samples.
+
+	"""
+
+	original, error = _errors(decoded, original)
+	return _psnr(int(np.dot(error, error)), error.size)
+
+
+#*******************************************************************************#
+#	Function getSNR: This calculates the Signal to Noise Ratio (SNR) of a       #
+#	decoded audio: original signal energy over error energy.                     #
+#	Input: Decoded and original samples                                         #
+#	Output: SNR (dB)                                                            #
+#*******************************************************************************#
+
+def getSNR(decoded, original):
+	"""Returns the SNR (dB) of the decoded samples, inf if they are the
+	original ones and -inf if the original audio is silent but the decoded
+	one is not.
+
+	Parameters: Decoded and original samples (see getPSNR).
+
+	Exceptions: This function will throw a ValueError if both audios do not
+	have the same number of samples.
+
+	"""
+
+	original, error = _errors(decoded, original)
+	return _ratio(int(np.dot(original, original)), int(np.dot(error, error)))
+
+
+#*******************************************************************************#
+#	Function getSegmentalSNR: This calculates the mean SNR of the segments of   #
+#	a decoded audio, which follows the perceived quality better than the SNR   #
+#	of the whole audio.                                                         #
+#	Input: Decoded and original samples, samples per segment (optional)         #
+#	Output: Segmental SNR (dB)                                                  #
+#*******************************************************************************#
+
+def getSegmentalSNR(decoded, original, segment_size=SEGMENT_SIZE):
+	"""Returns the mean of the SNR of every segment of segment_size samples
+	(the last one can be shorter), each one clamped between MIN_SEGMENT_SNR
+	and MAX_SEGMENT_SNR. Segments without error count as MAX_SEGMENT_SNR.
+	It is nan if there are no samples.
+
+	Parameters: Decoded and original samples (see getPSNR), number of
+	samples per segment.
+
+	Exceptions: This function will throw a ValueError if both audios do not
+	have the same number of samples.
+
+	"""
+
+	original, error = _errors(decoded, original)
+	if (original.size == 0):
+		return float("nan")
+
+	# Segments as rows, the last one padded with zeros (they add no energy)
+	n_segments = -(-original.size // segment_size)
+	pad = n_segments * segment_size - original.size
+	original = np.concatenate((original, np.zeros(pad, np.int64))).reshape(n_segments, segment_size)
+	error = np.concatenate((error, np.zeros(pad, np.int64))).reshape(n_segments, segment_size)
+
+	snr = _segmentSNRs((original * original).sum(axis=1), (error * error).sum(axis=1))
+	return float(snr.sum()) / n_segments
+
+
+#*******************************************************************************#
+#	Function getMaxError: This calculates the maximum absolute error of a       #
+#	decoded audio.                                                              #
+#	Input: Decoded and original samples                                         #
+#	Output: Maximum absolute error                                              #
+#*******************************************************************************#
+
+def getMaxError(decoded, original):
+	"""Returns the maximum absolute difference between the decoded and
+	original samples (0 if there are no samples).
+
+	Parameters: Decoded and original samples (see getPSNR).
+
+	Exceptions: This function will throw a ValueError if both audios do not
+	have the same number of samples.
+
+	"""
+
+	original, error = _errors(decoded, original)
+	if (error.size == 0):
+		return 0
+
+	return int(np.abs(error).max())
+
+
+class QualityMeter(object):
+	"""Quality metrics of a decoded audio given chunk by chunk (see update).
+
+	Only sums are kept (signal and error energy, maximum error, SNR of the
+	finished segments and energy of the current one), so the memory does
+	not depend on the audio length. The values are the ones the functions
+	of this module give for the whole audio.
+
+	"""
+
+	def __init__(self, segment_size=SEGMENT_SIZE):
+		self.segment_size = segment_size
+		self.n_samples = 0
+		self.signal_energy = 0 # Python integers, they do not overflow
+		self.error_energy = 0
+		self.max_error = 0
+		self.n_segments = 0 # Finished segments
+		self.segments_snr = 0.0 # Sum of their SNR
+		self._segment = [0, 0, 0] # Signal energy, error energy and samples of the current segment
+
+	def update(self, decoded, original):
+		"""Adds a chunk of decoded samples and the original ones (see
+		getPSNR). Raises a ValueError if their sizes are different."""
+
+		original, error = _errors(decoded, original)
+		n = error.size
+		if (n == 0):
+			return
+
+		signal_squares, error_squares = original * original, error * error
+		self.n_samples += n
+		self.signal_energy += int(signal_squares.sum())
+		self.error_energy += int(error_squares.sum())
+		self.max_error = max(self.max_error, int(np.abs(error).max()))
+
+		# The first samples finish the current segment
+		segment = self._segment
+		first = min(self.segment_size - segment[2], n)
+		segment[0] += int(signal_squares[:first].sum())
+		segment[1] += int(error_squares[:first].sum())
+		segment[2] += first
+		if (segment[2] < self.segment_size):
+			return
+		self._closeSegments(np.array([segment[0]]), np.array([segment[1]]))
+
+		# Whole segments, and the start of the next one
+		full = (n - first) // self.segment_size * self.segment_size
+		if (full > 0):
+			self._closeSegments(
+				signal_squares[first:first + full].reshape(-1, self.segment_size).sum(axis=1),
+				error_squares[first:first + full].reshape(-1, self.segment_size).sum(axis=1))
+		self._segment = [int(signal_squares[first + full:].sum()),
+			int(error_squares[first + full:].sum()), n - first - full]
+
+	def _closeSegments(self, signal, noise):
+		"""Adds the SNR of some finished segments, given their energies."""
+
+		self.segments_snr += float(_segmentSNRs(signal, noise).sum())
+		self.n_segments += len(signal)
+
+	def psnr(self):
+		"""Returns the PSNR (dB) of the samples given so far."""
+
+		return _psnr(self.error_energy, self.n_samples)
+
+	def snr(self):
+		"""Returns the SNR (dB) of the samples given so far."""
+
+		return _ratio(self.signal_energy, self.error_energy)
+
+	def segmentalSNR(self):
+		"""Returns the segmental SNR (dB) of the samples given so far, the
+		current segment included."""
+
+		signal, noise, n = self._segment
+		if (n == 0):
+			if (self.n_segments == 0):
+				return float("nan")
+			return self.segments_snr / self.n_segments
+
+		last = float(_segmentSNRs(np.array([signal]), np.array([noise]))[0])
+		return (self.segments_snr + last) / (self.n_segments + 1)
+
+	def maxError(self):
+		"""Returns the maximum absolute error of the samples given so far."""
+
+		return self.max_error
+
+	def as_dict(self):
+		"""Returns all the metrics (and the number of samples)."""
+
+		return {"samples": self.n_samples, "psnr": self.psnr(), "snr": self.snr(),
+			"segmental_snr": self.segmentalSNR(), "max_error": self.maxError()}
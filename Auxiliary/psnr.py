@@ -6,46 +6,45 @@ This module calculates the Peak Signal to Noise Ratio (PSNR) of a codified audio
 # LHE Codec for Audio
 # Author: Eduardo Rodes Pastor
 
-import math
+import numpy as np
+
+from metrics import getPSNR
 
 # ----------------#
 # PSNR CALCULATOR #
 # ----------------#
 
 #*******************************************************************************#
-#   Function getHops: This calculates the Peak Signal to Noise Ratio (PSNR) of  #
-#   the codified audio, comparing it to the original one.                       #
+#   Function calculatePSNR: This calculates the Peak Signal to Noise Ratio      #
+#   (PSNR) of the codified audio, comparing it to the original one (see         #
+#   metrics.getPSNR, which returns it without printing anything).               #
 #   Input: predicted amplitude list, original amplitude list and number of      #
 #   samples.                                                                    #
-#   Output: None, this just prints the PSNR.                                    #
+#   Output: PSNR (dB), it is printed too.                                       #
 #*******************************************************************************#
 
 def calculatePSNR(amp_pred, amp, n_samples):
-	"""Prints the PSNR of the audio amplitude lists given.
+	"""Prints and returns the PSNR of the audio amplitude lists given.
 
 	It compares the predicted amplitude list with the original one and gets
 	the total error between them.
 
-	Parameters: predicted and original amplitude (integer list with values from -32768 to
+	Parameters: predicted and original amplitude (integer list or array with values from -32768 to
 	32767), number of samples of the audio (integer).
 
-	Exceptions: This function does not throw an exception.
+	Exceptions: This function will throw a ValueError if both lists do not
+	have the same length.
 
 	"""
-	total_amp = 0 # Summatory of squared errors
-	sum_amp = 0
-
-	for i in range(0, len(amp)): 
+	amp_pred, amp = amp_pred[0:n_samples], amp[0:n_samples]
+	peakSignalToNoiseRatio = getPSNR(amp_pred, amp)
 
-		dif_amp = abs(amp_pred[i] - amp[i]) # Simple error between predicted and original amplitude
-		sum_amp = sum_amp + dif_amp
-		total_amp = total_amp + pow(dif_amp, 2) # We add its square to the summatory
-		meanSquaredError = float(total_amp) / float(n_samples) # And we get the mean squared error per sample
+	dif_amp = np.abs(np.asarray(amp_pred, np.int64) - np.asarray(amp, np.int64)) # Simple error between predicted and original amplitude
 
-	if (meanSquaredError != 0):
-		# We use 65535 because we're using 16+16 bits for every amplitude value (positive and negative)
-		peakSignalToNoiseRatio = float(10 * math.log(65535 * 65535 / meanSquaredError, 10))
+	if (peakSignalToNoiseRatio != float("inf")):
 		print "Peak Signal to Noise Ratio (PSNR) = ", round(peakSignalToNoiseRatio, 2), "dB"
-		print "Mean error = ", sum_amp/len(amp)
+		print "Mean error = ", int(dif_amp.sum()) / len(dif_amp)
 	else:
-		print "Peak Signal to Noise Ratio (PSNR) = 0 dB" # Ideal case
\ No newline at end of file
+		print "Peak Signal to Noise Ratio (PSNR) = inf dB (identical signals)" # Ideal case.
+
+	return peakSignalToNoiseRatio
@@ -0,0 +1,244 @@
+"""
+
+Adaptive range codec (encoder and decoder). It has the same interface as
+the Huffman codec, so it can take its place.
+
+"""
+import struct
+import array
+
+from huff import _as_bytes, _cal_freq, _Counter
+
+# First byte of the payload. It is followed by the number of symbols minus
+# one (1 byte), the symbols, most frequent first (1 byte each), and the
+# number of coded symbols ('<Q'). The range coder bytes go after them.
+RANGE = 'R'
+# First byte of the payload with a model per context. The small symbols
+# (their number, 1 byte, and the symbols) go before the rest of the header.
+CONTEXT = 'Q'
+
+TOP = 1 << 24 # The range is kept over TOP (and under 2^32)
+MAX_TOTAL = 1 << 14 # The frequencies are halved when their total gets here
+INCREMENT = 32 # Frequency added to a symbol every time it is coded
+
+
+def _models(n, small_symbols):
+    # The frequencies of the n symbols, with their total at the end, for
+    # every context: the symbol before (its index) and whether the one
+    # before that is small. Without small symbols all the contexts share
+    # one model.
+    if small_symbols is None:
+        return [[1] * n + [n]] * (2 * n)
+    return [[1] * n + [n] for ctx in xrange(2 * n)]
+
+
+class Encoder(object):
+    bitslen = 0
+    small = None # Small symbols of the contexts (None: no contexts)
+
+    def __init__(self, long_str=None):
+        if long_str is not None:
+            self.long_str = long_str
+
+    def __get_long_str(self):
+        return self._long_str
+    def __set_long_str(self, s):
+        self._long_str = s
+        if s is not None and len(s) > 0:
+            self.set_freq(_cal_freq(s))
+            self.codes = self.encode_chunk(s) + self.flush()
+            self.bitslen = 8 * len(self.codes)
+            self.bps = float(self.bitslen) / len(s)
+    long_str = property(__get_long_str, __set_long_str)
+
+    def count_chunk(self, long_str):
+        # Counts the symbols of a chunk, for set_freq
+        if getattr(self, '_counter', None) is None:
+            self._counter = _Counter()
+        self._counter.update(_as_bytes(long_str))
+
+    def set_freq(self, freq=None):
+        # The model adapts itself to the symbols, so the frequencies (the
+        # ones of the chunks given to count_chunk by default) are only
+        # needed to know the symbols and their order (the most frequent
+        # ones are found first by the decoder)
+        self._long_str = None
+        if freq is None:
+            freq = self._counter.freq()
+        self.symbols = sorted(freq, key=lambda ch: (-freq[ch], ch))
+        self.n_sym = sum(freq.itervalues())
+        self._index = dict((ch, i) for i, ch in enumerate(self.symbols))
+        self._small = [int(ch in (self.small or '')) for ch in self.symbols]
+        self._models = _models(len(self.symbols), self.small)
+        self._prev, self._prev2 = 0, 0
+        self._low, self._range = 0, 0xFFFFFFFF
+        self._cache, self._cache_size = 0, 1
+
+    def encode_chunk(self, long_str):
+        # Returns the bytes completed with the symbols of long_str (a string,
+        # or an array of bytes). The coder state goes on to the next chunk.
+        out = array.array('B')
+        append = out.append
+        index, models, small = self._index, self._models, self._small
+        n = len(self.symbols)
+        low, rng = self._low, self._range
+        cache, cache_size = self._cache, self._cache_size
+        prev, prev2 = self._prev, self._prev2
+
+        for ch in _as_bytes(long_str).tostring():
+            i = index[ch]
+            freqs = models[prev * 2 + small[prev2]]
+            prev2, prev = prev, i
+            f = freqs[i]
+            r = rng // freqs[n]
+            low += r * sum(freqs[:i])
+            rng = r * f
+            while rng < TOP:
+                rng <<= 8
+                # The top byte of low goes out, unless a carry may still
+                # change it (then it waits in cache, with the 0xFF after it)
+                if low < 0xFF000000 or low > 0xFFFFFFFF:
+                    carry = low >> 32
+                    append((cache + carry) & 0xFF)
+                    for k in xrange(cache_size - 1):
+                        append((0xFF + carry) & 0xFF)
+                    cache_size = 0
+                    cache = (low >> 24) & 0xFF
+                cache_size += 1
+                low = (low & 0x00FFFFFF) << 8
+
+            freqs[i] = f + INCREMENT
+            freqs[n] += INCREMENT
+            if freqs[n] > MAX_TOTAL:
+                for k in xrange(n):
+                    freqs[k] = (freqs[k] + 1) >> 1
+                freqs[n] = sum(freqs[:n])
+
+        self._prev, self._prev2 = prev, prev2
+        self._low, self._range = low, rng
+        self._cache, self._cache_size = cache, cache_size
+        return out.tostring()
+
+    def flush(self):
+        # Returns the last bytes, enough for the decoder to find every symbol
+        out = array.array('B')
+        low, cache, cache_size = self._low, self._cache, self._cache_size
+        for n in xrange(5):
+            if low < 0xFF000000 or low > 0xFFFFFFFF:
+                carry = low >> 32
+                out.append((cache + carry) & 0xFF)
+                for k in xrange(cache_size - 1):
+                    out.append((0xFF + carry) & 0xFF)
+                cache_size = 0
+                cache = (low >> 24) & 0xFF
+            cache_size += 1
+            low = (low & 0x00FFFFFF) << 8
+        self._low, self._cache, self._cache_size = low, cache, cache_size
+        return out.tostring()
+
+    def dumps_header(self):
+        # Returns what dumps writes before the codes
+        if self.small is None:
+            header = [RANGE]
+        else:
+            header = [CONTEXT, chr(len(self.small)), self.small]
+        return ''.join(header + [chr(len(self.symbols) - 1)] + self.symbols +
+            [struct.pack('<Q', self.n_sym)])
+
+    def dumps(self):
+        return self.dumps_header() + self.codes
+
+    def write(self, filename):
+        fcompressed = open(filename, 'wb')
+        fcompressed.write(self.dumps())
+        fcompressed.close()
+
+
+class ContextEncoder(Encoder):
+    # Range encoder with an adaptive model per context. The context of a
+    # symbol is the symbol before it and whether the one before that is in
+    # small (both are the most frequent symbol for the first one).
+    def __init__(self, small=''):
+        self.small = small
+        self._long_str = None
+
+
+def encode(long_str):
+    # Encodes a whole string (or array of bytes) in one call. Returns what
+    # Encoder.dumps writes and the bits per symbol.
+    enc = Encoder(long_str)
+    return enc.dumps(), enc.bps
+
+
+class Decoder(object):
+    # Decodes both payloads, with or without contexts
+    def __init__(self, filename=None):
+        if filename:
+            self.read(filename)
+
+    def loads(self, raw_string):
+        if raw_string[:1] == RANGE:
+            self.small = None
+            pos = 1
+        elif raw_string[:1] == CONTEXT:
+            pos = 2 + ord(raw_string[1])
+            self.small = raw_string[2:pos]
+        else:
+            raise ValueError('not a range coder payload')
+        n_symbols = ord(raw_string[pos]) + 1
+        self.symbols = list(raw_string[pos + 1:pos + 1 + n_symbols])
+        end = pos + 1 + n_symbols
+        self.n_sym = struct.unpack('<Q', raw_string[end:end + 8])[0]
+        self.codes = raw_string[end + 8:]
+
+    def read(self, filename):
+        fp = open(filename, 'rb')
+        self.loads(fp.read())
+        fp.close()
+
+    def decode(self):
+        symbols = self.symbols
+        n = len(symbols)
+        models = _models(n, self.small)
+        small = [int(ch in (self.small or '')) for ch in symbols]
+        prev, prev2 = 0, 0
+        # Zeros after the end, as the last bytes of the encoder may be missing
+        data = array.array('B', self.codes)
+        data.extend([0] * 8)
+
+        code, rng, pos = 0, 0xFFFFFFFF, 0
+        for k in xrange(5):
+            code = ((code << 8) | data[pos]) & 0xFFFFFFFF
+            pos += 1
+
+        string_buf = []
+        append = string_buf.append
+        for s in xrange(self.n_sym):
+            freqs = models[prev * 2 + small[prev2]]
+            r = rng // freqs[n]
+            v = code // r
+            i, cum = 0, 0
+            f = freqs[0]
+            while cum + f <= v and i < n - 1:
+                cum += f
+                i += 1
+                f = freqs[i]
+            append(symbols[i])
+            prev2, prev = prev, i
+            code -= r * cum
+            rng = r * f
+            while rng < TOP:
+                if pos >= len(data):
+                    raise ValueError('truncated range coder payload')
+                code = ((code << 8) | data[pos]) & 0xFFFFFFFF
+                pos += 1
+                rng <<= 8
+
+            freqs[i] = f + INCREMENT
+            freqs[n] += INCREMENT
+            if freqs[n] > MAX_TOTAL:
+                for k in xrange(n):
+                    freqs[k] = (freqs[k] + 1) >> 1
+                freqs[n] = sum(freqs[:n])
+
+        return ''.join(string_buf)
@@ -0,0 +1,326 @@
+"""
+
+This module reads the samples of .wav audio files in big blocks, or maps
+them (see mapWav), and creates .wav files whose samples are written in
+place (see createWav). Files over 4 GB are RF64 files, whose sizes take
+64 bits.
+
+"""
+# LHE Codec for Audio
+
+import collections, struct, wave
+import numpy as np
+
+# Format tags of the fmt chunk
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Number of frames read from the file at once
+CHUNK_FRAMES = 1 << 20
+
+# Largest size of a RIFF file or chunk (32 bits), bigger ones are RF64 sizes
+MAX_RIFF_SIZE = 0xFFFFFFFF
+
+WavInfo = collections.namedtuple("WavInfo", ["format_tag", "n_channels", "sample_rate",
+	"bits_per_sample", "block_align", "data_offset", "n_frames"])
+
+#*******************************************************************************#
+#	Function getWavInfo: This reads the RIFF header of a .wav file and finds    #
+#	its fmt and data chunks.                                                    #
+#	Input: .wav file object, opened in binary mode                              #
+#	Output: WavInfo with the audio format and the position of the samples       #
+#*******************************************************************************#
+
+def getWavInfo(fp):
+	"""Returns the format of a .wav file and where its samples are.
+
+	Parameters: .wav file object, opened in binary mode.
+
+	Exceptions: This function will throw a wave.Error if the file is not a
+	.wav file or its format is not supported (PCM or IEEE float samples).
+
+	"""
+
+	fp.seek(0, 2)
+	file_size = fp.tell()
+	fp.seek(0)
+
+	riff = fp.read(12)
+	if (len(riff) < 12 or riff[0:4] not in ("RIFF", "RF64") or riff[8:12] != "WAVE"):
+		raise wave.Error("file does not start with RIFF id")
+
+	fmt = None
+	data_size64 = None # Size of the data chunk in the ds64 chunk of RF64 files
+	position = 12
+
+	# We walk the chunks until we get the data one
+	while True:
+		chunk_header = fp.read(8)
+		if (len(chunk_header) < 8):
+			raise wave.Error("data chunk not found")
+		chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+		position = position + 8
+
+		if (chunk_id == "data"):
+			if (chunk_size == MAX_RIFF_SIZE and data_size64 is not None):
+				chunk_size = data_size64
+			break
+		if (chunk_id == "fmt "):
+			fmt = fp.read(chunk_size)
+		if (chunk_id == "ds64"):
+			ds64 = fp.read(chunk_size)
+			if (len(ds64) < 16):
+				raise wave.Error("bad ds64 chunk")
+			data_size64 = struct.unpack("<Q", ds64[8:16])[0]
+
+		# Chunks are aligned to 2 bytes
+		position = position + chunk_size + (chunk_size & 1)
+		fp.seek(position)
+
+	if (fmt is None or len(fmt) < 16):
+		raise wave.Error("fmt chunk not found")
+
+	format_tag, n_channels, sample_rate, _, block_align, bits_per_sample = struct.unpack("<HHIIHH", fmt[0:16])
+
+	# Extensible format: the real format tag is at the start of the subformat GUID
+	if (format_tag == WAVE_FORMAT_EXTENSIBLE):
+		if (len(fmt) < 26):
+			raise wave.Error("bad extensible fmt chunk")
+		format_tag = struct.unpack("<H", fmt[24:26])[0]
+
+	if (n_channels == 0 or block_align == 0 or block_align % n_channels != 0):
+		raise wave.Error("bad fmt chunk")
+
+	width = block_align / n_channels # Bytes per sample
+	if not ((format_tag == WAVE_FORMAT_PCM and width in (1, 2, 3, 4)) or
+			(format_tag == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8))):
+		raise wave.Error("unsupported format: %d, %d bits" % (format_tag, bits_per_sample))
+
+	# The data chunk size may be wrong in files which were not closed properly
+	# (or over 4 GB without being RF64 files)
+	if (chunk_size == MAX_RIFF_SIZE):
+		chunk_size = file_size - position
+	data_size = min(chunk_size, file_size - position)
+
+	return WavInfo(format_tag, n_channels, sample_rate, bits_per_sample, block_align,
+		position, data_size / block_align)
+
+
+#*******************************************************************************#
+#	Function framesToSamples: This converts raw .wav frames into samples        #
+#	scaled to 16 bits.                                                          #
+#	Input: Raw frames (string) and WavInfo of the file                          #
+#	Output: Samples array (frames x channels, signed 16 bits integers)          #
+#*******************************************************************************#
+
+def framesToSamples(data, info):
+	"""Returns the samples of some raw frames, scaled to 16 bits, in an
+	array with a row per frame and a column per channel.
+
+	Parameters: Raw frames (string or buffer, or rows of the array of
+	mapWav) and WavInfo of the file.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	width = info.block_align / info.n_channels
+
+	if (info.format_tag == WAVE_FORMAT_IEEE_FLOAT):
+		values = np.frombuffer(data, "<f%d" % width)
+		samples = np.clip(np.round(values * 32768.0), -32768, 32767).astype(np.int16)
+	elif (width == 1):
+		# 8 bits samples are unsigned
+		samples = (np.frombuffer(data, np.uint8).astype(np.int16) - 128) << 8
+	elif (width == 2):
+		samples = np.frombuffer(data, "<i2").astype(np.int16)
+	elif (width == 3):
+		# We keep the two most significant bytes of every 24 bits sample
+		raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+		samples = np.ascontiguousarray(raw[:, 1:3]).view("<i2").ravel().astype(np.int16)
+	else:
+		samples = (np.frombuffer(data, "<i4") >> 16).astype(np.int16)
+
+	return samples.reshape(-1, info.n_channels)
+
+
+#*******************************************************************************#
+#	Function readChunks: This reads the samples of a .wav file in big chunks.   #
+#	Input: Input audio file, number of frames per chunk (optional)              #
+#	Output: Generator of samples arrays (frames x channels, 16 bits)            #
+#*******************************************************************************#
+
+def readChunks(filename, chunk_frames=CHUNK_FRAMES):
+	"""Yields the samples of a .wav file, scaled to 16 bits, in arrays
+	of chunk_frames frames (the last one may be shorter).
+
+	Parameters: Input audio file, number of frames per chunk (optional).
+
+	Exceptions: This function will throw a wave.Error if the file is not a
+	supported .wav file.
+
+	"""
+
+	frames, info = mapWav(filename)
+	for start in range(0, info.n_frames, chunk_frames):
+		yield framesToSamples(frames[start:start + chunk_frames], info)
+
+
+#*******************************************************************************#
+#	Function readWav: This reads all the samples (every channel) of a .wav      #
+#	file.                                                                       #
+#	Input: Input audio file                                                     #
+#	Output: Samples array (frames x channels, 16 bits) and WavInfo of the file  #
+#*******************************************************************************#
+
+def readWav(filename, mapped=False):
+	"""Returns all the samples of a .wav file, scaled to 16 bits, in an
+	array with a row per frame and a column per channel, and its WavInfo
+	(sample rate, number of channels...).
+
+	With mapped=True, the samples of 16 bits PCM files are not read: the
+	array is a read-only view of the file (see mapWav), so they take no
+	memory of their own. The other files are read as usual.
+
+	Parameters: Input audio file, whether 16 bits PCM files are mapped.
+
+	Exceptions: This function will throw a wave.Error if the file is not a
+	supported .wav file.
+
+	"""
+
+	if mapped:
+		frames, info = mapWav(filename)
+		if (frames.dtype == np.dtype("<i2")):
+			return frames, info
+
+	fp = open(filename, "rb")
+	info = getWavInfo(fp)
+	fp.close()
+
+	samples = np.zeros((info.n_frames, info.n_channels), np.int16)
+
+	s = 0 # Frame counter
+	for chunk in readChunks(filename):
+		samples[s:s + len(chunk)] = chunk
+		s = s + len(chunk)
+
+	return samples[0:s], info
+
+
+#*******************************************************************************#
+#	Function mapWav: This maps the samples of a .wav file into memory, without  #
+#	reading them.                                                               #
+#	Input: Input audio file                                                     #
+#	Output: Frames array (a view of the file) and WavInfo of the file           #
+#*******************************************************************************#
+
+def mapWav(filename):
+	"""Returns a read-only view (numpy.memmap) of the data chunk of a .wav
+	file, typed as its samples are stored, and its WavInfo. The pages of
+	the file are only read when the samples are used, and the system can
+	drop them again, so the memory taken does not depend on the file size.
+
+	The array has a row per frame and a column per channel, of unsigned
+	bytes (8 bits), little endian integers (16 and 32 bits) or floats. 24
+	bits samples have a third dimension with their 3 bytes. framesToSamples
+	scales any rows of it to 16 bits.
+
+	Parameters: Input audio file.
+
+	Exceptions: This function will throw a wave.Error if the file is not a
+	supported .wav file.
+
+	"""
+
+	fp = open(filename, "rb")
+	try:
+		info = getWavInfo(fp)
+	finally:
+		fp.close()
+
+	width = info.block_align / info.n_channels
+	shape = (info.n_frames, info.n_channels)
+	if (info.format_tag == WAVE_FORMAT_IEEE_FLOAT):
+		dtype = "<f%d" % width
+	elif (width == 3):
+		dtype, shape = np.uint8, shape + (3,)
+	else:
+		dtype = {1: np.uint8, 2: "<i2", 4: "<i4"}[width]
+
+	if (info.n_frames == 0):
+		return np.zeros(shape, dtype), info # Nothing to map
+
+	return np.memmap(filename, dtype, "r", info.data_offset, shape), info
+
+
+#*******************************************************************************#
+#	Function getWavHeader: This builds the header of a 16 bits PCM .wav file,   #
+#	everything before its samples.                                              #
+#	Input: Number of frames, number of channels and sample rate                 #
+#	Output: Header (string)                                                     #
+#*******************************************************************************#
+
+def getWavHeader(n_frames, n_channels=1, sample_rate=48000):
+	"""Returns the header of a .wav file of n_frames frames of signed 16
+	bits samples, so the samples only have to be written after it. Files
+	whose data is over 4 GB get an RF64 header: their sizes are in a ds64
+	chunk (64 bits) and the 32 bits ones are 0xFFFFFFFF.
+
+	Parameters: Number of frames, number of channels and sample rate (Hz).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	block_align = 2 * n_channels
+	data_size = n_frames * block_align
+	fmt = struct.pack("<4sIHHIIHH", "fmt ", 16, WAVE_FORMAT_PCM, n_channels, sample_rate,
+		sample_rate * block_align, block_align, 16)
+
+	if (36 + data_size <= MAX_RIFF_SIZE):
+		header = "RIFF" + struct.pack("<I", 36 + data_size) + "WAVE" + fmt
+		return header + struct.pack("<4sI", "data", data_size)
+
+	riff_size = 72 + data_size
+	header = "RF64" + struct.pack("<I", MAX_RIFF_SIZE) + "WAVE"
+	header = header + struct.pack("<4sIQQQI", "ds64", 28, riff_size, data_size, n_frames, 0) + fmt
+	return header + struct.pack("<4sI", "data", MAX_RIFF_SIZE)
+
+
+#*******************************************************************************#
+#	Function createWav: This creates a 16 bits PCM .wav file of a given length  #
+#	and maps its samples, so they are written in place.                         #
+#	Input: Output audio file, number of frames, number of channels and sample   #
+#	rate                                                                        #
+#	Output: Frames array (a writable view of the file)                          #
+#*******************************************************************************#
+
+def createWav(filename, n_frames, n_channels=1, sample_rate=48000):
+	"""Creates a .wav file with room for n_frames frames of signed 16 bits
+	samples (silence until they are written) and returns a writable view
+	(numpy.memmap) of them, with a row per frame and a column per channel.
+	The samples are in the file when the view is flushed or deleted.
+	Files whose data is over 4 GB are RF64 files (see getWavHeader).
+
+	Parameters: Output audio file, number of frames, number of channels and
+	sample rate (Hz).
+
+	Exceptions: This function will throw an exception if the file can not
+	be written.
+
+	"""
+
+	header = getWavHeader(n_frames, n_channels, sample_rate)
+	fp = open(filename, "wb")
+	try:
+		fp.write(header)
+		fp.truncate(len(header) + 2 * n_frames * n_channels) # The samples, not written yet
+	finally:
+		fp.close()
+
+	if (n_frames == 0):
+		return np.zeros((0, n_channels), "<i2")
+
+	return np.memmap(filename, "<i2", "r+", len(header), (n_frames, n_channels))
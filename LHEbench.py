@@ -0,0 +1,379 @@
+"""
+
+Benchmarks of the codec. Every stage (reading, quantizer, dynamic
+compressor, Huffman coder, decoders) and the whole encoder and decoder run
+on the audios of input_audio and on generated signals (sine, noise,
+silence, clipped and speech-like) of several durations:
+
+  python LHEbench.py -o bench.json
+  python LHEbench.py --durations 1 --baseline bench.json
+
+The results (samples per second, peak memory and bytes per second of audio)
+are saved as JSON, and a run can be compared with a saved one: stages which
+got slower, use more memory or give bigger files are flagged.
+
+"""
+# LHE Codec for Audio
+
+import argparse, glob, json, multiprocessing, os, platform, resource, shutil
+import sys, tempfile, time, wave
+import numpy as np
+
+import Auxiliary.huff as huff
+import Auxiliary.rangecoder as rangecoder
+import Auxiliary.wavio as wavio
+from LHEquantizer import getSamples, getHops, getHopTable, getThresholdTable
+from binary_enc import getSymbols, writeFile
+from binary_dec import getSymbolsList
+from audio_dec import hopsToSamples, SAMPLE_RATE
+from LHEcodec import encode_bytes, decode_bytes, encodeStream
+from LHEframes import encodeFrames, decodeFrames
+
+BENCH_VERSION = 1 # Version of the JSON results
+
+SIGNALS = ["sine", "noise", "silence", "clipped", "speech"]
+DURATIONS = [1, 10] # Seconds of the generated signals
+STAGES = ["getSamples", "getHops", "getHops-threshold", "getSymbols", "huffman-encode",
+	"huffman-decode", "range-decode", "getSymbolsList", "hopsToSamples", "encode", "decode",
+	"decode-range", "encodeStream", "frames"]
+TOLERANCE = 0.10 # Relative change flagged as a regression
+
+# -------------------#
+# GENERATED SIGNALS  #
+# -------------------#
+
+#*******************************************************************************#
+#	Function makeSignal: This generates a test signal. They are always the      #
+#	same ones (the random ones have a fixed seed).                              #
+#	Input: Signal name (one of SIGNALS), duration in seconds, sample rate       #
+#	(optional)                                                                  #
+#	Output: Samples array (signed 16 bits integers)                             #
+#*******************************************************************************#
+
+def makeSignal(name, seconds, sample_rate=SAMPLE_RATE):
+	"""Returns the samples of a generated signal: a 440 Hz sine ("sine"),
+	white noise ("noise"), zeros ("silence"), a sine clipped at full scale
+	("clipped") or a voice-like signal with pitch, syllables and pauses
+	("speech").
+
+	Parameters: Signal name (one of SIGNALS), duration in seconds, sample
+	rate (Hz).
+
+	Exceptions: This function will throw a ValueError if the signal is
+	unknown.
+
+	"""
+
+	n = int(seconds * sample_rate)
+	t = np.arange(n) / float(sample_rate)
+	rand = np.random.RandomState(1234)
+
+	if (name == "sine"):
+		values = 0.5 * np.sin(2 * np.pi * 440 * t)
+	elif (name == "noise"):
+		values = 0.2 * rand.standard_normal(n)
+	elif (name == "silence"):
+		values = np.zeros(n)
+	elif (name == "clipped"):
+		values = 2.0 * np.sin(2 * np.pi * 440 * t)
+	elif (name == "speech"):
+		# Harmonics of a pitch which moves around 120 Hz, with 4 syllables per
+		# second, a pause every second and some breath noise
+		pitch = 120 + 20 * np.sin(2 * np.pi * 0.7 * t)
+		phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+		voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+		envelope = np.maximum(np.sin(2 * np.pi * 2 * t), 0) ** 2 * (np.fmod(t, 1.0) < 0.75)
+		values = 0.3 * envelope * voice + 0.005 * rand.standard_normal(n)
+	else:
+		raise ValueError("unknown signal: %s" % name)
+
+	return np.clip(np.round(values * 32767), -32768, 32767).astype(np.int16)
+
+
+def _writeWav(filename, samples, sample_rate=SAMPLE_RATE):
+	"""Writes a mono 16 bits .wav file."""
+
+	output = wave.open(filename, "wb")
+	output.setparams((1, 2, sample_rate, 0, "NONE", "not compressed"))
+	output.writeframes(samples.astype("<i2").tostring())
+	output.close()
+
+
+# -------#
+# STAGES #
+# -------#
+
+def _prepare(samples, stage, tmp):
+	"""Returns a function which runs a stage once, with everything it needs
+	already computed. It returns the number of bytes the stage writes, or
+	None if it writes nothing."""
+
+	samples = np.asarray(samples, np.int16)
+	wav_file = os.path.join(tmp, "input.wav")
+	lhe_file = os.path.join(tmp, "output.lhe")
+	_writeWav(wav_file, samples)
+	pcm = samples.astype("<i2").tostring()
+	lhe = None
+	if (stage == "decode"):
+		lhe = encode_bytes(pcm)
+	elif (stage == "decode-range"):
+		lhe = encode_bytes(pcm, coder="range")
+
+	# Inputs of the stages in the middle of the codec
+	values, n, max_sample, min_sample = getSamples(wav_file)
+	first_amp = values[0] if n else 0
+	hops = sym = payload = None
+	if (stage in ("getSymbols", "hopsToSamples", "huffman-encode", "huffman-decode", "range-decode", "getSymbolsList")):
+		hops, result = getHops(values, n, max_sample, min_sample)
+		sym = getSymbols(hops)
+		payload = huff.encode(sym)[0] if len(sym) else ""
+		if (stage == "range-decode"):
+			payload = rangecoder.encode(sym)[0]
+		writeFile(sym, first_amp, n, max_sample, min_sample, lhe_file)
+
+	def run():
+		if (stage == "getSamples"):
+			getSamples(wav_file)
+		elif (stage == "getHops"):
+			getHops(values, n, max_sample, min_sample, "exhaustive")
+		elif (stage == "getHops-threshold"):
+			getHops(values, n, max_sample, min_sample, "threshold")
+		elif (stage == "getSymbols"):
+			getSymbols(hops)
+		elif (stage == "huffman-encode"):
+			return len(huff.encode(sym)[0]) if len(sym) else 0
+		elif (stage == "huffman-decode"):
+			dec = huff.Decoder()
+			dec.loads(payload)
+			dec.decode()
+		elif (stage == "range-decode"):
+			dec = rangecoder.Decoder()
+			dec.loads(payload)
+			dec.decode()
+		elif (stage == "getSymbolsList"):
+			getSymbolsList(lhe_file, len(sym), n)
+		elif (stage == "hopsToSamples"):
+			hopsToSamples(hops, first_amp, n, max_sample, min_sample)
+		elif (stage == "encode"):
+			return len(encode_bytes(pcm))
+		elif (stage == "decode" or stage == "decode-range"):
+			decode_bytes(lhe)
+		elif (stage == "encodeStream"):
+			stream_file = os.path.join(tmp, "stream.lhe")
+			encodeStream(wav_file, stream_file)
+			return os.path.getsize(stream_file)
+		elif (stage == "frames"):
+			stream = encodeFrames(pcm)
+			decodeFrames(stream)
+			return len(stream)
+		return None
+
+	if (stage not in STAGES):
+		raise ValueError("unknown stage: %s" % stage)
+	return run
+
+
+def _maxRss():
+	"""Returns the peak memory (resident set size, KB) of this process."""
+
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss / 1024 if sys.platform == "darwin" else rss # Bytes in macOS
+
+
+def _runCase(conn, signal, seconds, stage, repeat):
+	"""Runs a benchmark case in this (new) process and sends its result."""
+
+	tmp = tempfile.mkdtemp(prefix="lhebench")
+	try:
+		if (signal in SIGNALS):
+			samples, sample_rate = makeSignal(signal, seconds), SAMPLE_RATE
+		else:
+			samples, info = wavio.readWav(signal) # An audio file (its first channel)
+			samples, sample_rate = samples[:, 0], info.sample_rate
+		run = _prepare(samples, stage, tmp)
+
+		rss_before = _maxRss()
+		times, out_bytes = [], None
+		for k in range(0, repeat):
+			start = time.time()
+			out_bytes = run()
+			times.append(time.time() - start)
+
+		conn.send({"times": times, "bytes": out_bytes, "samples": len(samples), "sample_rate": sample_rate,
+			"peak_rss_kb": _maxRss(), "rss_increase_kb": _maxRss() - rss_before})
+	except Exception as e:
+		conn.send({"error": "%s: %s" % (type(e).__name__, e)})
+	finally:
+		shutil.rmtree(tmp, True)
+		conn.close()
+
+
+#*******************************************************************************#
+#	Function runCase: This runs a benchmark case (a stage over a signal) in a   #
+#	new process, so its peak memory is its own.                                 #
+#	Input: Signal name or audio file, duration of generated signals, stage and  #
+#	number of runs                                                              #
+#	Output: Result dictionary                                                   #
+#*******************************************************************************#
+
+def runCase(signal, seconds, stage, repeat=3):
+	"""Returns the result of a stage over a signal: number of samples, best
+	and median time of repeat runs, samples per second, peak memory and
+	its increase during the stage (KB), and bytes written per second of
+	audio (None if the stage writes nothing).
+
+	Parameters: Generated signal name (one of SIGNALS) or audio file,
+	seconds of generated signals, stage (one of STAGES) and number of runs.
+
+	Exceptions: This function will throw a RuntimeError if the case fails.
+
+	"""
+
+	parent, child = multiprocessing.Pipe(False)
+	process = multiprocessing.Process(target=_runCase, args=(child, signal, seconds, stage, repeat))
+	process.start()
+	child.close()
+	try:
+		data = parent.recv()
+	except EOFError:
+		data = {"error": "the benchmark process died"}
+	process.join()
+
+	if ("error" in data):
+		raise RuntimeError("%s, %s: %s" % (signal, stage, data["error"]))
+
+	times = sorted(data["times"])
+	best = max(times[0], 1e-9)
+	audio_seconds = data["samples"] / float(data["sample_rate"])
+	name = signal if signal in SIGNALS else os.path.basename(signal)
+
+	return {"signal": name, "seconds": seconds if signal in SIGNALS else round(audio_seconds, 3),
+		"stage": stage, "samples": data["samples"], "best_s": best, "median_s": times[len(times) / 2],
+		"samples_per_sec": data["samples"] / best, "peak_rss_kb": data["peak_rss_kb"],
+		"rss_increase_kb": data["rss_increase_kb"],
+		"bytes_per_audio_sec": (data["bytes"] / audio_seconds
+			if data["bytes"] is not None and audio_seconds > 0 else None)}
+
+
+# ------------#
+# COMPARISON  #
+# ------------#
+
+def _key(result):
+	return (result["signal"], result["seconds"], result["stage"])
+
+
+#*******************************************************************************#
+#	Function compareResults: This compares a benchmark run with a baseline one. #
+#	Input: Results and baseline results (lists of dictionaries), tolerance      #
+#	Output: List of regressions (strings)                                       #
+#*******************************************************************************#
+
+def compareResults(results, baseline, tolerance=TOLERANCE):
+	"""Returns the regressions of some results against a baseline: cases
+	with fewer samples per second, a higher peak memory or more bytes per
+	second of audio than the baseline, beyond the given relative tolerance.
+
+	Parameters: Results and baseline results (as runCase returns them) and
+	tolerance (0.1 is 10%).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	base = dict((_key(result), result) for result in baseline)
+	regressions = []
+
+	for result in results:
+		old = base.get(_key(result))
+		if (old is None):
+			continue
+		name = "%s (%s s), %s" % _key(result)
+		if (result["samples_per_sec"] < old["samples_per_sec"] * (1 - tolerance)):
+			regressions.append("%s: %.0f samples/s, %.0f in the baseline" % (name,
+				result["samples_per_sec"], old["samples_per_sec"]))
+		if (result["peak_rss_kb"] > old["peak_rss_kb"] * (1 + tolerance)):
+			regressions.append("%s: %d KB peak memory, %d KB in the baseline" % (name,
+				result["peak_rss_kb"], old["peak_rss_kb"]))
+		if (result["bytes_per_audio_sec"] is not None and old.get("bytes_per_audio_sec") is not None
+				and result["bytes_per_audio_sec"] > old["bytes_per_audio_sec"] * (1 + tolerance)):
+			regressions.append("%s: %.0f bytes/s of audio, %.0f in the baseline" % (name,
+				result["bytes_per_audio_sec"], old["bytes_per_audio_sec"]))
+
+	return regressions
+
+
+# -------------#
+# COMMAND LINE #
+# -------------#
+
+def main(argv=None):
+	"""Runs the benchmarks of the command line, prints a line per case,
+	saves the results (JSON) and compares them with a baseline. Returns 1
+	if a case failed or regressed, 0 otherwise."""
+
+	parser = argparse.ArgumentParser(prog="LHEbench.py", description="LHE codec benchmarks.")
+	parser.add_argument("--signals", nargs="+", choices=SIGNALS, default=SIGNALS)
+	parser.add_argument("--durations", nargs="+", type=float, default=DURATIONS,
+		help="seconds of the generated signals")
+	parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+	parser.add_argument("--fixtures", nargs="*", default=None,
+		help="audio files (input_audio/*.wav by default)")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of every case (the best one counts)")
+	parser.add_argument("-o", "--output", help="JSON file for the results")
+	parser.add_argument("--baseline", help="JSON results to compare with")
+	parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+		help="relative change flagged as a regression")
+	args = parser.parse_args(argv)
+
+	fixtures = args.fixtures
+	if (fixtures is None):
+		fixtures = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "input_audio", "*.wav")))
+
+	# Tables are built once, not inside the first case
+	getHopTable()
+	getThresholdTable()
+
+	cases = [(signal, seconds) for signal in args.signals for seconds in args.durations]
+	cases = cases + [(filename, None) for filename in fixtures]
+
+	results, failed = [], 0
+	for signal, seconds in cases:
+		for stage in args.stages:
+			try:
+				result = runCase(signal, seconds, stage, args.repeat)
+			except RuntimeError as e:
+				print "FAILED", e
+				failed = failed + 1
+				continue
+			results.append(result)
+			print "%-12s %8s s  %-18s %12.0f samples/s %8d KB peak %8s bytes/s" % (result["signal"],
+				result["seconds"], stage, result["samples_per_sec"], result["peak_rss_kb"],
+				"-" if result["bytes_per_audio_sec"] is None else "%.0f" % result["bytes_per_audio_sec"])
+			sys.stdout.flush()
+
+	report = {"version": BENCH_VERSION, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"python": platform.python_version(), "numpy": np.__version__,
+		"platform": platform.platform(), "cpu_count": multiprocessing.cpu_count(),
+		"repeat": args.repeat, "results": results}
+
+	if (args.output):
+		fp = open(args.output, "w")
+		json.dump(report, fp, indent=1, sort_keys=True)
+		fp.close()
+
+	regressions = []
+	if (args.baseline):
+		fp = open(args.baseline)
+		baseline = json.load(fp)
+		fp.close()
+		regressions = compareResults(results, baseline["results"], args.tolerance)
+		for regression in regressions:
+			print "REGRESSION", regression
+		print "%d regressions against %s" % (len(regressions), args.baseline)
+
+	return int(failed > 0 or len(regressions) > 0)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+
+This module keeps the .lhe files of the audios already encoded in a
+directory, so an audio encoded again with the same options (a retry, the
+same file delivered twice...) is not encoded again:
+
+  cache = EncodeCache("lhe_cache", max_bytes=1 << 30)
+  lhe = encode_bytes(pcm, coder="range", cache=cache)
+  print cache.as_dict()["hits"]
+
+Every .lhe file is saved under the hash of its samples, every option which
+changes the file and CODEC_VERSION, so a file is never given for another
+audio, other options or another encoder. When the files take more than
+max_bytes, the least recently used ones are removed.
+
+Several processes (or machines, on a shared disk) can use the same
+directory: a file is written under a temporary name and renamed, so it is
+complete or not there at all, and files removed by another process are
+just misses.
+
+"""
+# LHE Codec for Audio
+
+import errno, hashlib, json, os, tempfile, threading, time
+
+CACHE_SIZE = 1 << 30 # Default size of the cache directory (bytes)
+CODEC_VERSION = 1 # Version of the .lhe files: a new one when the encoder gives other files for the same options
+EXTENSION = ".lhe"
+STALE_SECONDS = 3600 # Age of the temporary files of the processes which died while writing them
+
+
+class EncodeCache(object):
+	"""Directory of .lhe files by their key (see key, get and put).
+
+	hits, misses, writes and evictions count what this object did (not the
+	other processes which share the directory).
+
+	"""
+
+	def __init__(self, directory, max_bytes=CACHE_SIZE):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self.writes = 0
+		self.evictions = 0
+		self._size = None # Bytes of the directory, known after the first scan
+		self._lock = threading.Lock()
+		if not os.path.isdir(directory):
+			try:
+				os.makedirs(directory)
+			except OSError as e:
+				if (e.errno != errno.EEXIST): # Another process made it
+					raise
+
+	def key(self, pcm, **options):
+		"""Returns the key (hexadecimal SHA-256) of some samples (string or
+		any buffer, such as a numpy array, which is not copied) encoded with
+		the given options (numbers, strings or None)."""
+
+		digest = hashlib.sha256()
+		digest.update(json.dumps({"version": CODEC_VERSION, "options": options}, sort_keys=True))
+		digest.update("\0")
+		digest.update(buffer(pcm))
+		return digest.hexdigest()
+
+	def _path(self, key):
+		# Two levels, so a directory never has too many files
+		return os.path.join(self.directory, key[0:2], key + EXTENSION)
+
+	def get(self, key):
+		"""Returns the .lhe file content of a key, or None if it is not in
+		the cache. The file becomes the most recently used one."""
+
+		path = self._path(key)
+		try:
+			fp = open(path, "rb")
+		except IOError as e:
+			if (e.errno != errno.ENOENT):
+				raise
+			with self._lock:
+				self.misses += 1
+			return None
+
+		try:
+			data = fp.read()
+		finally:
+			fp.close()
+		try:
+			os.utime(path, None) # Its modification time is its last use
+		except OSError:
+			pass # Removed in the meantime, the content is right anyway
+
+		with self._lock:
+			self.hits += 1
+		return data
+
+	def put(self, key, data):
+		"""Saves the .lhe file content of a key, then removes the least
+		recently used files if the cache is over max_bytes."""
+
+		path = self._path(key)
+		folder = os.path.dirname(path)
+		if not os.path.isdir(folder):
+			try:
+				os.mkdir(folder)
+			except OSError as e:
+				if (e.errno != errno.EEXIST):
+					raise
+
+		# Written under a temporary name, so nobody reads a half file
+		handle, temporary = tempfile.mkstemp(EXTENSION + ".tmp", "", folder)
+		try:
+			fp = os.fdopen(handle, "wb")
+			try:
+				fp.write(data)
+			finally:
+				fp.close()
+			try:
+				os.rename(temporary, path)
+			except OSError:
+				if not os.path.exists(path): # Windows does not replace files
+					raise
+		finally:
+			if os.path.exists(temporary): # Not renamed (the same content was there)
+				os.remove(temporary)
+
+		with self._lock:
+			self.writes += 1
+			if (self._size is not None):
+				self._size += len(data)
+			full = (self._size is None or self._size > self.max_bytes)
+		if full:
+			self.evict()
+
+	def evict(self):
+		"""Removes the least recently used files until the cache is not
+		over max_bytes, and returns the number of bytes it takes."""
+
+		entries = []
+		for folder, names, files in os.walk(self.directory):
+			for name in files:
+				path = os.path.join(folder, name)
+				try:
+					info = os.stat(path)
+				except OSError:
+					continue # Removed in the meantime
+				if name.endswith(EXTENSION):
+					entries.append((info.st_mtime, info.st_size, path))
+				elif (time.time() - info.st_mtime > STALE_SECONDS):
+					try:
+						os.remove(path) # Left by a process which died while writing it
+					except OSError:
+						pass
+
+		size = sum(entry[1] for entry in entries)
+		evictions = 0
+		for mtime, file_size, path in sorted(entries):
+			if (size <= self.max_bytes):
+				break
+			try:
+				os.remove(path)
+				evictions += 1
+			except OSError:
+				pass # Removed by another process
+			size -= file_size
+
+		with self._lock:
+			self._size = size
+			self.evictions += evictions
+		return size
+
+	def as_dict(self):
+		"""Returns the counters and the hit rate (hits over lookups)."""
+
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {"hits": self.hits, "misses": self.misses, "writes": self.writes,
+				"evictions": self.evictions, "hit_rate": float(self.hits) / lookups if lookups else 0.0}
@@ -0,0 +1,453 @@
+"""
+
+Command line program of the codec. It encodes, decodes, describes and
+verifies many files at once, in parallel:
+
+  python LHEcli.py encode "input_audio/*.wav" -o output_lhe --jobs 8
+  python LHEcli.py encode input_audio/*.wav --stats stats.jsonl
+  python LHEcli.py encode input_audio/*.wav --bitrate 128
+  python LHEcli.py encode input_audio/*.wav --bitrate 128 --strict-bitrate
+  python LHEcli.py encode input_audio/*.wav --cache lhe_cache
+  python LHEcli.py decode output_lhe/*.lhe -o output_lhe/audio
+  python LHEcli.py info output_lhe/*.lhe
+  python LHEcli.py verify input_audio/*.wav output_lhe/*.lhe
+
+"""
+# LHE Codec for Audio
+
+import argparse, glob, multiprocessing, os, struct, sys, time, warnings
+from concurrent import futures
+
+import Auxiliary.huff as huff
+import Auxiliary.rangecoder as rangecoder
+import Auxiliary.wavio as wavio
+from Auxiliary.metrics import QualityMeter
+from LHEquantizer import getHopTable, getThresholdTable, QUANTIZERS
+from binary_enc import LHE_BASIC, LHE_BLOCKS, LHE_CHANNELS, LHE_RATE_BLOCKS, LHE_FRAMES, CODERS, STATIC_TABLE_NAMES
+from binary_dec import readData, readBlocks, readChannels, readFrames
+from LHEcodec import encodeWav, decodeWav, encodeChannels, decodeChannels, decode_bytes
+from LHEstats import CodecStats
+from LHEcache import EncodeCache, CACHE_SIZE
+
+DECODED_EXTENSION = ".wav" # Extension of the decoded audios (see outputName)
+
+# Names of the entropy coders, by the first byte of their payload
+PAYLOAD_CODERS = {
+	huff.CANONICAL: "huffman",
+	huff.LEGACY: "huffman (legacy header)",
+	huff.CONTEXT: "huffman-context",
+	huff.STATIC: "huffman-static",
+	rangecoder.RANGE: "range",
+	rangecoder.CONTEXT: "range-context"}
+
+LHE_TYPES = {LHE_BASIC: "basic", LHE_BLOCKS: "blocks", LHE_CHANNELS: "channels",
+	LHE_RATE_BLOCKS: "rate blocks", LHE_FRAMES: "frames"}
+
+# ------------#
+# FILE TASKS  #
+# ------------#
+
+# Every task works on a single file and returns a short report of it. They
+# run in the processes of the pool, so they must be module functions.
+
+def _encodeTask(filename, lhe_file, quantizer, block_size, coder, stats_file=None, bitrate=None, cache_dir=None, cache_size=CACHE_SIZE, strict=False):
+	"""Encodes a .wav file into lhe_file (at the target bitrate, if any) and
+	returns a report. If a stats file is given, the stats of the encode are
+	appended to it (a JSON line, written at once, so several processes can
+	share the file). If a cache directory is given, the .lhe file is taken
+	from it when the same audio was encoded with the same options. A file
+	over the bitrate is reported, or fails (and is not written) if strict
+	is set."""
+
+	stats = CodecStats() if stats_file is not None else None
+	cache = EncodeCache(cache_dir, cache_size) if cache_dir is not None else None
+	with warnings.catch_warnings(record=True) as caught:
+		warnings.simplefilter("always", RuntimeWarning)
+		encodeWav(filename, lhe_file, quantizer, block_size, 1, coder, bitrate, stats=stats, cache=cache, strict=strict)
+	if (stats is not None):
+		stats.writeJsonLine(stats_file, file=filename, lhe_file=lhe_file,
+			quantizer=quantizer, block_size=block_size, coder=coder, bitrate=bitrate)
+	report = "%d bytes -> %d bytes" % (os.path.getsize(filename), os.path.getsize(lhe_file))
+	for warning in caught:
+		report = "%s, %s" % (report, warning.message)
+	return report + " (cached)" if (cache is not None and cache.hits > 0) else report
+
+
+def _decodeTask(lhe_file, filename):
+	"""Decodes a .lhe file into filename and returns a report."""
+
+	decodeWav(lhe_file, filename, 1)
+	return "%d bytes -> %d bytes" % (os.path.getsize(lhe_file), os.path.getsize(filename))
+
+
+def _infoTask(lhe_file):
+	"""Returns the description of a .lhe file."""
+
+	fp = open(lhe_file, "rb")
+	data = fp.read()
+	fp.close()
+
+	return describe(data)
+
+
+def _verifyTask(filename, quantizer, block_size, coder, min_psnr, bitrate=None):
+	"""Checks a .wav file (encoded and decoded in memory) or a .lhe file
+	(decoded) and returns a report. Raises a ValueError if the check fails."""
+
+	if (os.path.splitext(filename)[1].lower() == ".lhe"):
+		fp = open(filename, "rb")
+		data = fp.read()
+		fp.close()
+		n_samples, n_channels = _samplesOf(data)
+		pcm = decode_bytes(data)
+		if (len(pcm) != 2 * n_samples * n_channels):
+			raise ValueError("%d samples decoded, %d expected" % (len(pcm) / 2, n_samples * n_channels))
+		return "decodes, %d samples x %d channels" % (n_samples, n_channels)
+
+	samples, info = wavio.readWav(filename)
+	channels = encodeChannels(samples, quantizer, block_size, 1, coder, bitrate, info.sample_rate)
+	decoded = decodeChannels(channels, len(samples), 1)
+	if (decoded.shape != samples.shape):
+		raise ValueError("decoded shape %s, %s expected" % (decoded.shape, samples.shape))
+
+	meter = QualityMeter()
+	meter.update(decoded, samples)
+	psnr = meter.psnr()
+	if (min_psnr is not None and psnr < min_psnr):
+		raise ValueError("PSNR %.2f dB < %.2f dB" % (psnr, min_psnr))
+
+	size = sum(len(channel) for channel in channels)
+	return "PSNR %.2f dB, segmental SNR %.2f dB, max error %d, %.3f bits/sample" % (
+		psnr, meter.segmentalSNR(), meter.maxError(), 8.0 * size / max(samples.size, 1))
+
+
+def _timed(task, args):
+	"""Runs task(*args) and returns (report, seconds, error message)."""
+
+	start = time.time()
+	try:
+		return task(*args), time.time() - start, None
+	except Exception as e:
+		return None, time.time() - start, "%s: %s" % (type(e).__name__, e)
+
+
+# -------------#
+# DESCRIPTION  #
+# -------------#
+
+def _samplesOf(data):
+	"""Returns the number of samples per channel and the number of channels
+	of a .lhe file content."""
+
+	lhe_type = struct.unpack("B", data[0])[0]
+	if (lhe_type == LHE_CHANNELS):
+		n_samples, sample_rate, channels = readChannels(data)
+		return n_samples, len(channels)
+	if (lhe_type == LHE_BLOCKS or lhe_type == LHE_RATE_BLOCKS):
+		return readBlocks(data)[0], 1
+	if (lhe_type == LHE_FRAMES):
+		return sum(frame[0] for frame in readFrames(data)[2]), 1
+	return readData(data)[2], 1
+
+
+#*******************************************************************************#
+#	Function describe: This describes the content of a .lhe file: its type,     #
+#	number of channels and samples, sample rate, entropy coder and size.        #
+#	Input: .lhe file content                                                    #
+#	Output: Description (string)                                                #
+#*******************************************************************************#
+
+def describe(data):
+	"""Returns a line with the type, number of channels and samples, sample
+	rate, entropy coder and bits per sample of a .lhe file content.
+
+	Parameters: .lhe file content (string).
+
+	Exceptions: This will throw an exception if the content is not a .lhe
+	file.
+
+	"""
+
+	lhe_type = struct.unpack("B", data[0])[0]
+	sample_rate = None
+	inner = data # .lhe content of the first channel
+
+	if (lhe_type == LHE_CHANNELS):
+		n_samples, sample_rate, channels = readChannels(data)
+		n_channels = len(channels)
+		if (n_channels > 0):
+			inner = channels[0]
+	else:
+		n_channels = 1
+		n_samples = _samplesOf(data)[0]
+
+	inner_type = struct.unpack("B", inner[0])[0] if inner else LHE_BASIC
+	if (inner_type == LHE_BLOCKS or inner_type == LHE_RATE_BLOCKS):
+		blocks = readBlocks(inner)[4]
+		payload = blocks[0][2] if blocks else ""
+	elif (inner_type == LHE_FRAMES):
+		payload = huff.STATIC + chr(readFrames(inner)[1]) # Frames only keep their table
+	else:
+		payload = inner[21:]
+
+	coder = PAYLOAD_CODERS.get(payload[0:1], "none") if payload else "none"
+	if (payload[0:1] == huff.STATIC and len(payload) > 1):
+		table = ord(payload[1])
+		coder = "%s (table %s)" % (coder, STATIC_TABLE_NAMES[table] if table < len(STATIC_TABLE_NAMES) else table)
+	bits = 8.0 * len(data) / max(n_samples * n_channels, 1)
+
+	return "%s, %s, %d channels x %d samples, %s Hz, %s, %d bytes (%.3f bits/sample)" % (
+		LHE_TYPES.get(lhe_type, "unknown"), LHE_TYPES.get(inner_type, "unknown"), n_channels,
+		n_samples, sample_rate or "unknown", coder, len(data), bits)
+
+
+# ---------------#
+# BATCH RUNNER   #
+# ---------------#
+
+#*******************************************************************************#
+#	Function expandInputs: This expands the input files and glob patterns of    #
+#	the command line.                                                           #
+#	Input: Files and glob patterns                                              #
+#	Output: Files list (sorted, without repeated files) and patterns with no    #
+#	file                                                                        #
+#*******************************************************************************#
+
+def expandInputs(patterns):
+	"""Returns the files matched by some file names and glob patterns, in
+	order and without repeated files, and the patterns which matched no
+	file.
+
+	Parameters: File names and glob patterns (list of strings).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	files, missing, seen = [], [], set()
+
+	for pattern in patterns:
+		matches = sorted(glob.glob(pattern))
+		if (not matches and os.path.isfile(pattern)):
+			matches = [pattern] # File names with glob characters
+		if (not matches):
+			missing.append(pattern)
+		for filename in matches:
+			if (os.path.abspath(filename) not in seen):
+				seen.add(os.path.abspath(filename))
+				files.append(filename)
+
+	return files, missing
+
+
+def outputName(filename, output_dir, extension):
+	"""Returns the output file of an input file: the same name in output_dir
+	(its own directory if None) with the given extension. Decoded audios
+	written next to their .lhe file are named .dec.wav, so they are never
+	taken for the original .wav files."""
+
+	name = os.path.splitext(os.path.basename(filename))[0]
+	if (output_dir is None):
+		output_dir = os.path.dirname(filename)
+		if (extension == DECODED_EXTENSION):
+			extension = ".dec" + extension
+
+	return os.path.join(output_dir, name + extension)
+
+
+#*******************************************************************************#
+#	Function runTasks: This runs a task per file in a pool of processes and     #
+#	reports the progress and time of every file.                                #
+#	Input: Task function, (file, args) list, number of processes, output stream #
+#	Output: Number of failed files                                              #
+#*******************************************************************************#
+
+def runTasks(task, jobs_list, jobs=None, out=sys.stderr):
+	"""Runs task(*args) for every (filename, args) in jobs_list in a pool of
+	jobs processes (all the CPUs if None, this process if 1), writing a
+	line per file (progress, report or error, and seconds) as they finish
+	and a summary at the end. Returns the number of failed files.
+
+	Parameters: Task function, list of (file name, arguments tuple), number
+	of processes and stream for the progress lines.
+
+	Exceptions: This function does not throw an exception (the errors of
+	the files are reported).
+
+	"""
+
+	if (jobs is None):
+		jobs = multiprocessing.cpu_count()
+
+	start = time.time()
+	total, failed = len(jobs_list), 0
+
+	def report(done, filename, result):
+		text, seconds, error = result
+		out.write("[%d/%d] %s: %s (%.2f s)\n" % (done, total, filename,
+			text if error is None else "FAILED, " + error, seconds))
+		out.flush()
+
+	if (jobs <= 1 or total <= 1):
+		for done, (filename, args) in enumerate(jobs_list):
+			result = _timed(task, args)
+			failed = failed + (result[2] is not None)
+			report(done + 1, filename, result)
+	else:
+		# Workers get the tables already built and memory-mapped
+		getHopTable()
+		getThresholdTable()
+
+		pool = futures.ProcessPoolExecutor(max_workers=jobs)
+		try:
+			tasks = dict((pool.submit(_timed, task, args), filename) for filename, args in jobs_list)
+			for done, finished in enumerate(futures.as_completed(tasks)):
+				try:
+					result = finished.result()
+				except Exception as e: # The worker died
+					result = (None, 0.0, "%s: %s" % (type(e).__name__, e))
+				failed = failed + (result[2] is not None)
+				report(done + 1, tasks[finished], result)
+		finally:
+			pool.shutdown()
+
+	out.write("%d files, %d failed, %.2f s\n" % (total, failed, time.time() - start))
+	out.flush()
+	return failed
+
+
+# ---------------#
+# COMMAND LINE   #
+# ---------------#
+
+def _parser():
+	"""Returns the parser of the command line."""
+
+	parser = argparse.ArgumentParser(prog="LHEcli.py", description="LHE audio codec.")
+	commands = parser.add_subparsers(dest="command")
+
+	def files(command, help_text):
+		command.add_argument("inputs", nargs="+", metavar="FILE", help=help_text)
+		command.add_argument("-j", "--jobs", type=int, default=None,
+			help="number of processes (all the CPUs by default)")
+
+	def coding(command):
+		command.add_argument("-q", "--quantizer", choices=QUANTIZERS, default="exhaustive")
+		command.add_argument("-c", "--coder", choices=sorted(CODERS), default="huffman",
+			help="entropy coder (huffman by default); the range coders give smaller "
+			"files, but decode about 2 times slower (LHEbench decode-range stage)")
+		command.add_argument("-b", "--block-size", type=int, default=None,
+			help="samples per independent block (no blocks by default)")
+		command.add_argument("-r", "--bitrate", type=float, default=None, metavar="KBPS",
+			help="target bitrate in kbit/s, all the channels together (rate "
+			"controlled blocks, of 65536 samples by default)")
+
+	encode = commands.add_parser("encode", help="encode .wav files")
+	files(encode, ".wav files or glob patterns")
+	encode.add_argument("-f", "--force", action="store_true",
+		help="overwrite the .lhe files which already exist")
+	encode.add_argument("-o", "--output-dir", default=None,
+		help="directory of the .lhe files (the one of every input by default)")
+	encode.add_argument("--stats", default=None, metavar="FILE",
+		help="append the stats of every encode (time per stage, counters) to "
+		"a JSON lines file")
+	encode.add_argument("--cache", default=None, metavar="DIR",
+		help="take the .lhe files of the audios already encoded with the same "
+		"options from a directory, and save the new ones in it")
+	encode.add_argument("--cache-size", type=float, default=CACHE_SIZE / float(1 << 20), metavar="MB",
+		help="size of the cache directory, the least recently used files are "
+		"removed beyond it (%(default)d MB by default)")
+	encode.add_argument("--strict-bitrate", action="store_true",
+		help="fail the files whose bitrate is over --bitrate, even with the "
+		"coarsest hop1 interval (they are only reported by default)")
+	coding(encode)
+
+	decode = commands.add_parser("decode", help="decode .lhe files into .wav files")
+	files(decode, ".lhe files or glob patterns")
+	decode.add_argument("-f", "--force", action="store_true",
+		help="overwrite the .wav files which already exist")
+	decode.add_argument("-o", "--output-dir", default=None,
+		help="directory of the .wav files (the one of every input by default)")
+
+	info = commands.add_parser("info", help="describe .lhe files")
+	files(info, ".lhe files or glob patterns")
+
+	verify = commands.add_parser("verify", help="encode and decode .wav files in memory, "
+		"or check that .lhe files decode")
+	files(verify, ".wav or .lhe files or glob patterns")
+	coding(verify)
+	verify.add_argument("--min-psnr", type=float, default=None,
+		help="fail the .wav files whose PSNR (dB) is lower")
+
+	return parser
+
+
+#*******************************************************************************#
+#	Function main: This runs the command line program.                          #
+#	Input: Command line arguments (optional)                                    #
+#	Output: Exit status (0 if every file was processed)                         #
+#*******************************************************************************#
+
+def main(argv=None):
+	"""Runs a command (encode, decode, info or verify) over the files of
+	the command line and returns the exit status: 0 if every file was
+	processed, 1 otherwise.
+
+	Parameters: Command line arguments (sys.argv[1:] by default).
+
+	Exceptions: This function exits (SystemExit) if the arguments are
+	wrong.
+
+	"""
+
+	args = _parser().parse_args(argv)
+
+	inputs, missing = expandInputs(args.inputs)
+	for pattern in missing:
+		sys.stderr.write("%s: no such file\n" % pattern)
+
+	if (args.command == "encode" or args.command == "decode"):
+		extension = ".lhe" if args.command == "encode" else DECODED_EXTENSION
+		if (args.output_dir is not None and not os.path.isdir(args.output_dir)):
+			os.makedirs(args.output_dir)
+
+		# Two inputs with the same name would write the same output
+		outputs = {}
+		for filename in inputs:
+			output = outputName(filename, args.output_dir, extension)
+			if (os.path.abspath(output) in outputs):
+				sys.stderr.write("%s and %s would both write %s\n" % (outputs[os.path.abspath(output)], filename, output))
+				return 1
+			outputs[os.path.abspath(output)] = filename
+
+		# Existing files (such as the original audios) are only replaced on request
+		existing = [output for output in sorted(outputs) if os.path.exists(output)]
+		if (existing and not args.force):
+			for output in existing:
+				sys.stderr.write("%s already exists\n" % output)
+			sys.stderr.write("nothing written, use --force to overwrite the existing files\n")
+			return 1
+
+		if (args.command == "encode"):
+			jobs_list = [(filename, (filename, outputName(filename, args.output_dir, extension),
+				args.quantizer, args.block_size, args.coder, args.stats, args.bitrate,
+				args.cache, int(args.cache_size * (1 << 20)), args.strict_bitrate)) for filename in inputs]
+			failed = runTasks(_encodeTask, jobs_list, args.jobs)
+		else:
+			jobs_list = [(filename, (filename, outputName(filename, args.output_dir, extension)))
+				for filename in inputs]
+			failed = runTasks(_decodeTask, jobs_list, args.jobs)
+
+	elif (args.command == "info"):
+		failed = runTasks(_infoTask, [(filename, (filename,)) for filename in inputs], args.jobs, sys.stdout)
+
+	else:
+		jobs_list = [(filename, (filename, args.quantizer, args.block_size, args.coder, args.min_psnr, args.bitrate))
+			for filename in inputs]
+		failed = runTasks(_verifyTask, jobs_list, args.jobs)
+
+	return int(failed > 0 or len(missing) > 0)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
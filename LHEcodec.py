@@ -0,0 +1,1052 @@
+"""
+
+This module encodes and decodes whole audios: split in independent blocks,
+so the blocks can be processed in parallel, as a stream, so long audios
+can be encoded with little memory, or with all their channels, each one
+coded on its own.
+
+"""
+# LHE Codec for Audio
+
+import array, multiprocessing, struct, tempfile, warnings
+from concurrent import futures
+import numpy as np
+
+import Auxiliary.huff as huff
+import Auxiliary.wavio as wavio
+from LHEquantizer import getHops, getHopTable, getThresholdTable, scanSamples, iterSamples, iterHops, getHop1States, MAX_HOP1, MIN_HOP1, RATE_LEVELS
+from binary_enc import getSymbols, iterSymbols, encodeSymbols, estimateBits, buildFile, buildBlocksFile, writeBlocksFile, buildChannelsFile, writeChannelsFile, LHE_BASIC, LHE_BLOCKS, LHE_CHANNELS, LHE_RATE_BLOCKS, LHE_FRAMES, CODERS
+from binary_dec import getBlocks, readBlocks, readData, decodeSymbols, readChannels, readFrames
+from audio_dec import symbolsToHops, hopsToSamples, iterHopsToSamples, SAMPLE_RATE
+from LHEstats import CodecStats, NO_STATS
+from LHEframes import decodeFrames
+
+# -------------#
+# BLOCK CODEC  #
+# -------------#
+
+BLOCK_SIZE = 65536 # Default number of samples per block
+
+# Bytes of a block entry in the header of a rate controlled block .lhe file
+RATE_BLOCK_BYTES = 16
+
+#*******************************************************************************#
+#	Function encodeBlock: This encodes a block of samples. The quantizer and    #
+#	the dynamic compressor start again in every block (hop0 is the first       #
+#	sample, hop1 is in the center of its interval and there are no chains).     #
+#	Input: Block samples (string of signed 16 bits integers), maximum and       #
+#	minimum sample value of the audio, quantizer, entropy coder, bits for the   #
+#	block and stats (optional).                                                 #
+#	Output: Number of symbols, first amplitude and Huffman payload (and hop1    #
+#	interval, if the bits are given)                                            #
+#*******************************************************************************#
+
+def encodeBlock(samples, max_sample, min_sample, quantizer="exhaustive", coder="huffman", bits=None, stats=None):
+	"""Returns the number of symbols, the first amplitude and the Huffman
+	payload of a block of samples. If a number of bits is given, the block
+	is quantized with the hop1 interval fitLevel chooses for them, and the
+	maximum and minimum hop1 follow the payload.
+
+	Parameters: Block samples (string with signed 16 bits integers, as in
+	array.tostring), maximum and minimum sample value of the whole audio,
+	quantizer (see getHops), entropy coder (see CODERS), bits for the 
+	symbols of the block (None for the default hop1 interval) and stats
+	object (see LHEstats, None to keep no stats).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	with timer.stage("ingest"):
+		samples = array.array("h", samples)
+
+	if (bits is None):
+		interval = None
+		with timer.stage("quantize"):
+			hops, result = getHops(samples, len(samples), max_sample, min_sample, quantizer)
+		with timer.stage("run-compress"):
+			sym = getSymbols(hops)
+	else:
+		interval, hops, sym = fitLevel(samples, max_sample, min_sample, bits, quantizer, coder, stats)
+
+	with timer.stage("stats"):
+		timer.countHops(hops, hop1_states=getHop1States(*(interval or (MAX_HOP1, MIN_HOP1))))
+		timer.countSymbols(sym)
+
+	with timer.stage("entropy"):
+		payload = encodeSymbols(sym, coder, stats)
+
+	if (interval is None):
+		return len(sym), samples[0], payload
+
+	return len(sym), samples[0], payload, interval[0], interval[1]
+
+
+#*******************************************************************************#
+#	Function fitLevel: This chooses the hop1 interval of a block for a number   #
+#	of bits: the finest one of RATE_LEVELS whose symbols fit in them.           #
+#	Input: Block samples (array), maximum and minimum sample value of the       #
+#	audio, bits, quantizer, entropy coder and stats (optional).                 #
+#	Output: hop1 interval (maximum and minimum hop1), hops and symbols          #
+#*******************************************************************************#
+
+def fitLevel(samples, max_sample, min_sample, bits, quantizer="exhaustive", coder="huffman", stats=None):
+	"""Returns the first (smallest) hop1 interval of RATE_LEVELS which codes
+	the samples with no more than the given bits (as estimateBits counts
+	them), and the hops and symbols of the samples with it. If no interval
+	is enough, the coarsest one is returned, and the block is counted in a
+	"rate_misses" counter of the stats.
+
+	Larger intervals give fewer bits, so the levels are binary searched:
+	about four runs of the quantizer for the eleven levels, and no entropy
+	coding (the stats get them in a "rate_trials" counter).
+
+	Parameters: Block samples (array of signed 16 bits integers), maximum 
+	and minimum sample value of the whole audio, bits for the symbols of
+	the block, quantizer (see getHops), entropy coder (see CODERS) and 
+	stats object (see LHEstats, None to keep no stats).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	trials = {} # Level: hops, symbols and bits
+	def trial(level):
+		if level not in trials:
+			max_hop1, min_hop1 = RATE_LEVELS[level]
+			with timer.stage("quantize"):
+				hops, result = getHops(samples, len(samples), max_sample, min_sample, quantizer, max_hop1, min_hop1)
+			with timer.stage("run-compress"):
+				sym = getSymbols(hops)
+			with timer.stage("entropy"):
+				trials[level] = hops, sym, estimateBits(sym, coder)
+		return trials[level]
+
+	low, high = 0, len(RATE_LEVELS) - 1
+	best = high
+	while (low <= high):
+		level = (low + high) // 2
+		if (trial(level)[2] <= bits):
+			best, high = level, level - 1
+		else:
+			low = level + 1
+
+	hops, sym, n_bits = trial(best)
+	timer.add("rate_trials", len(trials))
+	timer.add("rate_levels", {"%d-%d" % RATE_LEVELS[best]: 1})
+	if (n_bits > bits):
+		timer.add("rate_misses", 1) # Not even the coarsest interval fits
+
+	return RATE_LEVELS[best], hops, sym
+
+
+def _encodeBlockStats(*args):
+	"""Returns encodeBlock(*args) and the stats of the block (as_dict), so
+	they can be sent back from a worker process."""
+
+	stats = CodecStats()
+	return encodeBlock(*args, stats=stats), stats.as_dict()
+
+
+def _encodeBytesStats(*args):
+	"""Returns _encodeBytes(*args) and its stats (as_dict), so they can be
+	sent back from a worker process."""
+
+	stats = CodecStats()
+	return _encodeBytes(*args, stats=stats), stats.as_dict()
+
+
+def _mapStats(function, stats_function, args_list, jobs, stats):
+	"""Returns _map(function, args_list, jobs). With stats, stats_function
+	is called instead and the stats of every call are added to them."""
+
+	if (stats is None):
+		return _map(function, args_list, jobs)
+
+	results = []
+	for result, call_stats in _map(stats_function, args_list, jobs):
+		stats.merge(call_stats)
+		results.append(result)
+
+	return results
+
+
+#*******************************************************************************#
+#	Function decodeBlock: This decodes a block of samples.                      #
+#	Input: Huffman payload, number of symbols, first amplitude and number of    #
+#	samples of the block, maximum and minimum sample value of the audio, hop1   #
+#	interval (optional).                                                        #
+#	Output: Block samples (string of signed 16 bits integers)                   #
+#*******************************************************************************#
+
+def decodeBlock(payload, n_sym, first_amp, n_samples, max_sample, min_sample, max_hop1=MAX_HOP1, min_hop1=MIN_HOP1):
+	"""Returns the samples of a block, as a string of signed 16 bits
+	integers (see array.tostring).
+
+	Parameters: Huffman payload, number of symbols, first amplitude and
+	number of samples of the block, maximum and minimum sample value of the
+	whole audio, maximum and minimum hop1 the block was encoded with.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	sym = decodeSymbols(payload, n_sym, n_samples)
+	hops = symbolsToHops(sym)
+
+	return hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample, max_hop1, min_hop1).tostring()
+
+
+def _map(function, args_list, jobs):
+	"""Returns [function(*args) for args in args_list], using a pool of jobs
+	processes (all the CPUs if jobs is None) unless jobs is 1."""
+
+	return list(_imap(function, args_list, jobs))
+
+
+def _imap(function, args_list, jobs):
+	"""Yields function(*args) for every args in args_list, in order, as
+	_map computes them. A result is not kept once it is yielded."""
+
+	if (jobs is None):
+		jobs = multiprocessing.cpu_count()
+
+	if (jobs <= 1 or len(args_list) <= 1):
+		for args in args_list:
+			yield function(*args)
+		return
+
+	# Workers get the tables already built and memory-mapped
+	getHopTable()
+	getThresholdTable()
+
+	pool = futures.ProcessPoolExecutor(max_workers=jobs)
+	try:
+		tasks = [pool.submit(function, *args) for args in args_list]
+		for i in range(0, len(tasks)):
+			result = tasks[i].result()
+			tasks[i] = None
+			yield result
+	finally:
+		pool.shutdown()
+
+
+#*******************************************************************************#
+#	Function encodeBlocks: This encodes an audio in independent blocks, in      #
+#	parallel.                                                                   #
+#	Input: Samples list, number of samples, maximum and minimum sample value,   #
+#	block size, number of processes, quantizer, entropy coder, target bitrate,  #
+#	sample rate and stats (optional).                                           #
+#	Output: Blocks list                                                         #
+#*******************************************************************************#
+
+def encodeBlocks(samples, n_samples, max_sample, min_sample, block_size=BLOCK_SIZE, jobs=None, quantizer="exhaustive", coder="huffman", bitrate=None, sample_rate=SAMPLE_RATE, stats=None):
+	"""Returns the blocks of an audio (a tuple with the number of symbols,
+	first amplitude and Huffman payload per block, and the hop1 interval 
+	with a bitrate), as writeBlocksFile needs them.
+
+	Parameters: Samples list or array (signed 16 bits integers), number of
+	samples, maximum and minimum sample value, number of samples per block,
+	number of processes (all the CPUs by default, 1 to work in this
+	process), quantizer (see getHops), entropy coder (see CODERS), target
+	bitrate (kbit/s, None for no rate control), sample rate of the audio
+	and stats object (see LHEstats, None to keep no stats). The stats of 
+	every block are added to it, even if it is encoded in another process.
+
+	With a bitrate, every block gets the bits its duration allows, less
+	its entry in the file header, and is encoded with the best hop1
+	interval which fits in them (see fitLevel). Very loud blocks can need
+	more bits than the coarsest interval gives (see checkBitrate).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	args_list = []
+	with timer.stage("ingest"):
+		for start in range(0, n_samples, block_size):
+			block = array.array("h", samples[start:start + block_size]).tostring()
+			if (bitrate is None):
+				bits = None
+			else:
+				n = min(block_size, n_samples - start)
+				bits = int(bitrate * 1000.0 * n / sample_rate) - 8 * RATE_BLOCK_BYTES
+			args_list.append((block, max_sample, min_sample, quantizer, coder, bits))
+
+	return _mapStats(encodeBlock, _encodeBlockStats, args_list, jobs, stats)
+
+
+#*******************************************************************************#
+#	Function checkBitrate: This compares the bitrate of a .lhe file with the    #
+#	target one, which the rate control can not always reach.                    #
+#	Input: .lhe file content, number of frames, sample rate, target bitrate     #
+#	and strict option (optional)                                                #
+#	Output: Bitrate of the file (kbit/s)                                        #
+#*******************************************************************************#
+
+def checkBitrate(lhe, n_frames, sample_rate, bitrate, strict=False):
+	"""Returns the bitrate of a .lhe file (kbit/s, all the channels
+	together). If it is over the target, a RuntimeWarning is given, or a
+	ValueError raised if strict is set.
+
+	Parameters: .lhe file content (string), number of frames (samples per
+	channel) and sample rate of the audio, target bitrate (kbit/s) and
+	strict option.
+
+	Exceptions: This will throw a ValueError if strict is set and the
+	bitrate is over the target.
+
+	"""
+
+	achieved = 8.0 * len(lhe) * sample_rate / (1000.0 * max(n_frames, 1))
+
+	if (achieved > bitrate):
+		message = ("%.1f kbit/s, over the %g kbit/s target: not even the "
+			"coarsest hop1 interval fits in it" % (achieved, bitrate))
+		if strict:
+			raise ValueError(message)
+		warnings.warn(message, RuntimeWarning, stacklevel=3)
+
+	return achieved
+
+
+#*******************************************************************************#
+#	Function decodeBlocks: This decodes the blocks of an audio, in parallel.    #
+#	Input: Blocks list, number of samples, maximum and minimum sample value,    #
+#	block size, number of processes and output array (optional).                #
+#	Output: Samples array                                                       #
+#*******************************************************************************#
+
+def decodeBlocks(blocks, n_samples, max_sample, min_sample, block_size, jobs=None, out=None):
+	"""Returns the samples of an audio (array of signed 16 bits integers)
+	given its blocks, as getBlocks returns them (with or without their hop1
+	interval).
+
+	Parameters: Blocks list, number of samples, maximum and minimum sample
+	value, number of samples per block, number of processes (all the
+	CPUs by default, 1 to work in this process) and array of n_samples
+	samples where they are written, block by block (such as a column of
+	the array of wavio.createWav), if any.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	args_list = []
+	for i in range(0, len(blocks)):
+		n_sym, first_amp, payload = blocks[i][0:3]
+		block_samples = min(block_size, n_samples - i * block_size)
+		args_list.append((payload, n_sym, first_amp, block_samples, max_sample, min_sample) + tuple(blocks[i][3:5]))
+
+	if (out is not None):
+		s = 0 # Sample counter
+		for block in _imap(decodeBlock, args_list, jobs):
+			out[s:s + len(block) / 2] = np.frombuffer(block, np.int16)
+			s = s + len(block) / 2
+		return out
+
+	samples = array.array("h")
+	for block in _map(decodeBlock, args_list, jobs):
+		samples.fromstring(block)
+
+	return samples
+
+
+#*******************************************************************************#
+#	Function encodeFile: This encodes an audio in independent blocks and       #
+#	writes the .lhe file.                                                       #
+#	Input: Samples list, number of samples, maximum and minimum sample value,   #
+#	.lhe file path, block size, number of processes, quantizer, entropy coder,  #
+#	target bitrate, sample rate and stats (optional).                           #
+#	Output: None, this function just creates the file.                          #
+#*******************************************************************************#
+
+def encodeFile(samples, n_samples, max_sample, min_sample, filename="output_lhe/lhe_file.lhe", block_size=BLOCK_SIZE, jobs=None, quantizer="exhaustive", coder="huffman", bitrate=None, sample_rate=SAMPLE_RATE, stats=None):
+	"""Writes a block .lhe file for the given samples.
+
+	Parameters: Samples list or array (signed 16 bits integers), number of
+	samples, maximum and minimum sample value, .lhe file path, number of
+	samples per block, number of processes, quantizer, entropy coder,
+	target bitrate (kbit/s, see encodeBlocks), sample rate and stats 
+	object (see LHEstats, None to keep no stats).
+
+	Exceptions: This function will throw an exception if the file can not
+	be written.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	blocks = encodeBlocks(samples, n_samples, max_sample, min_sample, block_size, jobs, quantizer, coder, bitrate, sample_rate, stats)
+	with timer.stage("write"):
+		writeBlocksFile(blocks, n_samples, max_sample, min_sample, block_size, filename, stats)
+
+
+#*******************************************************************************#
+#	Function decodeFile: This reads a block .lhe file and decodes its blocks.   #
+#	Input: .lhe file path, number of processes (optional).                      #
+#	Output: Samples array                                                       #
+#*******************************************************************************#
+
+def decodeFile(filename="output_lhe/lhe_file.lhe", jobs=None):
+	"""Returns the samples of a block .lhe file (array of signed 16 bits
+	integers).
+
+	Parameters: .lhe file path, number of processes (all the CPUs by
+	default, 1 to work in this process).
+
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or it is not a block .lhe file.
+
+	"""
+
+	n_samples, max_sample, min_sample, block_size, blocks = getBlocks(filename)
+	return decodeBlocks(blocks, n_samples, max_sample, min_sample, block_size, jobs)
+
+
+# ---------------------#
+# MULTI-CHANNEL CODEC  #
+# ---------------------#
+
+#*******************************************************************************#
+#	Function encodeChannels: This encodes every channel of an audio on its own, #
+#	in parallel.                                                                #
+#	Input: Samples array (frames x channels), quantizer, block size, number of  #
+#	processes, entropy coder, target bitrate, sample rate and stats (optional). #
+#	Output: Channels list (.lhe file content of every channel)                  #
+#*******************************************************************************#
+
+def encodeChannels(samples, quantizer="exhaustive", block_size=None, jobs=None, coder="huffman", bitrate=None, sample_rate=SAMPLE_RATE, stats=None):
+	"""Returns the .lhe file content of every channel of an audio, as
+	writeChannelsFile needs them.
+
+	Parameters: Samples array (signed 16 bits integers, a row per frame and
+	a column per channel, as wavio.readWav returns it), quantizer (see 
+	getHops), number of samples per block (None for basic .lhe channels)
+	number of processes (all the CPUs by default, 1 to work in this 
+	process), entropy coder (see CODERS), target bitrate of the whole audio
+	(kbit/s, shared out evenly among the channels, see encode_bytes), 
+	sample rate and stats object (see LHEstats, None to keep no stats). The
+	stats of every channel are added to it.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	with timer.stage("ingest"):
+		samples = np.asarray(samples, np.int16).reshape(len(samples), -1)
+
+		channel_bitrate = None if bitrate is None else float(bitrate) / samples.shape[1]
+
+		args_list = []
+		for c in range(0, samples.shape[1]):
+			pcm = np.ascontiguousarray(samples[:, c]).astype("<i2").tostring()
+			args_list.append((pcm, quantizer, block_size, 1, None, sample_rate, coder, channel_bitrate))
+
+	return _mapStats(_encodeBytes, _encodeBytesStats, args_list, jobs, stats)
+
+
+#*******************************************************************************#
+#	Function decodeChannels: This decodes the channels of an audio, in          #
+#	parallel.                                                                   #
+#	Input: Channels list, number of samples per channel, number of processes    #
+#	and output array (optional).                                                #
+#	Output: Samples array (frames x channels)                                   #
+#*******************************************************************************#
+
+def decodeChannels(channels, n_samples, jobs=None, out=None):
+	"""Returns the samples of an audio (signed 16 bits integers, a row per
+	frame and a column per channel) given its channels, as getChannels
+	returns them.
+
+	Parameters: Channels list, number of samples per channel, number of
+	processes (all the CPUs by default, 1 to work in this process) and
+	array where the samples are written (a new one by default, or the
+	array of wavio.createWav). Every channel is written as soon as it is
+	decoded.
+
+	Exceptions: This will throw an exception if a channel is not a .lhe
+	file content.
+
+	"""
+
+	samples = np.zeros((n_samples, len(channels)), np.int16) if out is None else out
+
+	decoded = _imap(decode_bytes, [(channel, 1) for channel in channels], jobs)
+	for c, pcm in enumerate(decoded):
+		samples[:, c] = np.frombuffer(pcm, "<i2")
+
+	return samples
+
+
+#*******************************************************************************#
+#	Function encodeWav: This encodes all the channels of a .wav file, in        #
+#	parallel, and writes the multi-channel .lhe file.                           #
+#	Input: Input audio file, .lhe file path, quantizer, block size, number of   #
+#	processes, entropy coder, target bitrate, stats, cache and strict bitrate   #
+#	option (optional).                                                          #
+#	Output: None, this function just creates the file.                          #
+#*******************************************************************************#
+
+def encodeWav(filename, lhe_file="output_lhe/lhe_file.lhe", quantizer="exhaustive", block_size=None, jobs=None, coder="huffman", bitrate=None, stats=None, cache=None, strict=False):
+	"""Writes the multi-channel .lhe file of a .wav file, with all its
+	channels and its sample rate.
+
+	Parameters: Input audio file, .lhe file path, quantizer (see getHops),
+	number of samples per block (None for basic .lhe channels), number of
+	processes, entropy coder (see CODERS), target bitrate (kbit/s, see
+	encodeChannels), stats object (see LHEstats, None to keep no stats)
+	and cache of .lhe files (see LHEcache, None to encode every time). The
+	cache keys are the ones of encode_bytes for the interleaved samples,
+	so both find the files of each other. With a bitrate, a file over it
+	gives a warning, or nothing is written if strict is set (see 
+	checkBitrate).
+
+	Exceptions: This function will throw a wave.Error if the input file is
+	not a supported .wav file, a ValueError if strict is set and the file
+	is over the bitrate, and an exception if the .lhe file can not be
+	written.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	with timer.stage("ingest"):
+		samples, info = wavio.readWav(filename, mapped=True) # 16 bits samples are not read
+
+	data, key = None, None
+	if (cache is not None):
+		key = _cacheKey(cache, np.ascontiguousarray(samples, "<i2"), quantizer, block_size,
+			info.n_channels, info.sample_rate, coder, bitrate)
+		data = _cacheGet(cache, key, timer)
+
+	if (data is None):
+		channels = encodeChannels(samples, quantizer, block_size, jobs, coder, bitrate, info.sample_rate, stats)
+		with timer.stage("write"):
+			data = buildChannelsFile(channels, len(samples), info.sample_rate, stats)
+		if (cache is not None):
+			with timer.stage("cache"):
+				cache.put(key, data)
+
+	if (bitrate is not None):
+		checkBitrate(data, len(samples), info.sample_rate, bitrate, strict)
+
+	with timer.stage("write"):
+		f = open(lhe_file, "wb")
+		f.write(data)
+		f.close()
+
+
+def _cacheKey(cache, pcm, quantizer, block_size, n_channels, sample_rate, coder, bitrate):
+	"""Returns the key of an encode in a cache (see LHEcache): the samples
+	and every option which changes the .lhe file."""
+
+	return cache.key(pcm, quantizer=quantizer, block_size=block_size, n_channels=n_channels,
+		sample_rate=sample_rate, coder=coder, bitrate=bitrate)
+
+
+def _cacheGet(cache, key, timer=NO_STATS):
+	"""Returns the .lhe file of a key in a cache (None if it is not there),
+	counting the hits and misses in the stats."""
+
+	with timer.stage("cache"):
+		data = cache.get(key)
+	timer.add("cache_misses" if data is None else "cache_hits", 1)
+
+	return data
+
+
+#*******************************************************************************#
+#	Function decodeWav: This decodes a .lhe file (of any type) and saves the    #
+#	audio in .wav format, with all its channels. The samples are written into   #
+#	the mapped .wav file as they are decoded.                                   #
+#	Input: .lhe file path, output audio file and number of processes            #
+#	(optional).                                                                 #
+#	Output: None, this function just creates the file.                          #
+#*******************************************************************************#
+
+def decodeWav(lhe_file="output_lhe/lhe_file.lhe", filename="output_lhe/audio/output_audio.wav", jobs=None):
+	"""Writes the .wav file of a .lhe file. Multi-channel files keep their
+	channels and sample rate; the other ones give a mono audio at 
+	SAMPLE_RATE Hz.
+
+	Parameters: .lhe file path, output audio file and number of processes
+	(all the CPUs by default, 1 to work in this process).
+
+	Exceptions: This will throw an exception if the .lhe file does not
+	exist or the audio file can not be written.
+
+	"""
+
+	fp = open(lhe_file, "rb")
+	data = fp.read()
+	fp.close()
+
+	n_samples, n_channels, sample_rate = getShape(data)
+	samples = wavio.createWav(filename, n_samples, n_channels, sample_rate)
+	_decodeInto(data, samples, jobs)
+
+	del samples # Its pages are written to the file
+
+
+#*******************************************************************************#
+#	Function getShape: This reads the size of the audio of a .lhe file from     #
+#	its headers, without decoding it, so its decoder can be given an array of   #
+#	the right size (or a server can refuse to decode it).                       #
+#	Input: .lhe file content                                                    #
+#	Output: Number of samples per channel, number of channels and sample rate   #
+#*******************************************************************************#
+
+def getShape(lhe):
+	"""Returns the number of samples per channel, number of channels and
+	sample rate (SAMPLE_RATE if the file does not keep it) of a .lhe file
+	content. The headers are checked against the payloads (see 
+	binary_dec.checkSymbols), so the samples are there.
+
+	Parameters: .lhe file content (string).
+
+	Exceptions: This will throw an exception if the content is not a .lhe
+	file, or a ValueError if its headers are not possible.
+
+	"""
+
+	lhe_type = struct.unpack("B", lhe[0])[0]
+	if (lhe_type == LHE_CHANNELS):
+		n_samples, sample_rate, channels = readChannels(lhe)
+		return n_samples, len(channels), sample_rate
+	if (lhe_type == LHE_BLOCKS or lhe_type == LHE_RATE_BLOCKS):
+		return readBlocks(lhe)[0], 1, SAMPLE_RATE
+	if (lhe_type == LHE_FRAMES):
+		return sum(frame[0] for frame in readFrames(lhe)[2]), 1, SAMPLE_RATE
+
+	return readData(lhe)[2], 1, SAMPLE_RATE
+
+
+def _decodeInto(lhe, out, jobs):
+	"""Writes the samples of a .lhe file content into an array of the shape
+	getShape gives (frames x channels, such as the array of createWav), as
+	they are decoded."""
+
+	lhe_type = struct.unpack("B", lhe[0])[0]
+	if (lhe_type == LHE_CHANNELS):
+		n_samples, sample_rate, channels = readChannels(lhe)
+		decodeChannels(channels, n_samples, jobs, out)
+	elif (lhe_type == LHE_BLOCKS or lhe_type == LHE_RATE_BLOCKS):
+		n_samples, max_sample, min_sample, block_size, blocks = readBlocks(lhe)
+		decodeBlocks(blocks, n_samples, max_sample, min_sample, block_size, jobs, out[:, 0])
+	elif (lhe_type == LHE_FRAMES):
+		out[:, 0] = np.frombuffer(decodeFrames(lhe), "<i2")
+	else:
+		_decodeStream(lhe, out[:, 0], STREAM_CHUNK)
+
+
+def _decodeStream(lhe, out, chunk_size):
+	"""Writes the samples of a basic .lhe file content into an array (such
+	as a column of the array of wavio.createWav), in chunks of chunk_size
+	samples, so only its symbols are kept in memory."""
+
+	n_sym, first_amp, n_samples, max_sample, min_sample = readData(lhe)
+	hops = symbolsToHops(decodeSymbols(lhe[21:], n_sym, n_samples))
+
+	chunks = (hops[s:s + chunk_size] for s in xrange(0, n_samples, chunk_size))
+	s = 0 # Sample counter
+	for result in iterHopsToSamples(chunks, first_amp, max_sample, min_sample):
+		out[s:s + len(result)] = np.frombuffer(result, np.int16)
+		s = s + len(result)
+
+
+# ----------------#
+# STREAM ENCODER  #
+# ----------------#
+
+STREAM_CHUNK = 65536 # Default number of samples (or symbols) per chunk
+STATIC_PREFIX = 65536 # Symbols a static Huffman table is chosen from (see encodeStream): the
+# first ones of an audio (an attack, a silence) are not enough
+
+#*******************************************************************************#
+#	Function encodeStream: This encodes an audio file into a basic .lhe file    #
+#	reading it in chunks. Samples, hops and symbols never are in memory at      #
+#	once: the quantizer and the dynamic compressor go chunk by chunk (their     #
+#	state goes on between chunks), the symbols are counted and saved in a       #
+#	temporary file, and the Huffman codes are written chunk by chunk when the   #
+#	Huffman table is known. The .lhe file is the same one writeFile writes.     #
+#	With a static Huffman table, the codes are written in the same pass.        #
+#	Input: Input audio file, .lhe file path, quantizer, channel, samples per    #
+#	chunk, entropy coder, stats and quality meter (optional)                    #
+#	Output: None, this function just creates the file.                          #
+#*******************************************************************************#
+
+def encodeStream(filename, lhe_file="output_lhe/lhe_file.lhe", quantizer="exhaustive", channel=0, chunk_size=STREAM_CHUNK, coder="huffman", stats=None, quality=None):
+	"""Writes the basic .lhe file of an audio file with a memory use which
+	does not depend on the audio length.
+
+	The Huffman table needs the frequencies of all the symbols before the
+	first code is written, so the symbols (one byte each) are kept in a 
+	temporary file between both passes. The "huffman-static" coder takes
+	one of its tables from the first STATIC_PREFIX symbols instead, and
+	writes every code at once (the number of symbols and code bits are
+	written at the end, in their place). It only falls back to a code of
+	its own for audios of fewer symbols, as the symbols are not kept.
+
+	Parameters: Input audio file, .lhe file path, quantizer (see getHops),
+	channel to be encoded, number of samples per chunk, entropy coder (see
+	CODERS) and stats object (see LHEstats, None to keep no stats). The
+	counters are the same ones encode_bytes gives for the whole audio. If
+	a quality meter is given (see metrics.QualityMeter), the samples the
+	decoder will give are compared with the original ones on the way.
+
+	Exceptions: This function will throw a wave.Error if the input file is
+	not a supported .wav file, and an exception if the .lhe file can not be
+	written.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	# First pass over the audio: maximum and minimum values
+	with timer.stage("ingest"):
+		n_samples, max_sample, min_sample, first_amp = scanSamples(filename, channel)
+
+	# Second pass: quantizer and dynamic compressor (every generator is
+	# timed on its own, so each stage only gets its own time)
+	chunks = timer.timed(iterSamples(filename, channel, chunk_size), "ingest")
+	if (quality is None):
+		hops_results = iterHops(chunks, max_sample, min_sample, quantizer)
+	else:
+		hops_results = _measureHops(chunks, max_sample, min_sample, quantizer, quality, timer)
+	hops_chunks = timer.timed((hops for hops, result in hops_results), "quantize")
+	if (stats is not None):
+		hops_chunks = _countHopChunks(hops_chunks, stats)
+
+	enc = CODERS[coder]() # It counts the symbols (for its code table) chunk by chunk
+	sym_chunks = timer.timed(iterSymbols(hops_chunks), "run-compress")
+	if isinstance(enc, huff.StaticEncoder):
+		_writeStatic(sym_chunks, enc, lhe_file, n_samples, max_sample, min_sample, first_amp, timer)
+		return
+
+	n_sym = 0
+	spool = tempfile.TemporaryFile()
+
+	for sym in sym_chunks:
+		with timer.stage("stats"):
+			timer.countSymbols(sym)
+		with timer.stage("entropy"):
+			spool.write(sym)
+			enc.count_chunk(sym)
+		n_sym = n_sym + len(sym)
+
+	with timer.stage("write"):
+		f = open(lhe_file, "wb")
+
+		# -- HEADER -- # (as in writeFile)
+		f.write(struct.pack("B", LHE_BASIC))
+		f.write(struct.pack("i", n_sym))
+		f.write(struct.pack("i", first_amp))
+		f.write(struct.pack("i", n_samples))
+		f.write(struct.pack("i", max_sample))
+		f.write(struct.pack("i", min_sample))
+	timer.add("header_bytes", 21)
+
+	# -- PAYLOAD -- #
+	if (n_sym != 0):
+		with timer.stage("entropy"):
+			enc.set_freq()
+			table = enc.dumps_header()
+		with timer.stage("write"):
+			f.write(table)
+
+		code_bytes = 0
+		spool.seek(0)
+		while True:
+			with timer.stage("entropy"):
+				sym = spool.read(chunk_size)
+				codes = enc.encode_chunk(sym) if sym else enc.flush()
+			with timer.stage("write"):
+				f.write(codes)
+			code_bytes = code_bytes + len(codes)
+			if not sym:
+				break
+
+		timer.add("symbols", n_sym)
+		timer.add("code_bits", enc.bitslen or 8 * code_bytes) # The range coder only knows its bytes
+		timer.add("table_bytes", len(table))
+		timer.add("code_bytes", code_bytes)
+
+	f.close()
+	spool.close()
+
+
+def _writeStatic(sym_chunks, enc, lhe_file, n_samples, max_sample, min_sample, first_amp, timer=NO_STATS):
+	"""Writes the basic .lhe file of the chunks of symbols in a single pass
+	with a static Huffman encoder (see encodeStream)."""
+
+	# The table is chosen from the first symbols, which wait for it
+	prefix, n_sym, complete = [], 0, True
+	for sym in sym_chunks:
+		with timer.stage("stats"):
+			timer.countSymbols(sym)
+		prefix.append(sym)
+		n_sym = n_sym + len(sym)
+		if (n_sym >= STATIC_PREFIX):
+			complete = False
+			break
+
+	with timer.stage("entropy"):
+		if complete:
+			# All the symbols are known: as in encodeFile, with a code of
+			# its own if it is smaller than every table
+			for sym in prefix:
+				enc.count_chunk(sym)
+			if (n_sym != 0):
+				enc.set_freq()
+		elif (n_sym != 0):
+			enc.set_table(enc.best_table("".join(prefix)[0:STATIC_PREFIX]))
+		if (n_sym != 0):
+			table = enc.dumps_header()
+
+	with timer.stage("write"):
+		f = open(lhe_file, "wb")
+		f.write(struct.pack("B", LHE_BASIC))
+		f.write(struct.pack("i", n_sym if complete else 0)) # Else written at the end
+		f.write(struct.pack("i", first_amp))
+		f.write(struct.pack("i", n_samples))
+		f.write(struct.pack("i", max_sample))
+		f.write(struct.pack("i", min_sample))
+	timer.add("header_bytes", 21)
+
+	if (n_sym != 0):
+		with timer.stage("write"):
+			f.write(table)
+
+		def chunks():
+			for sym in prefix:
+				yield sym
+			for sym in sym_chunks:
+				with timer.stage("stats"):
+					timer.countSymbols(sym)
+				yield sym
+
+		n_sym, code_bytes = 0, 0
+		for sym in chunks():
+			with timer.stage("entropy"):
+				codes = enc.encode_chunk(sym)
+			with timer.stage("write"):
+				f.write(codes)
+			n_sym, code_bytes = n_sym + len(sym), code_bytes + len(codes)
+		with timer.stage("entropy"):
+			codes = enc.flush()
+
+		with timer.stage("write"):
+			f.write(codes)
+			if not complete:
+				f.seek(1)
+				f.write(struct.pack("i", n_sym))
+				f.seek(21 + huff.STATIC_BITS)
+				f.write(struct.pack("<Q", enc.code_length))
+
+		timer.add("symbols", n_sym)
+		timer.add("code_bits", enc.code_length)
+		timer.add("table_bytes", len(table))
+		timer.add("code_bytes", code_bytes + len(codes))
+
+	f.close()
+
+
+def _measureHops(chunks, max_sample, min_sample, quantizer, quality, timer=NO_STATS):
+	"""Yields the hops and amplitudes of every chunk of samples (see
+	iterHops). The amplitudes are the samples the decoder gives, so they
+	are added to the quality meter with the original ones."""
+
+	kept = []
+	def keep(chunks):
+		for samples in chunks:
+			kept.append(samples)
+			yield samples
+
+	for hops, result in iterHops(keep(chunks), max_sample, min_sample, quantizer):
+		with timer.stage("stats"):
+			quality.update(result, kept.pop())
+		yield hops, result
+
+
+def _countHopChunks(hops_chunks, stats):
+	"""Yields the chunks of hops of an audio, counting them (see
+	CodecStats.countHops) on the way."""
+
+	carry = None
+	for hops in hops_chunks:
+		with stats.stage("stats"):
+			carry = stats.countHops(hops, carry)
+		yield hops
+
+
+# -----------------#
+# IN-MEMORY CODEC  #
+# -----------------#
+
+#*******************************************************************************#
+#	Function encode_bytes: This encodes raw audio samples into the content of   #
+#	a .lhe file, without writing any file, so it can be called from several     #
+#	threads at once.                                                            #
+#	Input: PCM samples, quantizer, block size, number of processes, number of   #
+#	channels, sample rate, entropy coder, target bitrate, stats, cache and      #
+#	strict bitrate option (optional)                                            #
+#	Output: .lhe file content (string)                                          #
+#*******************************************************************************#
+
+def encode_bytes(pcm, quantizer="exhaustive", block_size=None, jobs=1, n_channels=None, sample_rate=SAMPLE_RATE, coder="huffman", bitrate=None, stats=None, cache=None, strict=False):
+	"""Returns the content of the .lhe file of some raw samples.
+
+	Parameters: PCM samples (string or buffer with signed 16 bits little
+	endian integers, one channel), quantizer (see getHops), number of 
+	samples per block (None for a basic .lhe file, as writeFile writes it)
+	and number of processes for the blocks (see encodeBlocks). If the
+	number of channels is given, the samples are interleaved frames and
+	a multi-channel .lhe file is returned, with the given sample rate (its
+	channels are coded by jobs processes, see encodeChannels). The symbols
+	are coded by the given entropy coder (see CODERS). With a target 
+	bitrate (kbit/s), the file is a rate controlled block .lhe file (of 
+	BLOCK_SIZE samples per block if no block size is given, see 
+	encodeBlocks). If the file is over the bitrate, a warning is given, or
+	a ValueError raised if strict is set (see checkBitrate). The time per
+	stage and the counters are added to the stats object, if any (see 
+	LHEstats). With a cache (see LHEcache), the .lhe file of the same
+	samples and options is only encoded once.
+
+	Exceptions: This will throw a ValueError if strict is set and the file
+	is over the bitrate.
+
+	"""
+
+	timer = stats if stats is not None else NO_STATS
+
+	lhe = None
+	if (cache is not None):
+		key = _cacheKey(cache, pcm, quantizer, block_size, n_channels, sample_rate, coder, bitrate)
+		lhe = _cacheGet(cache, key, timer)
+
+	if (lhe is None):
+		lhe = _encodeBytes(pcm, quantizer, block_size, jobs, n_channels, sample_rate, coder, bitrate, stats)
+		if (cache is not None):
+			with timer.stage("cache"):
+				cache.put(key, lhe)
+
+	if (bitrate is not None):
+		checkBitrate(lhe, len(pcm) // (2 * (n_channels or 1)), sample_rate, bitrate, strict)
+
+	return lhe
+
+
+def _encodeBytes(pcm, quantizer, block_size, jobs, n_channels, sample_rate, coder, bitrate, stats=None):
+	"""encode_bytes with no cache and no bitrate check (every channel of
+	encodeChannels is coded with it, and the whole file is checked)."""
+
+	timer = stats if stats is not None else NO_STATS
+
+	with timer.stage("ingest"):
+		values = np.frombuffer(pcm, "<i2")
+
+	if (n_channels is not None):
+		samples = values.reshape(-1, n_channels)
+		channels = encodeChannels(samples, quantizer, block_size, jobs, coder, bitrate, sample_rate, stats)
+		with timer.stage("write"):
+			return buildChannelsFile(channels, len(samples), sample_rate, stats)
+
+	with timer.stage("ingest"):
+		samples = array.array("h", values.astype(np.int16).tostring())
+		n_samples = len(samples)
+
+		if (n_samples == 0):
+			max_sample, min_sample, first_amp = 0, 0, 0
+		else:
+			max_sample, min_sample, first_amp = int(values.max()), int(values.min()), samples[0]
+
+	if (bitrate is not None and block_size is None):
+		block_size = BLOCK_SIZE
+
+	if (block_size is not None):
+		blocks = encodeBlocks(samples, n_samples, max_sample, min_sample, block_size, jobs, quantizer, coder, bitrate, sample_rate, stats)
+		with timer.stage("write"):
+			return buildBlocksFile(blocks, n_samples, max_sample, min_sample, block_size, stats)
+
+	with timer.stage("quantize"):
+		hops, result = getHops(samples, n_samples, max_sample, min_sample, quantizer)
+	with timer.stage("run-compress"):
+		sym = getSymbols(hops)
+	with timer.stage("stats"):
+		timer.countHops(hops)
+		timer.countSymbols(sym)
+
+	with timer.stage("entropy"):
+		return buildFile(sym, first_amp, n_samples, max_sample, min_sample, coder, stats)
+
+
+#*******************************************************************************#
+#	Function decode_bytes: This decodes the content of a .lhe file (of any      #
+#	type) into raw audio samples, without writing any file.                     #
+#	Input: .lhe file content, number of processes (optional)                    #
+#	Output: PCM samples (string)                                                #
+#*******************************************************************************#
+
+def decode_bytes(lhe, jobs=1):
+	"""Returns the raw samples of a .lhe file content.
+
+	Parameters: .lhe file content (string), number of processes for block
+	and multi-channel files (see decodeBlocks and decodeChannels).
+
+	Output: PCM samples (string with signed 16 bits little endian integers,
+	interleaved frames for multi-channel files).
+
+	Exceptions: This will throw an exception if the content is not a .lhe 
+	file.
+
+	"""
+
+	samples, sample_rate = decode_samples(lhe, jobs)
+	return np.ascontiguousarray(samples, "<i2").tostring()
+
+
+#*******************************************************************************#
+#	Function decode_samples: This decodes the content of a .lhe file (of any    #
+#	type) into an array of samples, without writing any file.                   #
+#	Input: .lhe file content, number of processes (optional)                    #
+#	Output: Samples array (frames x channels) and sample rate                   #
+#*******************************************************************************#
+
+def decode_samples(lhe, jobs=1):
+	"""Returns the samples of a .lhe file content and its sample rate
+	(SAMPLE_RATE if the file does not keep it). The samples are written
+	into the array as they are decoded, and it is never copied: it can be
+	given as it is to anything which takes buffers (memoryview(samples),
+	writeAudio, a sound card...).
+
+	Parameters: .lhe file content (string or buffer), number of processes
+	for block and multi-channel files (see decodeBlocks and 
+	decodeChannels).
+
+	Output: C contiguous numpy array of signed 16 bits integers, with a row
+	per frame and a column per channel (one for the files which are not
+	multi-channel ones), and sample rate (Hz).
+
+	Exceptions: This will throw an exception if the content is not a .lhe
+	file, or a ValueError if it is corrupt (its headers give more samples
+	than its payloads have).
+
+	"""
+
+	if not isinstance(lhe, str):
+		lhe = str(bytearray(lhe)) # Buffers, bytearrays...
+
+	n_samples, n_channels, sample_rate = getShape(lhe)
+	samples = np.zeros((n_samples, n_channels), np.int16)
+	_decodeInto(lhe, samples, jobs)
+
+	return samples, sample_rate
@@ -0,0 +1,319 @@
+"""
+
+This module encodes and decodes live audio in frames of a few milliseconds,
+for streams which can not wait for the whole audio:
+
+  encoder, decoder = Encoder(), Decoder()
+  for frame in frames:           # 256 samples (5.3 ms at 48000 Hz) each
+      data = encoder.push(frame) # Bytes of the frame, sent at once
+      pcm = decoder.push(data)   # Samples of every complete frame received
+
+The quantizer, the dynamic compressor and the decoder keep their state
+from one frame to the next one, so there is no restart cost per frame. The
+symbols are coded with a static Huffman table (see STATIC_TABLES), as a 
+table of their own would need the symbols of the whole audio first. Every frame is
+ready as soon as its samples are given: the latency is the frame duration
+and the push time, which every Encoder and Decoder measures.
+
+The stream is a .lhe file content (LHE_FRAMES): its type, first
+amplitude and table number, then a header (number of samples and code 
+bits) and the codes of every frame.
+
+"""
+# LHE Codec for Audio
+
+import array, collections, struct, time
+import numpy as np
+
+import Auxiliary.huff as huff
+from LHEquantizer import iterHops
+from binary_enc import hopsToSymbols, compressRuns, LHE_FRAMES, STATIC_TABLES
+from binary_dec import iterExpandRuns
+from audio_dec import symbolsToHops, iterHopsToSamples
+from LHEstats import NO_STATS
+
+FRAME_SIZE = 256 # Default number of samples per frame
+MAX_FRAME_SIZE = 4096 # Samples of the longest frame, so its code bits fit in 16 bits
+
+# The live audio is not known in advance, so the quantizer works with the
+# whole 16 bits range
+MAX_SAMPLE = 32767
+MIN_SAMPLE = -32768
+
+LATENCY_WINDOW = 1000 # Last frames whose push times are kept for the percentiles
+
+
+def _checkTable(table):
+	"""Raises a ValueError if the table number is unknown or its codes are
+	too long for the code bits of a frame header."""
+
+	if (table < 0 or table >= len(STATIC_TABLES)):
+		raise ValueError("unknown Huffman table %d" % table)
+	if (max(STATIC_TABLES[table].itervalues()) * MAX_FRAME_SIZE > 0xFFFF):
+		raise ValueError("codes of Huffman table %d too long for frames" % table)
+
+
+class _Stage(object):
+	"""A generator of the codec which takes chunks (such as iterHops), fed
+	with one chunk at a time. Its state goes on between them."""
+
+	def __init__(self, function, *args):
+		self._chunks = collections.deque()
+		self._output = function(self._input(), *args)
+
+	def _input(self):
+		while True:
+			yield self._chunks.popleft()
+
+	def push(self, chunk):
+		"""Returns what the generator yields for the chunk."""
+
+		self._chunks.append(chunk)
+		return next(self._output)
+
+
+class LatencyMeter(object):
+	"""Time spent on every frame by a push: number of frames, mean and
+	maximum of all of them, and percentiles of the last LATENCY_WINDOW
+	ones (so the memory does not depend on the stream length)."""
+
+	def __init__(self, window=LATENCY_WINDOW):
+		self.frames = 0
+		self.total = 0.0
+		self.max = 0.0
+		self._last = collections.deque(maxlen=window)
+
+	def update(self, seconds):
+		"""Adds the time of a frame."""
+
+		self.frames += 1
+		self.total += seconds
+		self.max = max(self.max, seconds)
+		self._last.append(seconds)
+
+	def percentile(self, p):
+		"""Returns the time (seconds) under which p percent of the last
+		frames were done, 0 if there are none."""
+
+		if not self._last:
+			return 0.0
+
+		last = sorted(self._last)
+		return last[min(len(last) - 1, int(p / 100.0 * len(last)))]
+
+	def as_dict(self):
+		"""Returns the number of frames and their mean, median, 99th
+		percentile and maximum time in milliseconds."""
+
+		return {"frames": self.frames, "mean_ms": 1000.0 * self.total / max(self.frames, 1),
+			"p50_ms": 1000.0 * self.percentile(50), "p99_ms": 1000.0 * self.percentile(99),
+			"max_ms": 1000.0 * self.max}
+
+
+class Encoder(object):
+	"""Frame encoder of a live mono audio (see push).
+
+	The threshold quantizer gives the same hops as the exhaustive one, in
+	less time, so it is the default one here. The Huffman table is a number
+	in STATIC_TABLES (the general one by default), or None to take the one
+	which codes the first frame with the fewest bits.
+
+	"""
+
+	def __init__(self, quantizer="threshold", table=0, stats=None):
+		if (table is not None):
+			_checkTable(table)
+		self.quantizer = quantizer
+		self.table = table
+		self.stats = stats
+		self.latency = LatencyMeter()
+		self._code = huff.StaticEncoder(STATIC_TABLES, fallback=False)
+		self._hops = None # Quantizer, from the first sample
+		self._x_length = 8 # Dynamic compressor state
+		self._carry = None # Stats state
+
+	def push(self, frame):
+		"""Returns the bytes of a frame of samples: the stream header
+		before the first one, then the frame header and its codes. An
+		empty frame gives no bytes.
+
+		Parameters: Frame samples (list or array of signed 16 bits integers,
+		or PCM string with signed 16 bits little endian integers), up to
+		MAX_FRAME_SIZE samples.
+
+		Exceptions: This function will throw a ValueError if the frame is
+		longer than MAX_FRAME_SIZE samples.
+
+		"""
+
+		start = time.time()
+		timer = self.stats if self.stats is not None else NO_STATS
+
+		with timer.stage("ingest"):
+			if isinstance(frame, (str, buffer, bytearray)):
+				frame = np.frombuffer(frame, "<i2")
+			samples = array.array("h", np.asarray(frame).astype(np.int16).tostring())
+		if (len(samples) > MAX_FRAME_SIZE):
+			raise ValueError("%d samples per frame, %d at most" % (len(samples), MAX_FRAME_SIZE))
+		if (len(samples) == 0):
+			return ""
+
+		first = (self._hops is None)
+		if first:
+			self._hops = _Stage(iterHops, MAX_SAMPLE, MIN_SAMPLE, self.quantizer)
+
+		with timer.stage("quantize"):
+			hops, result = self._hops.push(samples)
+		with timer.stage("run-compress"):
+			# Every frame finishes its '1' chains, so it is decoded at once
+			sym, self._x_length, pending = compressRuns(hopsToSymbols(hops), self._x_length)
+		with timer.stage("stats"):
+			self._carry = timer.countHops(hops, self._carry)
+			timer.countSymbols(sym)
+
+		out = []
+		with timer.stage("entropy"):
+			if first:
+				if (self.table is None):
+					self.table = self._code.best_table(sym)
+					_checkTable(self.table)
+				self._code.set_table(self.table)
+				out.append(struct.pack("=BiB", LHE_FRAMES, samples[0], self.table))
+				timer.add("header_bytes", 6)
+			bits_before = self._code.code_length # It counts the bits of every chunk
+			codes = self._code.encode_chunk(sym) + self._code.flush()
+			code_bits = self._code.code_length - bits_before
+		out.append(struct.pack("=HH", len(samples), code_bits))
+		out.append(codes)
+
+		timer.add("symbols", len(sym))
+		timer.add("code_bits", code_bits)
+		timer.add("header_bytes", 4)
+		timer.add("code_bytes", len(codes))
+
+		self.latency.update(time.time() - start)
+		return "".join(out)
+
+
+class Decoder(object):
+	"""Frame decoder of a stream written by an Encoder (see push)."""
+
+	def __init__(self):
+		self.latency = LatencyMeter()
+		self._code = huff.StaticDecoder(STATIC_TABLES)
+		self._samples = None # Decoder, from the stream header
+		self._runs = _Stage(iterExpandRuns)
+		self._buffer = "" # Bytes of the frame not complete yet
+
+	def buffered(self):
+		"""Returns the number of bytes received which are not decoded yet
+		(the start of a frame)."""
+
+		return len(self._buffer)
+
+	def push(self, data):
+		"""Returns the samples of the frames completed by some bytes of
+		the stream, which can come in pieces of any size.
+
+		Parameters: Bytes of the stream (string).
+
+		Output: PCM samples (string with signed 16 bits little endian
+		integers, empty if no frame is complete).
+
+		Exceptions: This function will throw a ValueError if the bytes are
+		not a frame stream or a frame is not valid.
+
+		"""
+
+		self._buffer = self._buffer + str(data)
+		if (self._samples is None):
+			if (len(self._buffer) < 6):
+				return ""
+			lhe_type, first_amp, table = struct.unpack("=BiB", self._buffer[0:6])
+			if (lhe_type != LHE_FRAMES):
+				raise ValueError("not a frame stream")
+			_checkTable(table)
+			self._code.loads(huff.STATIC + chr(table) + struct.pack("<Q", 0))
+			self._samples = _Stage(iterHopsToSamples, first_amp, MAX_SAMPLE, MIN_SAMPLE)
+			self._buffer = self._buffer[6:]
+
+		out = []
+		i = 0 # Position in the buffer
+		while (i + 4 <= len(self._buffer)):
+			n_samples, code_bits = struct.unpack("=HH", self._buffer[i:i + 4])
+			size = (code_bits + 7) // 8
+			if (i + 4 + size > len(self._buffer)):
+				break
+
+			start = time.time()
+			sym = self._code.decode_codes(self._buffer[i + 4:i + 4 + size], code_bits)
+			sym = self._runs.push(np.frombuffer(sym, np.uint8))
+			if (len(sym) != n_samples):
+				raise ValueError("frame of %d samples with %d symbols" % (n_samples, len(sym)))
+			result = self._samples.push(symbolsToHops(sym))
+			out.append(np.frombuffer(result, np.int16).astype("<i2").tostring())
+			self.latency.update(time.time() - start)
+
+			i = i + 4 + size
+
+		self._buffer = self._buffer[i:]
+		return "".join(out)
+
+
+#*******************************************************************************#
+#	Function encodeFrames: This encodes an audio into a frame stream, frame by  #
+#	frame.                                                                      #
+#	Input: Samples (list, array or PCM string), samples per frame, quantizer    #
+#	and stats (optional)                                                        #
+#	Output: Frame stream (.lhe file content)                                    #
+#*******************************************************************************#
+
+def encodeFrames(samples, frame_size=FRAME_SIZE, quantizer="threshold", table=0, stats=None):
+	"""Returns the frame stream of an audio, as an Encoder gives it for
+	frames of frame_size samples.
+
+	Parameters: Samples (list or array of signed 16 bits integers, or PCM
+	string with signed 16 bits little endian integers, one channel),
+	number of samples per frame (up to MAX_FRAME_SIZE), quantizer (see
+	getHops), Huffman table (see Encoder) and stats object (see LHEstats,
+	None to keep no stats).
+
+	Exceptions: This function will throw a ValueError if the frames are
+	longer than MAX_FRAME_SIZE samples or the table is unknown.
+
+	"""
+
+	if isinstance(samples, (str, buffer, bytearray)):
+		samples = np.frombuffer(samples, "<i2")
+	samples = np.asarray(samples)
+
+	encoder = Encoder(quantizer, table, stats)
+	return "".join(encoder.push(samples[start:start + frame_size])
+		for start in range(0, len(samples), frame_size))
+
+
+#*******************************************************************************#
+#	Function decodeFrames: This decodes a whole frame stream.                   #
+#	Input: Frame stream (.lhe file content)                                     #
+#	Output: PCM samples (string)                                                #
+#*******************************************************************************#
+
+def decodeFrames(data):
+	"""Returns the raw samples of a frame stream.
+
+	Parameters: Frame stream (string, as encodeFrames or the pushes of an
+	Encoder give it).
+
+	Output: PCM samples (string with signed 16 bits little endian integers).
+
+	Exceptions: This function will throw a ValueError if it is not a frame
+	stream or its last frame is not complete.
+
+	"""
+
+	decoder = Decoder()
+	pcm = decoder.push(data)
+	if (decoder.buffered() > 0):
+		raise ValueError("truncated frame stream")
+
+	return pcm
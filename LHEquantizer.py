@@ -6,153 +6,198 @@ This module gets the hops lists of the 16 bits audio file given.
 # LHE Codec for Audio
 # Author: Eduardo Rodes Pastor
 
-import struct, wave
+import struct, os, mmap, array, bisect, errno, threading, collections
+import numpy as np
+
+import Auxiliary.wavio as wavio
 
 # --------------#
 # LHE QUANTIZER #
 # --------------#
 
+# Hops sorted by amplitude, from the most negative one to the most positive one.
+# This is the column order of the hop table rows.
+HOP_ORDER = ["A", "B", 0, 1, 2, 3, 4, 5, 6, 7, 8, "C", "D"]
+HOP_INDEX = dict((hop, i) for i, hop in enumerate(HOP_ORDER))
+
+# Every hop is kept as its index in HOP_ORDER (0 is hop 'A', 6 is the null hop
+# and 12 is hop 'D'), a signed byte in array('b') or NumPy int8 arrays.
+NULL_HOP = HOP_INDEX[4]
+SMALL_HOPS = (HOP_INDEX[3], HOP_INDEX[5]) # Hops 3, 4 and 5 are small (first and last index)
+POSITIVE_HOPS = range(NULL_HOP, len(HOP_ORDER)) # Search order of the hops, from the null one
+NEGATIVE_HOPS = range(NULL_HOP, -1, -1)
+
+# Prediction offsets for the next hop0 after every hop, sorted as in HOP_ORDER
+HOP_PREDICTION = [-300, -250, -200, -150, -100, -50, 0, 50, 100, 150, 200, 250, 300]
+
+# Hop1 interval: hop1 goes back to MAX_HOP1 after a big hop, and it gets
+# smaller in N_HOP1_STATES - 1 equal steps, down to MIN_HOP1, while the hops
+# are small (h1 adaptation mechanism)
+MAX_HOP1 = 327
+MIN_HOP1 = 27
+N_HOP1_STATES = 7
+
+# Every value hop1 can take in the default interval (327, 277, ..., 27)
+HOP1_STATES = [MAX_HOP1 - i * (MAX_HOP1 - MIN_HOP1) / (N_HOP1_STATES - 1) for i in range(N_HOP1_STATES)]
+HOP1_STATE = dict((hop1, i) for i, hop1 in enumerate(HOP1_STATES))
+
+# Hop1 intervals (max_hop1, min_hop1) of the rate control, from the default
+# one to the coarsest one. Bigger hop1 values give fewer bits per sample (and
+# a lower quality): on track1, from 3.4 bits per sample down to 1.7.
+RATE_LEVELS = [(327, 27), (427, 27), (527, 27), (727, 27), (1027, 127), (1527, 177),
+	(2027, 227), (3027, 327), (5027, 527), (8027, 827), (12027, 1227)]
+
+# Precomputed tables, cached on disk the first time they are needed: in the
+# LHE_TABLE_DIR directory if it is set, next to the codec modules otherwise.
+# If that directory is read-only, they go to FALLBACK_TABLE_DIR.
+TABLE_DIR = os.environ.get("LHE_TABLE_DIR") or os.path.dirname(os.path.abspath(__file__))
+FALLBACK_TABLE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lhe")
+
+HOP_TABLE_FILE = os.path.join(TABLE_DIR, "hop_table.bin")
+HOP_TABLE_MAGIC = "LHEHOP01"
+HOP_ROW = struct.Struct("<13i") # One row: the 13 hop amplitudes for a (hop0, hop1) pair
+
+THRESHOLD_TABLE_FILE = os.path.join(TABLE_DIR, "threshold_table.bin")
+THRESHOLD_TABLE_MAGIC = "LHETHR01"
+THRESHOLD_ROW = struct.Struct("<26i") # One row: the 13 hop amplitudes, the 12 thresholds between them and a monotony flag
+
+_hop_table = None # Memory-mapped hop table, loaded by getHopTable
+_threshold_table = None # Memory-mapped threshold table, loaded by getThresholdTable
+_table_lock = threading.RLock() # Threads load (or build) the tables one by one
+
+# Threshold tables of other hop1 intervals, built in memory when they are
+# needed (48 MB each), the most recently used ones last
+LEVEL_TABLES = 2
+_level_tables = collections.OrderedDict()
+
+# Quantizers available in getHops
+QUANTIZERS = ["exhaustive", "threshold"]
+
 #*******************************************************************************#
-#	Function getSamples: Given an audio file, this returns a list of its        #
-#	samples (scaled to 16 bits), its length, maximum and minimum value.         #
-#	Input: Input audio file                                                     #
-#	Output: Samples list, length of it, maximum and minimum sample values.      #
+#	Function getSamples: Given an audio file, this returns an array of its      #
+#	samples (scaled to 16 bits), its length, maximum and minimum value. The     #
+#	file is mapped (or read in big chunks), so this is fast even with long      #
+#	audios.                                                                     #
+#	Input: Input audio file, channel to be read (optional)                      #
+#	Output: Samples array, length of it, maximum and minimum sample values.     #
 #*******************************************************************************#
 
-def getSamples(filename):
-	"""Returns a list of samples of an audio file (scaled to 16 bits), 
+def getSamples(filename, channel=0):
+	"""Returns an array of samples of an audio file (scaled to 16 bits), 
 	its length, maximum and minimum value.
 
-	Parameters: Input audio file
+	8, 16, 24 and 32 bits PCM and 32 and 64 bits float .wav files are 
+	supported, with any number of channels. Only one channel is read.
 
-	Exceptions: This function does not throw an exception.
+	Parameters: Input audio file, channel to be read (the first one by 
+	default).
+
+	Exceptions: This function will throw a wave.Error if the file is not a
+	supported .wav file.
 
 	"""
 
-	# Loading audio file
-	file = wave.open(filename, "r")
-	n_samples = file.getnframes()
+	# 16 bits files are mapped, not read (the samples are only copied once)
+	frames, info = wavio.readWav(filename, mapped=True)
+	data = np.ascontiguousarray(frames[:, channel], np.int16)
+	s = len(data)
 
-	data = [0] * n_samples # List where we will save the samples values
+	if (s == 0):
+		max_sample, min_sample = 0, 0
+	else:
+		max_sample, min_sample = int(data.max()), int(data.min())
 
-	# We don't know how big are the samples, so we extract them with 'l' (32 bits)
-	for i in range(0, n_samples):
-		waveData = file.readframes(1)
-		try:
-			data[i] = int(struct.unpack("<h", waveData)[0])
-		except:
-			data[i] = int(struct.unpack("<hh", waveData)[0])
+	# array('h') gives python integers when indexed, which the quantizer loop needs
+	samples = array.array("h")
+	samples.fromstring(buffer(data))
+	return samples, s, max_sample, min_sample
 
-	return data, n_samples, max(data), min(data)
+#*******************************************************************************#
+#	Function nextHop: This gets the hop of a sample and its amplitude in a      #
+#	single pass, with a binary search over the decision thresholds of the       #
+#	(hop0, hop1) pair instead of checking the hops one by one. This is the      #
+#	threshold quantizer.                                                        #
+#	Input: Actual sample value, predicted amplitude (hop0), hop1 value,         #
+#	pre-selected hop and initial error.                                         #
+#	Output: Hop index and its amplitude                                         #
+#*******************************************************************************#
 
-def nextHop(acs, prs, hop1): # acs = actual sample, prs = previous sample
+def nextHop(acs, prs, hop1, hop_number, emin): # acs = actual sample, prs = previous sample
+	"""Returns the hop of the actual sample and its amplitude, with a
+	binary search over the decision thresholds of the threshold table.
+
+	The result is always the same one searchHop gives (exhaustive 
+	quantizer). searchHop moves away from the null hop while the error
+	decreases strictly, so when the hop amplitudes are strictly increasing 
+	it stops at the first hop whose threshold (twice the middle point 
+	between it and the next hop) is not crossed by twice the sample, ties
+	going to the hop closer to the null one: that is a binary search over 
+	the thresholds of one side. Rows whose amplitudes are not strictly
+	increasing (only near the limits of the 16 bits range, where amplitudes
+	are clipped or ratios are lower than 1) are flagged in the table and 
+	use searchHop. If the null hop error is not lower than emin, the 
+	pre-selected hop is kept, as searchHop does.
+
+	So getHops gives the same hops and amplitudes with the "threshold" and
+	the "exhaustive" quantizers, for every audio. test_quantizer checks it
+	on random (sample, hop0, hop1 state) cases, on the rows which are not
+	strictly increasing and on the audios of input_audio.
+
+	Parameters: Actual sample value, predicted amplitude (hop0), hop1 value,
+	pre-selected hop (index in HOP_ORDER) and initial error (maximum sample
+	value in getHops).
 
-	max_sample = 32768
-	min_sample = -32768
-	prs = prs - min_sample
-	acs = acs - min_sample
+	Exceptions: This function does not throw an exception.
 
-	percent_range = 0.8 # Factor for positive and negative ratios
-	rmax = 1.6 # Factor for ratio limits
-	hop_result = 0 # Final hop
-	sample_result = 0
+	"""
+	if (hop1 not in HOP1_STATE or prs < -32768 or prs > 32767):
+		# Not in the table
+		row = calculateHopsRow(prs, hop1)
+		hop_number = searchHop(acs, prs, row, hop_number, emin)
+		return hop_number, row[hop_number]
 
-	# Ratio values for positive hops	
-	ratio_pos = pow(percent_range * abs((max_sample - min_sample - 1 - prs)/(hop1)), 0.2) 
-	
-	# Ratio values for negative hops
-	ratio_neg = pow(percent_range * abs((prs)/(hop1)), 0.2) 	
-	
-	# Ratio limits
-	if (ratio_pos > rmax):
-		ratio_pos = rmax 
-	if (ratio_neg > rmax):
-		ratio_neg = rmax
+	table = _threshold_table
+	if (table is None):
+		table = getThresholdTable()
 
-	# --- AMPLITUDES COMPUTATION --- #
+	offset = ((prs + 32768) * len(HOP1_STATES) + HOP1_STATE[hop1]) * THRESHOLD_ROW.size
+	row = THRESHOLD_ROW.unpack_from(table, len(THRESHOLD_TABLE_MAGIC) + offset)
+
+	i = _thresholdSearch(acs, prs, row, hop_number, emin)
+	return i, row[i]
+
+def _thresholdSearch(acs, prs, row, i, emin):
+	"""Returns the hop index (position in HOP_ORDER) for the actual sample
+	given a threshold table row and the pre-selected hop index."""
+
+	if (not row[25]):
+		return searchHop(acs, prs, row, i, emin)
+
+	# Null hop error
+	if (abs(acs - row[6]) >= emin):
+		return i
+
+	# Thresholds are in positions 13 to 24 of the row
+	if (acs >= prs):
+		return bisect.bisect_left(row, 2 * acs, 19, 25) - 13 # Positive hops
+	else:
+		return bisect.bisect_right(row, 2 * acs, 13, 19) - 13 # Negative hops
 
-	h6 = prs
 
-	# Amplitude of positive hops
-	h7 = prs + hop1
-	h8 = int(prs + hop1 * ratio_pos) 
-	h9 = int(prs + hop1 * pow(ratio_pos, 2))
-	h10 = int(prs + hop1 * pow(ratio_pos, 3))
-	h11 = int(prs + hop1 * pow(ratio_pos, 4))
-	h12 = int(prs + hop1 * pow(ratio_pos, 5))
-
-	# Amplitude of negative hops	
-	h5 = prs - hop1
-	h4 = int(prs - hop1 * ratio_neg)
-	h3 = int(prs - hop1 * pow(ratio_neg, 2))
-	h2 = int(prs - hop1 * pow(ratio_neg, 3))
-	h1 = int(prs - hop1 * pow(ratio_neg, 4))
-	h0 = int(prs - hop1 * pow(ratio_neg, 5))
-
-	if ((acs >= h6 and acs < h7) or (acs > h5 and acs <= h6)):
-		hop_result = 4
-		sample_result = h6
-	elif (acs >= h7 and acs < h8):
-		hop_result = 5
-		sample_result = h7
-	elif (acs <= h5 and acs > h4):
-		hop_result = 3
-		sample_result = h5
-	elif (acs >= h8 and acs < h9):
-		hop_result = 6
-		sample_result = h8
-	elif (acs <= h4 and acs > h3):
-		hop_result = 2
-		sample_result = h4
-	elif (acs >= h9 and acs < h10):
-		hop_result = 7
-		sample_result = h9
-	elif (acs <= h3 and acs > h2):
-		hop_result = 1
-		sample_result = h3
-	elif (acs >= h10 and acs < h11):
-		hop_result = 8
-		sample_result = h10
-	elif (acs <= h2 and acs > h1):
-		hop_result = 0
-		sample_result = h2
-	elif (acs >= h11 and acs < h12):
-		hop_result = "C"
-		sample_result = h11
-	elif (acs <= h1 and acs > h0):
-		hop_result = "B"
-		sample_result = h1
-	elif (acs >= h12):
-		hop_result = "D"
-		sample_result = h12
-	elif (acs <= h0):
-		hop_result = "A"
-		sample_result = h0
-
-	if (sample_result <= 0):
-		sample_result = 1
-	if (sample_result > max_sample - min_sample):
-		sample_result = max_sample - min_sample - 1
-
-	sample_result = sample_result + min_sample
-	return hop_result, sample_result
-			
 #*******************************************************************************#
-#	Function calculateHops: This function calculates the hop assigned to a      #
-#	sample, according to the previous one in the following method. This         #
-#	is the LHE algorithm, so some knowledge about it is recommended to          #
-#	understand better what this function does.                                  #
-#	Input: Actual sample value, number of samples to the first hop, previous    #
-#	hop value, scaled maximum and minimum sample values.                        #
-#	Output: New hop value                                                       #
+#	Function calculateHopsRow: This function calculates the amplitudes of all  #
+#	the hops for a given predicted amplitude and hop1. This is the LHE          #
+#	algorithm, so some knowledge about it is recommended to understand better   #
+#	what this function does.                                                    #
+#	Input: Predicted amplitude value (hop0) and hop1 value.                     #
+#	Output: List with the amplitude of every hop, sorted as in HOP_ORDER        #
 #*******************************************************************************#
 
-def calculateHops(hop0, hop1, hop_number, max_sample, min_sample):
-	"""Returns the value of the new hop based on the calculations with
-	the previous one, actual sample value and distance to the first hop.
+def calculateHopsRow(hop0, hop1):
+	"""Returns the amplitudes of the 13 hops for a predicted amplitude, 
+	sorted as in HOP_ORDER (from hop 'A' to hop 'D').
 
-	Parameters: Actual sample value, number of samples to the first hop, 
-	previous hop value, scaled maximum and minimum sample values.
+	Parameters: Predicted amplitude value (hop0) and hop1 value.
 
 	Exceptions: This function does not throw an exception.
 	
@@ -165,7 +210,6 @@ def calculateHops(hop0, hop1, hop_number, max_sample, min_sample):
 
 	percent_range = 0.8 # Factor for positive and negative ratios
 	rmax = 1.6 # Factor for ratio limits
-	hop_result = 0 # Final hop
 
 	# Ratio values for positive hops	
 	ratio_pos = pow(percent_range * abs((max_sample - min_sample - 1 - hop0)/(hop1)), 0.2) 
@@ -195,80 +239,446 @@ def calculateHops(hop0, hop1, hop_number, max_sample, min_sample):
 	h1 = h2 * ratio_neg 
 	h0 = h1 * ratio_neg 
 
-	# Hop result values
-	if hop_number == 4:
-		hop_result = hop0  # Null hop
-	elif hop_number == 5:
-		hop_result = hop0 + hop1
-	elif hop_number == 3:
-		hop_result = hop0 - hop1
-	elif hop_number == 6:
-		hop_result = hop0 + int(h8)
-	elif hop_number == 2:
-		hop_result = hop0 - int(h4)
-	elif hop_number == 7:
-		hop_result = hop0 + int(h9)
-	elif hop_number == 1:
-		hop_result = hop0 - int(h3)
-	elif hop_number == 8:
-		hop_result = hop0 + int(h10)
-	elif hop_number == 0:
-		hop_result = hop0 - int(h2)
-	elif hop_number == "C":
-		hop_result = hop0 + int(h11)
-	elif hop_number == "B":
-		hop_result = hop0 - int(h1)
-	elif hop_number == "D":
-		hop_result = hop0 + int(h12)
-	elif hop_number == "A":
-		hop_result = hop0 - int(h0)
-
-	# Hop result limits
-	if (hop_result <= 0):
-		hop_result = 1
-	if (hop_result > max_sample - min_sample):
-		hop_result = max_sample - min_sample - 1
-
-	# We bring back the sample to the [-32768, 32767] interval
-	hop_result = hop_result + min_sample
-
-	return hop_result
+	# Hop result values, from hop 'A' to hop 'D'
+	row = [hop0 - int(h0), hop0 - int(h1), hop0 - int(h2), hop0 - int(h3), hop0 - int(h4),
+		hop0 - hop1, hop0, hop0 + hop1,
+		hop0 + int(h8), hop0 + int(h9), hop0 + int(h10), hop0 + int(h11), hop0 + int(h12)]
+
+	for i in range(0, len(row)):
+		# Hop result limits
+		if (row[i] <= 0):
+			row[i] = 1
+		if (row[i] > max_sample - min_sample):
+			row[i] = max_sample - min_sample - 1
+
+		# We bring back the sample to the [-32768, 32767] interval
+		row[i] = row[i] + min_sample
+
+	return row
+
+#*******************************************************************************#
+#	Function calculateHops: This function calculates the hop assigned to a      #
+#	sample, according to the previous one in the following method. This         #
+#	is the LHE algorithm, so some knowledge about it is recommended to          #
+#	understand better what this function does.                                  #
+#	Input: Actual sample value, number of samples to the first hop, previous    #
+#	hop value, scaled maximum and minimum sample values.                        #
+#	Output: New hop value                                                       #
+#*******************************************************************************#
+
+def calculateHops(hop0, hop1, hop_number, max_sample, min_sample):
+	"""Returns the value of the new hop based on the calculations with
+	the previous one, actual sample value and distance to the first hop.
+
+	Parameters: Actual sample value, number of samples to the first hop, 
+	previous hop value, scaled maximum and minimum sample values.
+
+	Exceptions: This function does not throw an exception.
+	
+	"""
+	return calculateHopsRow(hop0, hop1)[hop_number]
+
+
+def _calculateHopTable():
+	"""Returns every hop table row, as a little endian string. The rows are
+	computed with numpy, and some of them are checked against
+	calculateHopsRow."""
+
+	hops = _hopRows(HOP1_STATES)
+	for hop0 in range(-32768, 32768, 4099) + [32766, 32767]:
+		for i, hop1 in enumerate(HOP1_STATES):
+			assert list(hops[hop0 + 32768, i]) == calculateHopsRow(hop0, hop1), "hop table row (%d, %d)" % (hop0, hop1)
+
+	return hops.astype("<i4").tostring()
+
+def _hopRows(states):
+	"""Returns the hop table rows of some hop1 states, as a (65536, states,
+	13) numpy array."""
+
+	hops = np.empty((65536, len(states), 13), np.int64)
+	for i, hop1 in enumerate(states):
+		hops[:, i, :] = _calculateHopRows(hop1)
+
+	return hops
+
+def _calculateHopRows(hop1):
+	"""Returns the rows of calculateHopsRow for every hop0 (from -32768 to
+	32767) and a hop1 value, as a (65536, 13) numpy array. The operations
+	are the same ones, so the amplitudes are the same ones too."""
+
+	hop0 = np.arange(0, 65536, dtype=np.int64) # hop0 moved to [0, 65535]
+
+	ratio_pos = np.minimum(np.power(0.8 * ((65535 - hop0) // hop1), 0.2), 1.6)
+	ratio_neg = np.minimum(np.power(0.8 * (hop0 // hop1), 0.2), 1.6)
+
+	rows = np.empty((65536, 13), np.int64)
+	rows[:, 5] = hop0 - hop1
+	rows[:, 6] = hop0
+	rows[:, 7] = hop0 + hop1
+
+	h = hop1 * ratio_pos
+	for j in range(8, 13): # Positive hops
+		rows[:, j] = hop0 + h.astype(np.int64)
+		h = h * ratio_pos
+	h = hop1 * ratio_neg
+	for j in range(4, -1, -1): # Negative hops
+		rows[:, j] = hop0 - h.astype(np.int64)
+		h = h * ratio_neg
+
+	rows[rows <= 0] = 1
+	rows[rows > 65536] = 65535
+	return rows - 32768
+
+def _thresholdRows(hops):
+	"""Returns the threshold table rows (little endian string) of some hop
+	table rows (numpy array with 13 amplitudes per row)."""
+
+	table = np.empty((len(hops), 26), "<i4")
+	table[:, 0:13] = hops
+	table[:, 13:25] = hops[:, 0:12] + hops[:, 1:13] # Twice the middle point of every pair of hops
+	table[:, 25] = np.all(hops[:, 1:13] > hops[:, 0:12], axis=1) # Strictly increasing amplitudes
+
+	return table.tostring()
+
+def _calculateThresholdTable():
+	"""Returns every threshold table row, as a little endian string."""
+
+	return _thresholdRows(np.frombuffer(getHopTable(), "<i4", offset=len(HOP_TABLE_MAGIC)).reshape(-1, 13))
+
+def _writeTable(filename, magic, table):
+	"""Writes a table file. We write a temporary file and rename it, so
+	other processes never see half a table."""
+
+	folder = os.path.dirname(filename)
+	if (folder and not os.path.isdir(folder)):
+		try:
+			os.makedirs(folder)
+		except OSError as e:
+			if (e.errno != errno.EEXIST): # Another process made it
+				raise
+
+	tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+	try:
+		f = open(tmp_filename, "wb")
+		try:
+			f.write(magic)
+			f.write(table)
+		finally:
+			f.close()
+		try:
+			os.rename(tmp_filename, filename)
+		except OSError:
+			if not os.path.exists(filename): # Windows does not replace files (another process wrote it)
+				raise
+	finally:
+		if os.path.exists(tmp_filename):
+			os.remove(tmp_filename)
+
+def _loadTable(filename, magic, row, calculate):
+	"""Returns a memory-mapped table, building its file if needed. If the
+	file can not be written, it goes to FALLBACK_TABLE_DIR, and if that
+	fails too, the table is built in memory."""
+
+	size = len(magic) + 65536 * len(HOP1_STATES) * row.size
+	fallback = os.path.join(FALLBACK_TABLE_DIR, os.path.basename(filename))
+
+	if (not _isTable(filename, size)):
+		if (fallback != filename and _isTable(fallback, size)):
+			filename = fallback # Built when the table directory was read-only
+		else:
+			table = calculate()
+			try:
+				_writeTable(filename, magic, table)
+			except (IOError, OSError):
+				try:
+					_writeTable(fallback, magic, table) # Read-only location
+					filename = fallback
+				except (IOError, OSError):
+					return magic + table
+
+	f = open(filename, "rb")
+	table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	f.close()
+
+	if (len(table) != size or table[:len(magic)] != magic):
+		table.close()
+		os.remove(filename) # Stale or broken table, we build it again
+		return _loadTable(filename, magic, row, calculate)
+
+	return table
+
+def _isTable(filename, size):
+	"""Tells if a table file exists with the right size."""
+
+	return os.path.exists(filename) and os.path.getsize(filename) == size
+
+#*******************************************************************************#
+#	Function buildHopTable: This writes the hop table file. It has a row with   #
+#	the 13 hop amplitudes for every possible hop0 (16 bits) and every hop1      #
+#	state, computed with numpy in the same way as calculateHopsRow, so it is    #
+#	bit-exact with it (some rows are checked against it).                       #
+#	Input: Path of the hop table file.                                          #
+#	Output: None, this function just creates the file.                          #
+#*******************************************************************************#
+
+def buildHopTable(filename):
+	"""Writes the hop table file: 13 signed 32 bits amplitudes for every
+	(hop0, hop1 state) pair, after an 8 bytes magic string.
+
+	Parameters: Path of the hop table file.
+
+	Exceptions: This function will throw an exception if the file can not
+	be written.
+
+	"""
+	_writeTable(filename, HOP_TABLE_MAGIC, _calculateHopTable())
+
+
+#*******************************************************************************#
+#	Function getHopTable: This returns the hop table, memory-mapped from its    #
+#	file. The file is built the first time if it does not exist yet.            #
+#	Input: Path of the hop table file (optional).                               #
+#	Output: Hop table (read-only buffer)                                        #
+#*******************************************************************************#
+
+def getHopTable(filename=HOP_TABLE_FILE):
+	"""Returns the memory-mapped hop table, building its file if needed.
+
+	If the file can not be written, the table is built in memory.
+
+	Parameters: Path of the hop table file (optional).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	global _hop_table
+
+	with _table_lock:
+		if (_hop_table is None):
+			_hop_table = _loadTable(filename, HOP_TABLE_MAGIC, HOP_ROW, _calculateHopTable)
+
+	return _hop_table
+
+
+#*******************************************************************************#
+#	Function getThresholdTable: This returns the threshold table used by the    #
+#	threshold quantizer, memory-mapped from its file. Every row has the 13 hop  #
+#	amplitudes of a (hop0, hop1) pair (as in the hop table), the 12 decision    #
+#	thresholds between consecutive hops and a flag which tells if the hop       #
+#	amplitudes are strictly increasing.                                         #
+#	Input: Path of the threshold table file (optional).                         #
+#	Output: Threshold table (read-only buffer)                                  #
+#*******************************************************************************#
+
+def getThresholdTable(filename=THRESHOLD_TABLE_FILE):
+	"""Returns the memory-mapped threshold table, building its file if 
+	needed (from the hop table).
+
+	Parameters: Path of the threshold table file (optional).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	global _threshold_table
+
+	with _table_lock:
+		if (_threshold_table is None):
+			_threshold_table = _loadTable(filename, THRESHOLD_TABLE_MAGIC, THRESHOLD_ROW, _calculateThresholdTable)
+
+	return _threshold_table
+
+
+#*******************************************************************************#
+#	Function getHop1States: This returns every value hop1 can take in a hop1    #
+#	interval.                                                                   #
+#	Input: Maximum and minimum hop1 (optional).                                 #
+#	Output: hop1 values, from the maximum one to the minimum one                #
+#*******************************************************************************#
+
+def getHop1States(max_hop1=MAX_HOP1, min_hop1=MIN_HOP1):
+	"""Returns the N_HOP1_STATES values of hop1 in the given interval, from
+	max_hop1 down to min_hop1 in equal (integer) steps. They are
+	HOP1_STATES for the default interval.
+
+	Parameters: Maximum and minimum hop1 values.
+
+	Exceptions: This function will throw a ValueError if the interval is
+	not valid (1 <= min_hop1 <= max_hop1 <= 65535).
+
+	"""
+	if not (1 <= min_hop1 <= max_hop1 <= 65535):
+		raise ValueError("bad hop1 interval [%d, %d]" % (min_hop1, max_hop1))
+
+	return [max_hop1 - i * (max_hop1 - min_hop1) / (N_HOP1_STATES - 1) for i in range(N_HOP1_STATES)]
+
+
+#*******************************************************************************#
+#	Function getLevelTable: This returns the threshold table of a hop1          #
+#	interval, with the rows of its hop1 states (see getThresholdTable).          #
+#	Input: Maximum and minimum hop1.                                            #
+#	Output: Threshold table (read-only buffer)                                  #
+#*******************************************************************************#
+
+def getLevelTable(max_hop1=MAX_HOP1, min_hop1=MIN_HOP1):
+	"""Returns the threshold table of a hop1 interval: the same layout as
+	the threshold table, with the states of getHop1States instead of
+	HOP1_STATES. The default interval gives the threshold table itself; the
+	other ones are built with numpy (a fraction of a second) and the last
+	LEVEL_TABLES ones are kept in memory.
+
+	Parameters: Maximum and minimum hop1 values.
+
+	Exceptions: This function will throw a ValueError if the interval is
+	not valid (see getHop1States).
+
+	"""
+	if (max_hop1 == MAX_HOP1 and min_hop1 == MIN_HOP1):
+		return getThresholdTable()
+
+	key = (max_hop1, min_hop1)
+	with _table_lock:
+		if (key in _level_tables):
+			table = _level_tables.pop(key)
+		else:
+			hops = _hopRows(getHop1States(max_hop1, min_hop1))
+			table = THRESHOLD_TABLE_MAGIC + _thresholdRows(hops.reshape(-1, 13))
+			while (len(_level_tables) >= LEVEL_TABLES):
+				_level_tables.popitem(last=False)
+		_level_tables[key] = table
+
+	return table
+
+
+#*******************************************************************************#
+#	Function getHopRow: This returns the amplitudes of all the hops for a given #
+#	predicted amplitude and hop1, reading them from the hop table.              #
+#	Input: Predicted amplitude value (hop0) and hop1 value.                     #
+#	Output: Tuple with the amplitude of every hop, sorted as in HOP_ORDER       #
+#*******************************************************************************#
+
+def getHopRow(hop0, hop1):
+	"""Returns the amplitudes of the 13 hops for a predicted amplitude, 
+	sorted as in HOP_ORDER. It gives the same values as calculateHopsRow.
+
+	Parameters: Predicted amplitude value (hop0) and hop1 value.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	if (hop1 not in HOP1_STATE or hop0 < -32768 or hop0 > 32767):
+		return calculateHopsRow(hop0, hop1) # Not in the table
+
+	table = _hop_table
+	if (table is None):
+		table = getHopTable()
+
+	offset = ((hop0 + 32768) * len(HOP1_STATES) + HOP1_STATE[hop1]) * HOP_ROW.size
+	return HOP_ROW.unpack_from(table, len(HOP_TABLE_MAGIC) + offset)
+
+
+#*******************************************************************************#
+#	Function searchHop: This looks for the best hop for a sample, checking the  #
+#	hops one by one from the null hop while the error keeps decreasing. This    #
+#	is the same search getHops does with the exhaustive quantizer.              #
+#	Input: Actual sample value, predicted amplitude (hop0), hop amplitudes row, #
+#	pre-selected hop and initial error.                                         #
+#	Output: Hop index                                                           #
+#*******************************************************************************#
+
+def searchHop(os, hop0, row, hop_number, emin):
+	"""Returns the hop for the actual sample, checking the hop amplitudes
+	one by one from the null hop while the error keeps decreasing.
+
+	Parameters: Actual sample value, predicted amplitude (hop0), hop 
+	amplitudes row (as in getHopRow), pre-selected hop index (returned if no
+	hop has an error lower than emin) and initial error emin.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	e2 = 0 # Computed error for each hop 
+	finbuc = 0 # We can optimize the code below with this
+
+	#Positive hops computation
+	if (os - hop0 >= 0): 
+		for j in POSITIVE_HOPS:
+			# We start checking the difference between the original amplitude and the cache
+			e2 = os - row[j]
+			if (e2 < 0): 
+				e2 = - e2
+				finbuc = 1 # When error is negative, we get the hop we need
+			if (e2 < emin):
+				hop_number = j # Hop assignment
+				emin = e2
+				if (finbuc == 1): # This avoids a useless iteration
+					break
+			else:
+				break
+
+	# Negative hops computation. Same bucle as before
+	else:
+		for j in NEGATIVE_HOPS:
+			e2 = row[j] - os  
+			if (e2 < 0): 
+				e2 = - e2
+				finbuc = 1 
+			if (e2 < emin): 
+				hop_number = j 
+				emin = e2
+				if (finbuc == 1):
+					break
+			else:
+				break 
+
+	return hop_number
 
 
 #*******************************************************************************#
 #	Function getHops: This gets a specific hop list given the samples values.   #
 #	The hop value will be predicted with the previous one.                      #   
 #	Input: scaled samples list, total number of samples, maximum and minimum    #
-#	sample value.                                                               #
-#	Output: audio hops []                                                       #
+#	sample value, quantizer and hop1 interval (optional).                       #
+#	Output: Hops array (indexes in HOP_ORDER) and amplitudes array              #
 #*******************************************************************************#
 
-def getHops(samples, n_samples, max_sample, min_sample):
-	"""Returns the hops lists for a given audio samples.
+def getHops(samples, n_samples, max_sample, min_sample, quantizer="exhaustive", max_hop1=MAX_HOP1, min_hop1=MIN_HOP1):
+	"""Returns the hops for a given audio samples, as their indexes in
+	HOP_ORDER (array('b')), and the amplitudes of the samples (array('h')).
+
+	The "exhaustive" quantizer checks the hops one by one. The 
+	"threshold" quantizer does a binary search over precomputed thresholds
+	(nextHop); it is faster and gives exactly the same hops.
+
+	Other hop1 intervals than the default one (see RATE_LEVELS) give fewer
+	bits; their hops are found by iterHops.
 
 	Parameters: Scaled samples list (signed 16 bits integers), 
-	total number of samples, maximum and minimum sample value.
+	total number of samples, maximum and minimum sample value, quantizer
+	(one of QUANTIZERS, "exhaustive" by default), maximum and minimum hop1.
 
-	This function does not throw an exception.
+	This function will throw a ValueError if the hop1 interval is not
+	valid.
 
 	"""	
 
-	# Hop1 interval: [1024, 2560], since we are working with 16 bits
-	max_hop1 = 327
-	min_hop1 = 27
+	if (quantizer == "threshold" or max_hop1 != MAX_HOP1 or min_hop1 != MIN_HOP1):
+		return _getHopsIter(samples, n_samples, max_sample, min_sample, quantizer, max_hop1, min_hop1)
+
+	# Hop1 interval: [1024, 2560], since we are working with 16 bits (the
+	# default one, MAX_HOP1 and MIN_HOP1, in steps of 50)
 
 	# We start in the center of the interval
 	start_hop1 = (max_hop1+min_hop1)/2 
 	hop1 = start_hop1
 
 	hop0 = 0 # Predicted amplitude signal
-	hop_number = 4 # Pre-selected hop -> 4 is null hop
+	hop_number = NULL_HOP # Pre-selected hop -> null hop
 	os = 0 # Original sample
 	amp = 0 # Amplitude position, from 0 to n_samples   
 	last_small_hop = "false" # Indicates if last hop is small. Used for h1 adaptation mechanism
 
-	hops = [-1] * n_samples # Final hop values
-	result = [-1] * n_samples # Final amplitude values
+	hops = array.array("b", [NULL_HOP]) * n_samples # Final hop values (indexes in HOP_ORDER)
+	result = array.array("h", [0]) * n_samples # Final amplitude values
 
 	s = 0 # Sample counter
 	k = 0 # Original color counter
@@ -281,36 +691,9 @@ def getHops(samples, n_samples, max_sample, min_sample):
 		# HOP0 PREDICTION #
 		# ------------------------------------------------------------------------------ #
 
-		# We just need the previous amplitude value.
+		# We just need the previous amplitude value and the offset of the previous hop
 		if (s > 0):
-			# hop0 = result[amp-1]
-			if hops[amp-1] == 4:
-				hop0 = result[amp-1]
-			elif hops[amp-1] == 5:
-				hop0 = result[amp-1] + 50
-			elif hops[amp-1] == 3:
-				hop0 = result[amp-1] - 50
-			elif hops[amp-1] == 6:
-				hop0 = result[amp-1] + 100
-			elif hops[amp-1] == 2:
-				hop0 = result[amp-1] - 100
-			elif hops[amp-1] == 7:
-				hop0 = result[amp-1] + 150
-			elif hops[amp-1] == 1:
-				hop0 = result[amp-1] - 150
-			elif hops[amp-1] == 8:
-				hop0 = result[amp-1] + 200
-			elif hops[amp-1] == 0:
-				hop0 = result[amp-1] - 200
-			elif hops[amp-1] == "C":
-				hop0 = result[amp-1] + 250
-			elif hops[amp-1] == "B":
-				hop0 = result[amp-1] - 250
-			elif hops[amp-1] == "D":
-				hop0 = result[amp-1] + 300
-			elif hops[amp-1] == "A":
-				hop0 = result[amp-1] - 300
-
+			hop0 = result[amp-1] + HOP_PREDICTION[hops[amp-1]]
 			if (hop0 < min_sample):
 				hop0 = min_sample
 			if (hop0 > max_sample):
@@ -321,6 +704,9 @@ def getHops(samples, n_samples, max_sample, min_sample):
 		# HOPS COMPUTATION #
 		# ---------------------------------------------------- #
 
+		# Amplitudes of every hop for this prediction, from the hop table
+		row = getHopRow(hop0, hop1)
+
 		# Initial error values 
 		emin = max_sample # Current minimum prediction error 
 		e2 = 0 # Computed error for each hop 
@@ -329,9 +715,9 @@ def getHops(samples, n_samples, max_sample, min_sample):
 
 		#Positive hops computation
 		if (os - hop0 >= 0): 
-			for j in [4, 5, 6, 7, 8, "C", "D"]:
+			for j in POSITIVE_HOPS:
 				# We start checking the difference between the original amplitude and the cache
-				e2 = os - calculateHops(hop0, hop1, j, max_sample, min_sample)
+				e2 = os - row[j]
 				if (e2 < 0): 
 					e2 = - e2
 					finbuc = 1 # When error is negative, we get the hop we need
@@ -345,8 +731,8 @@ def getHops(samples, n_samples, max_sample, min_sample):
 
 		# Negative hops computation. Same bucle as before
 		else:
-			for j in [4, 3, 2, 1, 0, "B", "A"]:
-				e2 = calculateHops(hop0, hop1, j, max_sample, min_sample) - os  
+			for j in NEGATIVE_HOPS:
+				e2 = row[j] - os  
 				if (e2 < 0): 
 					e2 = - e2
 					finbuc = 1 
@@ -359,13 +745,13 @@ def getHops(samples, n_samples, max_sample, min_sample):
 					break 
 
 		# Assignment of final value
-		#hops[amp], result[amp] = nextHop(os, hop0, hop1)
-		result[amp] = calculateHops(hop0, hop1, hop_number, max_sample, min_sample) # Final amplitude
+		#hops[amp], result[amp] = nextHop(os, hop0, hop1, hop_number, max_sample)
+		result[amp] = row[hop_number] # Final amplitude
 		hops[amp] = hop_number  # Final hop value
 
 		# Tunning hop1 for the next hop ("h1 adaptation")
 		small_hop = "false" 
-		if (type(hop_number) is int and hop_number <= 5 and hop_number >= 3): 
+		if (hop_number >= SMALL_HOPS[0] and hop_number <= SMALL_HOPS[1]): 
 			small_hop = "true" # Hop 4 is in the center and is null.
 		else:
 			small_hop = "false"      
@@ -385,4 +771,160 @@ def getHops(samples, n_samples, max_sample, min_sample):
 		s = s + 1 
 		k = k + 1
 
-	return hops, result
\ No newline at end of file
+	return hops, result
+
+
+def _getHopsIter(samples, n_samples, max_sample, min_sample, quantizer, max_hop1, min_hop1):
+	"""getHops with the threshold quantizer or another hop1 interval (see
+	iterHops)."""
+
+	for hops, result in iterHops([samples[0:n_samples]], max_sample, min_sample, quantizer, max_hop1, min_hop1):
+		return hops, result
+
+	return array.array("b"), array.array("h")
+
+
+#*******************************************************************************#
+#	Function iterHops: This is getHops for audios which come in chunks. The     #
+#	quantizer state (last amplitude, last hop, hop1 and last_small_hop) goes    #
+#	on from one chunk to the next one, so the hops are the same ones getHops    #
+#	would give for the whole audio.                                             #
+#	Input: Iterable of samples chunks, maximum and minimum sample value,        #
+#	quantizer and hop1 interval (optional).                                     #
+#	Output: Generator of (hops, amplitudes) arrays, one per chunk               #
+#*******************************************************************************#
+
+def iterHops(chunks, max_sample, min_sample, quantizer="exhaustive", max_hop1=MAX_HOP1, min_hop1=MIN_HOP1):
+	"""Yields the hops and amplitude arrays of every chunk of samples, as
+	getHops would give them for the whole audio.
+
+	It is the same loop as getHops, but hop1 is handled as an index in
+	its states (HOP1_STATES, or getHop1States for another hop1 interval),
+	and every sample needs a single threshold table row.
+
+	Parameters: Iterable of samples chunks (lists or arrays of signed 16 
+	bits integers), maximum and minimum sample value of the whole audio,
+	quantizer (one of QUANTIZERS), maximum and minimum hop1.
+
+	Exceptions: This function will throw a ValueError if the hop1 interval
+	is not valid.
+
+	"""
+
+	table = getLevelTable(max_hop1, min_hop1)
+	unpack_row = THRESHOLD_ROW.unpack_from
+	row_size = THRESHOLD_ROW.size
+	n_states = len(HOP1_STATES)
+	table_offset = len(THRESHOLD_TABLE_MAGIC) + 32768 * n_states * row_size
+	bisect_left, bisect_right = bisect.bisect_left, bisect.bisect_right
+	threshold = (quantizer == "threshold")
+	min_small, max_small = SMALL_HOPS
+
+	i = NULL_HOP # Pre-selected hop
+	state = n_states / 2 # We start in the center of the hop1 interval
+	last_small_hop = False
+	last_result = None # Last amplitude, None before the first sample
+
+	for samples in chunks:
+
+		n_samples = len(samples)
+		hops = array.array("b", [NULL_HOP]) * n_samples # Final hop values (indexes in HOP_ORDER)
+		result = array.array("h", [0]) * n_samples # Final amplitude values
+
+		for s in xrange(0, n_samples):
+
+			os = samples[s]
+
+			# HOP0 PREDICTION #
+			if (last_result is not None):
+				hop0 = last_result + HOP_PREDICTION[i]
+				if (hop0 < min_sample):
+					hop0 = min_sample
+				if (hop0 > max_sample):
+					hop0 = max_sample
+			else:
+				hop0 = os
+
+			# HOPS COMPUTATION (see nextHop) #
+			row = unpack_row(table, table_offset + (hop0 * n_states + state) * row_size)
+
+			if (not threshold or not row[25]):
+				i = searchHop(os, hop0, row, i, max_sample)
+			elif (abs(os - row[6]) < max_sample):
+				if (os >= hop0):
+					i = bisect_left(row, 2 * os, 19, 25) - 13
+				else:
+					i = bisect_right(row, 2 * os, 13, 19) - 13
+
+			last_result = row[i]
+			result[s] = last_result
+			hops[s] = i
+
+			# H1 ADAPTATION: hops 3, 4 and 5 are small #
+			small_hop = (i >= min_small and i <= max_small)
+			if (small_hop and last_small_hop):
+				if (state < n_states - 1):
+					state = state + 1
+			else:
+				state = 0
+			last_small_hop = small_hop
+
+		yield hops, result
+
+
+#*******************************************************************************#
+#	Function scanSamples: Given an audio file, this returns its length, maximum #
+#	minimum and first sample value, reading it in chunks and keeping nothing    #
+#	in memory.                                                                  #
+#	Input: Input audio file, channel to be read (optional)                      #
+#	Output: Length, maximum, minimum and first sample values                    #
+#*******************************************************************************#
+
+def scanSamples(filename, channel=0):
+	"""Returns the number of samples of an audio file, its maximum, minimum
+	and first sample value (scaled to 16 bits), as getSamples, but without
+	keeping the samples.
+
+	Parameters: Input audio file, channel to be read (the first one by 
+	default).
+
+	Exceptions: This function will throw a wave.Error if the file is not a
+	supported .wav file.
+
+	"""
+
+	n_samples = 0
+	max_sample, min_sample, first_sample = 0, 0, 0
+
+	for chunk in wavio.readChunks(filename):
+		chunk = chunk[:, channel]
+		if (n_samples == 0):
+			max_sample, min_sample, first_sample = -32768, 32767, int(chunk[0])
+		n_samples = n_samples + len(chunk)
+		max_sample = max(max_sample, int(chunk.max()))
+		min_sample = min(min_sample, int(chunk.min()))
+
+	return n_samples, max_sample, min_sample, first_sample
+
+
+#*******************************************************************************#
+#	Function iterSamples: Given an audio file, this reads its samples in chunks.#
+#	Input: Input audio file, channel to be read and samples per chunk           #
+#	(optional)                                                                  #
+#	Output: Generator of samples arrays                                         #
+#*******************************************************************************#
+
+def iterSamples(filename, channel=0, chunk_size=wavio.CHUNK_FRAMES):
+	"""Yields the samples of an audio file (scaled to 16 bits) in arrays of
+	chunk_size samples, as getSamples gives them.
+
+	Parameters: Input audio file, channel to be read (the first one by 
+	default), number of samples per chunk.
+
+	Exceptions: This function will throw a wave.Error if the file is not a
+	supported .wav file.
+
+	"""
+
+	for chunk in wavio.readChunks(filename, chunk_size):
+		yield array.array("h", np.ascontiguousarray(chunk[:, channel]).tostring())
@@ -0,0 +1,583 @@
+"""
+
+Encoding and decoding service of the codec: an HTTP server which takes
+raw samples or .wav files and sends their .lhe file back, and takes .lhe
+files and sends their samples back, so the codec is shared by many
+clients without running a program per file:
+
+  python LHEserver.py serve --port 8000 --jobs 4
+  curl --data-binary @input_audio/track1.wav "localhost:8000/encode?coder=range" > track1.lhe
+  curl --data-binary @track1.lhe localhost:8000/decode > track1.pcm
+  python LHEserver.py load input_audio/track1.wav --requests 200 --concurrency 16
+
+Every connection has a thread, which only reads and writes the sockets:
+the quantizer and entropy coder run in a pool of processes. At most
+max_requests requests are worked on at once; the next ones wait (up to
+max_pending of them) and the rest get a 503 answer at once. A request
+whose task takes more than task_timeout seconds gets a 504 answer: its
+worker may have been killed (the future of a killed worker never ends),
+so the pool is replaced. A request body is only read when the request
+gets its turn, so the sockets (not the memory of the server) keep the
+bodies of the waiting clients.
+
+Answers are buffered, not streamed: the whole .lhe file (or the whole
+decoded audio) is made by a process of the pool, pickled back to the
+server and only then sent, with its Content-Length. The first byte comes
+when the whole task is done, and a request takes about three times its
+answer in memory while it is sent.
+
+Requests:
+
+  POST /encode   Raw samples (signed 16 bits little endian) or a .wav file.
+                 Options in the query: quantizer, coder, block_size,
+                 bitrate and, for raw samples, channels and rate (a basic
+                 mono .lhe file without them).
+  POST /decode   A .lhe file. The samples are sent back as raw samples
+                 (interleaved), or as a .wav file with format=wav. Files
+                 with more than max_samples samples are refused.
+  GET  /stats    Counters of the server (JSON).
+
+"""
+# LHE Codec for Audio
+
+import argparse, BaseHTTPServer, cStringIO, httplib, json, multiprocessing, os, SocketServer
+import struct, sys, threading, time, urlparse, wave
+from concurrent import futures
+from concurrent.futures import process as pool_process
+import numpy as np
+
+import Auxiliary.wavio as wavio
+from LHEquantizer import getHopTable, getThresholdTable, QUANTIZERS
+from binary_enc import CODERS
+from audio_dec import writeAudio, SAMPLE_RATE
+from LHEcodec import encode_bytes, decode_samples, getShape
+
+PORT = 8000 # Default port of the server
+MAX_REQUESTS = None # Requests worked on at once (the number of processes by default)
+MAX_PENDING = 64 # Requests which can wait for their turn, the next ones are rejected
+MAX_BODY = 256 << 20 # Bytes of the longest request body
+MAX_SAMPLES = 128 << 20 # Samples (all the channels) of the longest decoded audio
+IO_CHUNK = 65536 # Bytes read from or written to a socket at once
+SOCKET_TIMEOUT = 60 # Seconds a client can keep the server waiting
+TASK_TIMEOUT = 600 # Seconds a request can take in the pool, its worker is taken as dead after them
+
+
+# --------------#
+# CODEC TASKS   #
+# --------------#
+
+# They run in the processes of the pool, so they must be module functions
+
+def _encodeTask(body, options):
+	"""Returns the .lhe file of some raw samples or a .wav file, with the
+	options of the request (see parseOptions)."""
+
+	n_channels, sample_rate = options["channels"], options["rate"]
+	if (body[0:4] == "RIFF"):
+		info = wavio.getWavInfo(cStringIO.StringIO(body))
+		data = body[info.data_offset:info.data_offset + info.n_frames * info.block_align]
+		body = wavio.framesToSamples(data, info).astype("<i2").tostring()
+		n_channels, sample_rate = info.n_channels, info.sample_rate
+	elif (len(body) % (2 * (n_channels or 1)) != 0):
+		raise ValueError("%d bytes are not whole frames of 16 bits samples" % len(body))
+
+	return encode_bytes(body, options["quantizer"], options["block_size"], 1, n_channels,
+		sample_rate, options["coder"], options["bitrate"])
+
+
+def _decodeTask(lhe, as_wav):
+	"""Returns the raw samples of a .lhe file, or its .wav file."""
+
+	samples, sample_rate = decode_samples(lhe)
+	if not as_wav:
+		return np.ascontiguousarray(samples, "<i2").tostring()
+
+	out = cStringIO.StringIO()
+	writeAudio(samples, out, sample_rate=sample_rate)
+	return out.getvalue()
+
+
+def _breakPool(pool):
+	"""Ends a pool which has a task that does not end: its processes are
+	killed and its other tasks fail, as Python 3 does when a worker dies.
+	The pool of the futures backport would wait for the dead worker
+	forever, and so would the exit of the server."""
+
+	processes, items = list(pool._processes), pool._pending_work_items
+	thread, results = pool._queue_management_thread, pool._result_queue
+
+	# A killed worker may keep the lock of a queue, so nothing waits for
+	# the queues or the thread of the pool at exit
+	results.cancel_join_thread()
+	pool._call_queue.cancel_join_thread()
+	pool_process._threads_queues.pop(thread, None)
+
+	pool.shutdown(wait=False)
+	for worker in processes:
+		worker.terminate()
+	for item in items.values():
+		if not item.future.done():
+			item.future.set_exception(RuntimeError("a process of the pool died"))
+	items.clear()
+	results.put(None) # Its thread ends when it has no tasks, if the queue still works
+
+
+def _prepareWorker():
+	"""Builds the tables of the quantizers once per process of the pool."""
+
+	getHopTable()
+	getThresholdTable()
+
+
+#*******************************************************************************#
+#	Function parseOptions: This reads the encoding options of the query of a     #
+#	request.                                                                    #
+#	Input: Query string                                                         #
+#	Output: Dictionary of options                                               #
+#*******************************************************************************#
+
+def parseOptions(query):
+	"""Returns the options of an encode request (quantizer, coder,
+	block_size, bitrate, channels, rate and format), with their defaults
+	for the ones not in the query.
+
+	Parameters: Query string of the request (as "coder=range&bitrate=128").
+
+	Exceptions: This function will throw a ValueError if an option is
+	unknown or its value is not valid.
+
+	"""
+
+	options = {"quantizer": "exhaustive", "coder": "huffman", "block_size": None,
+		"bitrate": None, "channels": None, "rate": SAMPLE_RATE, "format": "pcm"}
+	numbers = {"block_size": int, "bitrate": float, "channels": int, "rate": int}
+
+	for name, values in urlparse.parse_qs(query, keep_blank_values=True).iteritems():
+		if (name not in options):
+			raise ValueError("unknown option %s" % name)
+		value = values[-1]
+		if (name in numbers):
+			try:
+				value = numbers[name](value)
+			except ValueError:
+				raise ValueError("%s must be a number" % name)
+			if (value <= 0):
+				raise ValueError("%s must be positive" % name)
+		options[name] = value
+
+	if (options["quantizer"] not in QUANTIZERS):
+		raise ValueError("unknown quantizer %s" % options["quantizer"])
+	if (options["coder"] not in CODERS):
+		raise ValueError("unknown coder %s" % options["coder"])
+	if (options["format"] not in ("pcm", "wav")):
+		raise ValueError("unknown format %s" % options["format"])
+
+	return options
+
+
+# ---------#
+# SERVER   #
+# ---------#
+
+class Limiter(object):
+	"""Admission of the requests: up to max_requests at once, and up to
+	max_pending more waiting for their turn (see acquire)."""
+
+	def __init__(self, max_requests, max_pending=MAX_PENDING):
+		self.max_requests = max_requests
+		self.max_pending = max_pending
+		self.running = 0
+		self.pending = 0
+		self._condition = threading.Condition()
+
+	def acquire(self):
+		"""Waits for the turn of a request and returns True, or returns
+		False at once if too many requests are waiting already."""
+
+		with self._condition:
+			if (self.running >= self.max_requests):
+				if (self.pending >= self.max_pending):
+					return False
+				self.pending += 1
+				while (self.running >= self.max_requests):
+					self._condition.wait()
+				self.pending -= 1
+			self.running += 1
+			return True
+
+	def release(self):
+		"""Ends a request, so the next waiting one gets its turn."""
+
+		with self._condition:
+			self.running -= 1
+			self._condition.notify()
+
+
+class CodecServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""HTTP server of the codec (see the module description). Its pool and
+	limiter are shared by the threads of the connections."""
+
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 128
+
+	def __init__(self, address, jobs=None, max_requests=MAX_REQUESTS, max_pending=MAX_PENDING, task_timeout=TASK_TIMEOUT, max_samples=MAX_SAMPLES):
+		if (jobs is None):
+			jobs = multiprocessing.cpu_count()
+		if (max_requests is None):
+			max_requests = jobs
+
+		# Workers get the tables already built and memory-mapped
+		_prepareWorker()
+		self.jobs = jobs
+		self.pool = self._newPool()
+		self.task_timeout = task_timeout
+		self.max_samples = max_samples
+
+		self.limiter = Limiter(max_requests, max_pending)
+		self.counters = dict.fromkeys(["requests", "encoded", "decoded", "rejected",
+			"failed", "timeouts", "bytes_in", "bytes_out"], 0)
+		self._lock = threading.Lock()
+		BaseHTTPServer.HTTPServer.__init__(self, address, CodecHandler)
+
+	def _newPool(self):
+		"""Returns a pool of jobs processes, which build their tables."""
+
+		pool = futures.ProcessPoolExecutor(max_workers=self.jobs)
+		for i in range(self.jobs):
+			pool.submit(_prepareWorker)
+		return pool
+
+	def replacePool(self, pool):
+		"""Puts a new pool in place of one whose task did not end in time,
+		unless another thread did it already (see _breakPool)."""
+
+		with self._lock:
+			if (self.pool is not pool):
+				return
+			self.pool = self._newPool()
+		_breakPool(pool)
+
+	def count(self, name, value=1):
+		"""Adds a value to a counter of the server."""
+
+		with self._lock:
+			self.counters[name] += value
+
+	def stats(self):
+		"""Returns the counters, the requests worked on and the waiting ones."""
+
+		with self._lock:
+			stats = dict(self.counters)
+		stats["running"], stats["pending"] = self.limiter.running, self.limiter.pending
+		return stats
+
+	def server_close(self):
+		BaseHTTPServer.HTTPServer.server_close(self)
+		self.pool.shutdown()
+
+
+class CodecHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""Requests of a connection (see the module description). The
+	connection is kept open between requests."""
+
+	protocol_version = "HTTP/1.1"
+	timeout = SOCKET_TIMEOUT
+
+	def log_message(self, format, *args):
+		pass # One line per request would slow the server down
+
+	def do_GET(self):
+		if (urlparse.urlparse(self.path).path != "/stats"):
+			return self._answer(404, "no such resource\n")
+		self._answer(200, json.dumps(self.server.stats(), sort_keys=True) + "\n", "application/json")
+
+	def do_POST(self):
+		url = urlparse.urlparse(self.path)
+		server = self.server
+		server.count("requests")
+
+		if (url.path not in ("/encode", "/decode")):
+			return self._answer(404, "no such resource\n", close=True)
+		try:
+			options = parseOptions(url.query)
+			length = int(self.headers.get("Content-Length", -1))
+		except ValueError as e:
+			return self._answer(400, "%s\n" % e, close=True)
+		if (length < 0):
+			return self._answer(411, "Content-Length needed\n", close=True)
+		if (length > MAX_BODY):
+			return self._answer(413, "%d bytes at most\n" % MAX_BODY, close=True)
+
+		# The body waits in the socket until the request gets its turn
+		if not server.limiter.acquire():
+			server.count("rejected")
+			return self._answer(503, "too many requests\n", close=True, retry=True)
+		try:
+			body = self._readBody(length)
+			if (body is None):
+				return
+			server.count("bytes_in", length)
+
+			# The headers tell the work of a decode, so it is refused before it starts
+			if (url.path == "/decode"):
+				try:
+					n_samples, n_channels, sample_rate = getShape(body)
+				except (ValueError, IndexError, struct.error) as e:
+					server.count("failed")
+					return self._answer(400, "%s: %s\n" % (type(e).__name__, e))
+				if (n_samples * n_channels > server.max_samples):
+					server.count("failed")
+					return self._answer(413, "%d samples, %d at most\n" % (n_samples * n_channels, server.max_samples))
+
+			pool = server.pool
+			if (url.path == "/encode"):
+				task = pool.submit(_encodeTask, body, options)
+			else:
+				task = pool.submit(_decodeTask, body, options["format"] == "wav")
+			del body
+			try:
+				result = task.result(timeout=server.task_timeout)
+			except futures.TimeoutError:
+				# Too slow, or its worker was killed (out of memory...)
+				server.count("failed")
+				server.count("timeouts")
+				task.cancel()
+				server.replacePool(pool)
+				return self._answer(504, "no answer of the codec in %d s\n" % server.task_timeout)
+			except (ValueError, IndexError, struct.error, wave.Error) as e:
+				server.count("failed")
+				return self._answer(400, "%s: %s\n" % (type(e).__name__, e))
+			except Exception as e: # The worker died
+				server.count("failed")
+				return self._answer(500, "%s: %s\n" % (type(e).__name__, e))
+
+			server.count("encoded" if url.path == "/encode" else "decoded")
+			server.count("bytes_out", len(result))
+			self._answer(200, result, "application/octet-stream")
+		finally:
+			server.limiter.release()
+
+	def _readBody(self, length):
+		"""Returns the body of the request, read in pieces, or None if the
+		client closed the connection before sending all of it."""
+
+		pieces, remaining = [], length
+		while (remaining > 0):
+			piece = self.rfile.read(min(IO_CHUNK, remaining))
+			if not piece:
+				self.close_connection = 1
+				return None
+			pieces.append(piece)
+			remaining -= len(piece)
+
+		return "".join(pieces)
+
+	def _answer(self, status, data, content_type="text/plain", close=False, retry=False):
+		"""Sends an answer whose data is all in memory (see the module
+		description), with its length in the header. The connection is
+		closed after it if close is True, as the body of the request has
+		not been read."""
+
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(data)))
+		if retry:
+			self.send_header("Retry-After", "1")
+		if close:
+			self.send_header("Connection", "close")
+			self.close_connection = 1
+		self.end_headers()
+
+		view = buffer(data)
+		for start in range(0, len(data), IO_CHUNK):
+			self.wfile.write(view[start:start + IO_CHUNK])
+
+
+#*******************************************************************************#
+#	Function serve: This runs the server until it is interrupted.               #
+#	Input: Host, port, number of processes, requests worked on at once,         #
+#	waiting requests, task timeout and decoded samples limit (optional)         #
+#	Output: None                                                                #
+#*******************************************************************************#
+
+def serve(host="127.0.0.1", port=PORT, jobs=None, max_requests=MAX_REQUESTS, max_pending=MAX_PENDING, task_timeout=TASK_TIMEOUT, max_samples=MAX_SAMPLES):
+	"""Runs a CodecServer until the process gets a KeyboardInterrupt.
+
+	Parameters: Host and port to listen to, number of processes (all the
+	CPUs by default), requests worked on at once (the number of processes
+	by default), requests which can wait for their turn, seconds a
+	request can take in the pool and samples of the longest decoded audio.
+
+	Exceptions: This function will throw a socket.error if the port can
+	not be listened to.
+
+	"""
+
+	server = CodecServer((host, port), jobs, max_requests, max_pending, task_timeout, max_samples)
+	sys.stderr.write("listening on %s:%d\n" % server.server_address)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+# ---------------#
+# LOAD GENERATOR #
+# ---------------#
+
+#*******************************************************************************#
+#	Function loadTest: This sends the same request many times to a server,      #
+#	from several connections at once, and measures its answers.                 #
+#	Input: Host, port, path, request body, number of requests and of            #
+#	connections                                                                 #
+#	Output: Dictionary of results                                               #
+#*******************************************************************************#
+
+def loadTest(host, port, path, body, requests=100, concurrency=8):
+	"""Sends requests POST requests of the given body to a server, from
+	concurrency connections (one thread each, a new request as soon as the
+	answer of the previous one arrives), and returns the number of
+	requests, the answers per status, the seconds, the requests per second
+	and the mean, median, 99th percentile and maximum latency (ms) of the
+	successful ones.
+
+	Parameters: Host and port of the server, path (with the query) of the
+	requests, body (string), number of requests and number of connections.
+
+	Exceptions: This function does not throw an exception (the requests
+	which fail count as status 0).
+
+	"""
+
+	statuses = {}
+	latencies = []
+	lock = threading.Lock()
+	left = [requests]
+
+	def client():
+		connection = httplib.HTTPConnection(host, port, timeout=SOCKET_TIMEOUT)
+		while True:
+			with lock:
+				if (left[0] == 0):
+					break
+				left[0] -= 1
+
+			start = time.time()
+			try:
+				connection.request("POST", path, body, {"Content-Type": "application/octet-stream"})
+				response = connection.getresponse()
+				response.read()
+				status = response.status
+				if response.will_close:
+					connection.close()
+			except Exception:
+				status = 0
+				connection.close()
+			seconds = time.time() - start
+
+			with lock:
+				statuses[status] = statuses.get(status, 0) + 1
+				if (status == 200):
+					latencies.append(seconds)
+		connection.close()
+
+	start = time.time()
+	threads = [threading.Thread(target=client) for i in range(concurrency)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	seconds = time.time() - start
+
+	result = {"requests": requests, "concurrency": concurrency, "seconds": seconds,
+		"statuses": dict((str(status), n) for status, n in statuses.iteritems()),
+		"requests_per_s": statuses.get(200, 0) / seconds if seconds else 0.0}
+	if latencies:
+		ms = 1000.0 * np.array(latencies)
+		result.update({"mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+			"p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())})
+
+	return result
+
+
+# ---------------#
+# COMMAND LINE   #
+# ---------------#
+
+def _parser():
+	"""Returns the parser of the command line."""
+
+	parser = argparse.ArgumentParser(prog="LHEserver.py", description="LHE audio codec server.")
+	commands = parser.add_subparsers(dest="command")
+
+	def address(command):
+		command.add_argument("--host", default="127.0.0.1")
+		command.add_argument("-p", "--port", type=int, default=PORT)
+
+	server = commands.add_parser("serve", help="run the server")
+	address(server)
+	server.add_argument("-j", "--jobs", type=int, default=None,
+		help="number of processes (all the CPUs by default)")
+	server.add_argument("--max-requests", type=int, default=MAX_REQUESTS,
+		help="requests worked on at once (the number of processes by default)")
+	server.add_argument("--max-pending", type=int, default=MAX_PENDING,
+		help="requests which can wait for their turn, the next ones are rejected")
+	server.add_argument("--task-timeout", type=float, default=TASK_TIMEOUT, metavar="SECONDS",
+		help="seconds a request can take, then it gets a 504 answer and the "
+		"processes are replaced (%(default)d by default)")
+	server.add_argument("--max-samples", type=int, default=MAX_SAMPLES,
+		help="samples (all the channels) of the longest audio a request can "
+		"decode (%(default)d by default)")
+
+	load = commands.add_parser("load", help="send many requests to a server and "
+		"report the requests per second and their latency")
+	load.add_argument("input", metavar="FILE", help=".wav or .pcm file to encode, or .lhe file to decode")
+	address(load)
+	load.add_argument("-n", "--requests", type=int, default=100)
+	load.add_argument("-c", "--concurrency", type=int, default=8, help="number of connections")
+	load.add_argument("--query", default="", help='options of the requests (as "coder=range")')
+
+	return parser
+
+
+#*******************************************************************************#
+#	Function main: This runs the command line program.                          #
+#	Input: Command line arguments (optional)                                    #
+#	Output: Exit status                                                         #
+#*******************************************************************************#
+
+def main(argv=None):
+	"""Runs the server (serve), or a load test (load) which writes its
+	results as JSON and returns 1 if some request failed.
+
+	Parameters: Command line arguments (sys.argv[1:] by default).
+
+	Exceptions: This function exits (SystemExit) if the arguments are
+	wrong.
+
+	"""
+
+	args = _parser().parse_args(argv)
+
+	if (args.command == "serve"):
+		serve(args.host, args.port, args.jobs, args.max_requests, args.max_pending, args.task_timeout, args.max_samples)
+		return 0
+
+	fp = open(args.input, "rb")
+	body = fp.read()
+	fp.close()
+
+	path = "/decode" if (os.path.splitext(args.input)[1].lower() == ".lhe") else "/encode"
+	if args.query:
+		path = path + "?" + args.query
+
+	result = loadTest(args.host, args.port, path, body, args.requests, args.concurrency)
+	print json.dumps(result, indent=1, sort_keys=True)
+	return int(result["statuses"].get("200", 0) != args.requests)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
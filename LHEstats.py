@@ -0,0 +1,223 @@
+"""
+
+This module keeps statistics of the encoder: the time spent in every stage
+(ingest, quantize, run-compress, entropy and write) and some counters of
+the hops and symbols, so slow encodes and big files can be explained.
+
+  stats = CodecStats()
+  lhe = encode_bytes(pcm, stats=stats)
+  print stats.as_dict()["bits_per_symbol"]
+  stats.writeJsonLine("stats.jsonl", file="track1.wav")
+
+The encoder functions take an optional stats object and do not keep
+anything without it. The time spent counting goes to a "stats" stage of
+its own, so the other stages are not slowed down by it.
+
+"""
+# LHE Codec for Audio
+
+import contextlib, json, time
+import numpy as np
+
+from LHEquantizer import HOP_ORDER, HOP1_STATES, HOP1_STATE, SMALL_HOPS, NULL_HOP
+from binary_enc import ONE, X
+
+STAGES = ["ingest", "quantize", "run-compress", "entropy", "write"]
+
+# hop1 state of the first sample of an audio (or block), as in the quantizer
+FIRST_HOP1_STATE = HOP1_STATE[(327 + 27) / 2]
+
+# Counters which keep the maximum value instead of the sum
+MAX_COUNTERS = ["max_null_run"]
+
+
+class CodecStats(object):
+	"""Time per stage and counters of one or several encodes.
+
+	times: seconds per stage. Time spent in a stage inside another one
+	(as in nested generators) only counts for the inner one.
+
+	counters: numbers, or dictionaries of numbers (histograms), added up
+	over all the samples encoded with this object.
+
+	"""
+
+	def __init__(self):
+		self.times = dict((stage, 0.0) for stage in STAGES)
+		self.counters = {}
+		self._stack = [] # [stage, start, time of the stages inside it]
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""Adds the time spent in the with block to the given stage."""
+
+		frame = [name, time.time(), 0.0]
+		self._stack.append(frame)
+		try:
+			yield
+		finally:
+			self._stack.pop()
+			elapsed = time.time() - frame[1]
+			self.times[name] = self.times.get(name, 0.0) + elapsed - frame[2]
+			if self._stack:
+				self._stack[-1][2] += elapsed
+
+	def timed(self, iterable, name):
+		"""Yields the items of an iterable, adding the time spent getting
+		every one of them to the given stage."""
+
+		iterator = iter(iterable)
+		while True:
+			with self.stage(name):
+				try:
+					item = next(iterator)
+				except StopIteration:
+					return
+			yield item
+
+	def add(self, name, value):
+		"""Adds a number, or a dictionary of numbers, to a counter."""
+
+		if isinstance(value, dict):
+			counter = self.counters.setdefault(name, {})
+			for key, n in value.iteritems():
+				counter[key] = counter.get(key, 0) + n
+		elif (name in MAX_COUNTERS):
+			self.counters[name] = max(self.counters.get(name, 0), value)
+		else:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	def merge(self, other):
+		"""Adds the times and counters of other stats (a CodecStats or what
+		its as_dict returns) to these ones."""
+
+		if isinstance(other, CodecStats):
+			other = other.as_dict()
+		for name, seconds in other["times"].iteritems():
+			self.times[name] = self.times.get(name, 0.0) + seconds
+		for name, value in other["counters"].iteritems():
+			self.add(name, value)
+
+	def countHops(self, hops, carry=None, hop1_states=HOP1_STATES):
+		"""Counts the hops, the hop1 value used by every sample (the h1
+		adaptation only depends on the hops) and the null hop chains, and
+		returns what the next chunk of hops needs (None at the start).
+
+		Parameters: Hops array (indexes in HOP_ORDER), the state returned
+		for the previous chunk of the same audio, if any, and hop1 values of
+		the hop1 interval of the hops (see getHop1States).
+
+		Exceptions: This function does not throw an exception.
+
+		"""
+
+		hops = np.frombuffer(hops, np.int8) if not isinstance(hops, np.ndarray) else hops
+		n = len(hops)
+		first_state, small_run, null_run = carry if carry else (FIRST_HOP1_STATE, 0, 0)
+		if (n == 0):
+			return first_state, small_run, null_run
+
+		counts = np.bincount(hops, minlength=len(HOP_ORDER))
+		self.add("hops", dict((str(HOP_ORDER[i]), int(counts[i])) for i in range(len(HOP_ORDER))))
+		self.add("samples", n)
+
+		# hop1 state after every hop: 0 unless this hop and the one before are
+		# small, one more for every small hop in a row (up to the last state)
+		index = np.arange(n)
+		small = (hops >= SMALL_HOPS[0]) & (hops <= SMALL_HOPS[1])
+		last_big = np.maximum.accumulate(np.where(small, -1, index))
+		run = index - last_big + np.where(last_big < 0, small_run, 0) # Small hops in a row, this one included
+		after = np.where(small, np.minimum(run - 1, len(HOP1_STATES) - 1), 0)
+		states = np.concatenate(([first_state], after[:-1]))
+		occupancy = np.bincount(states, minlength=len(HOP1_STATES))
+		self.add("hop1", dict((str(hop1_states[i]), int(occupancy[i])) for i in range(len(HOP1_STATES))))
+
+		# Null hop chains (the ones 'X' symbols compress)
+		null = np.zeros(n + 2, np.int8)
+		null[1:n + 1] = (hops == NULL_HOP)
+		edges = np.diff(null)
+		starts = np.flatnonzero(edges == 1)
+		ends = np.flatnonzero(edges == -1)
+		lengths = ends - starts
+		self.add("null_hops", int(lengths.sum()))
+		if (len(lengths) > 0 and starts[0] == 0 and null_run > 0):
+			lengths[0] += null_run # The chain of the previous chunk goes on
+			self.add("null_runs", -1)
+		self.add("null_runs", len(lengths))
+		if (len(lengths) > 0):
+			self.add("max_null_run", int(lengths.max()))
+
+		small_end = int(run[-1]) if small[-1] else 0
+		null_end = int(lengths[-1]) if (len(lengths) > 0 and ends[-1] == n) else 0
+		return int(after[-1]), small_end, null_end
+
+	def countSymbols(self, sym):
+		"""Counts the symbols given by the dynamic compressor: all of them,
+		'X' symbols and '1' symbols (null hops not compressed)."""
+
+		sym = np.frombuffer(sym, np.uint8) if not isinstance(sym, np.ndarray) else sym
+		self.add("run_symbols", len(sym))
+		self.add("x_symbols", int(np.count_nonzero(sym == X)))
+		self.add("one_symbols", int(np.count_nonzero(sym == ONE)))
+
+	def as_dict(self):
+		"""Returns the times and counters, and some values computed from
+		them: bits per symbol of the entropy coder, null hops per 'X' symbol,
+		mean null hop chain and total bytes."""
+
+		counters = self.counters
+		derived = {}
+		if counters.get("symbols"):
+			derived["bits_per_symbol"] = counters.get("code_bits", 0) / float(counters["symbols"])
+		if counters.get("x_symbols"):
+			derived["null_hops_per_x"] = (counters.get("null_hops", 0) -
+				counters.get("one_symbols", 0)) / float(counters["x_symbols"])
+		if counters.get("null_runs"):
+			derived["mean_null_run"] = counters.get("null_hops", 0) / float(counters["null_runs"])
+		derived["total_bytes"] = (counters.get("header_bytes", 0) + counters.get("table_bytes", 0) +
+			counters.get("code_bytes", 0))
+		if counters.get("samples"):
+			derived["bits_per_sample"] = 8.0 * derived["total_bytes"] / counters["samples"]
+
+		result = {"times": dict(self.times), "counters": json.loads(json.dumps(counters))}
+		result.update(derived)
+		return result
+
+	def writeJsonLine(self, filename_or_file, **extra):
+		"""Appends the stats (as_dict, with the extra keys given, such as
+		the file name) to a JSON lines file, as a single line."""
+
+		record = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+		record.update(self.as_dict())
+		record.update(extra)
+		line = json.dumps(record, sort_keys=True) + "\n"
+
+		if hasattr(filename_or_file, "write"):
+			filename_or_file.write(line)
+		else:
+			fp = open(filename_or_file, "a")
+			fp.write(line)
+			fp.close()
+
+
+class NoStats(CodecStats):
+	"""Stats which keep nothing, for the encoders called without stats."""
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		yield
+
+	def timed(self, iterable, name):
+		return iterable
+
+	def add(self, name, value):
+		pass
+
+	def countHops(self, hops, carry=None, hop1_states=HOP1_STATES):
+		pass
+
+	def countSymbols(self, sym):
+		pass
+
+
+NO_STATS = NoStats()
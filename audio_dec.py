@@ -6,83 +6,84 @@ This module gets and saves the decoded audio, given its symbols lists.
 # LHE Codec for Audio
 # Author: Eduardo Rodes Pastor
 
-import struct, wave
-from example import calculateHops, nextHop
+import array
+import numpy as np
+import Auxiliary.wavio as wavio
+from LHEquantizer import calculateHopsRow, getHopRow, getHop1States, getLevelTable, HOP_PREDICTION, SMALL_HOPS, MAX_HOP1, MIN_HOP1, THRESHOLD_ROW, THRESHOLD_TABLE_MAGIC
+from binary_enc import HOP_SYMBOLS
+
+SAMPLE_RATE = 48000 # Sample rate of the audios whose .lhe file does not keep it
+
+# Hop (index in HOP_ORDER) of every symbol, by its character code
+SYMBOL_HOPS = np.zeros(256, np.int8)
+SYMBOL_HOPS[HOP_SYMBOLS] = np.arange(len(HOP_SYMBOLS))
 
 # --------------#
 # AUDIO DECODER #
 # --------------#
 
 #*******************************************************************************#
-#	Function symbolsToHops: Given a list of symbols, this returns a list of the #
-#	hops they represent. We will use a list called distribution which will work #
-#	as a dictionary.                                                            #
-#	Input: Symbols list.                                                        #
-#	Output: Hops list.                                                          #
+#	Function symbolsToHops: Given an array of symbols, this returns an array   #
+#	of the hops they represent. We will use an array called SYMBOL_HOPS which   #
+#	will work as a dictionary.                                                  #
+#	Input: Symbols array.                                                       #
+#	Output: Hops array.                                                         #
 #*******************************************************************************#
 
 def symbolsToHops(sym): 
-	"""Transforms a symbols list into its respective hops one.
+	"""Transforms a symbols array into its respective hops one.
+
+	Parameters: symbols array (uint8, the characters of the symbols, as
+	expandSymbols gives them) or string.
 
-	Parameters: symbols list (integers from 1 to 9)
+	Output: Hops array (array('b') of indexes in HOP_ORDER).
 
 	Exceptions: This function does not throw an exception.
 
 	"""
 
-	hops = [0] * len(sym)
-
-	distribution = [4, 5, 3, 6, 2, 7, 1, 8, 0] # Distribution of hops (0, +1, -1, +2...)
-
-	# Hop calculation
-	for i in range(0, len(sym)):
-
-		# If the symbol is '1', hop will always be 4. Otherwise, we check distribution:
-		if (sym[i] == '1'):
-			hops[i] = 4
-			continue
-		elif type(sym[i]) is int:
-			hops[i] = distribution[int(sym[i])-1]
-			continue
-		else:
-			hops[i] = sym[i]
-
-	return hops
+	return array.array("b", SYMBOL_HOPS[np.frombuffer(sym, np.uint8)].tostring())
 
 
 #*******************************************************************************#
 #	Function hopsToSamples: This gets a specific samples list given its hops    #
 #	list. This method is similar to GetHops in LHEquantizer, since this is its  #
 #	inverse function.                                                           #
-#	Input: hops list (integers from 0 to 8), first amplitude value, number of   #
-#	samples, maximum sample value and minimum sample value.                     #
-#	Output: component samples list (signed integers with 16 bits)               #
+#	Input: hops array (indexes in HOP_ORDER), first amplitude value, number of  #
+#	samples, maximum sample value, minimum sample value and hop1 interval       #
+#	(optional).                                                                 #
+#	Output: component samples array (signed integers with 16 bits)              #
 #*******************************************************************************#
 
-def hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample):
+def hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample, max_hop1=MAX_HOP1, min_hop1=MIN_HOP1):
 	"""Returns the audio samples values given their hops list.
 
-	Parameters: hops list (integers from 0 to 8), first amplitude value, number of samples,
-	maximum sample value and minimum sample value.
+	Parameters: hops array (indexes in HOP_ORDER, as symbolsToHops gives
+	them), first amplitude value, number of samples, maximum sample value,
+	minimum sample value, maximum and minimum hop1 (the interval the 
+	encoder used, see getHops).
 
-	Exceptions: This function does not throw an exception.
+	Output: Samples array (array('h')).
+
+	Exceptions: This function will throw a ValueError if the hop1 interval
+	is not valid.
 
 	"""
 
+	if (max_hop1 != MAX_HOP1 or min_hop1 != MIN_HOP1):
+		return _hopsToSamplesLevel(hops, first_amp, n_samples, max_sample, min_sample, max_hop1, min_hop1)
+
 	# Hop1 interval: [1024, 2560], since we are working with 16 bits
-	max_hop1 = 327
-	min_hop1 = 27
 
 	# We start in the center of the interval
 	start_hop1 = (max_hop1 + min_hop1) / 2 
 	hop1 = start_hop1
 
 	hop0 = 0 # Predicted amplitude signal
-	hop_number = 4 # Pre-selected hop -> 4 is null hop
 	amp = 0 # Amplitude position, from 0 to image size        
 	last_small_hop = "false" # Indicates if last hop is small. Used for h1 adaptation mechanism
 
-	result = [-1] * n_samples  # List where we will save the samples values
+	result = array.array("h", [0]) * n_samples # Array where we will save the samples values
 
 	s = 0 # Sample counter
 
@@ -95,33 +96,7 @@ def hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample):
 
 		# We just need the previous amplitude value, since audio amplitude is a continuous function
 		if (s > 0):
-			if hops[amp-1] == 4:
-				hop0 = result[amp-1]
-			elif hops[amp-1] == 5:
-				hop0 = result[amp-1] + 50
-			elif hops[amp-1] == 3:
-				hop0 = result[amp-1] - 50
-			elif hops[amp-1] == 6:
-				hop0 = result[amp-1] + 100
-			elif hops[amp-1] == 2:
-				hop0 = result[amp-1] - 100
-			elif hops[amp-1] == 7:
-				hop0 = result[amp-1] + 150
-			elif hops[amp-1] == 1:
-				hop0 = result[amp-1] - 150
-			elif hops[amp-1] == 8:
-				hop0 = result[amp-1] + 200
-			elif hops[amp-1] == 0:
-				hop0 = result[amp-1] - 200
-			elif hops[amp-1] == "C":
-				hop0 = result[amp-1] + 250
-			elif hops[amp-1] == "B":
-				hop0 = result[amp-1] - 250
-			elif hops[amp-1] == "D":
-				hop0 = result[amp-1] + 300
-			elif hops[amp-1] == "A":
-				hop0 = result[amp-1] - 300
-				
+			hop0 = result[amp-1] + HOP_PREDICTION[hops[amp-1]]
 			if (hop0 < min_sample):
 				hop0 = min_sample
 			if (hop0 > max_sample):
@@ -130,11 +105,11 @@ def hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample):
 			hop0 = first_amp # If there isn't previous value, we are in the first sample
 
 		# Assignment of final value
-		result[amp] = calculateHops(hop0, hop1, hop_number, max_sample, min_sample) # Final amplitude
+		result[amp] = getHopRow(hop0, hop1)[hop_number] # Final amplitude, from the hop table
 
 		# Tunning hop1 for the next hop ("h1 adaptation")
 		small_hop = "false" 
-		if (type(hop_number) is int and hop_number <= 5 and hop_number >= 3): 
+		if (hop_number >= SMALL_HOPS[0] and hop_number <= SMALL_HOPS[1]): 
 			small_hop = "true" # Hop 4 is in the center and is null
 		else:
 			small_hop = "false"      
@@ -152,41 +127,162 @@ def hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample):
 		amp = amp + 1
 		s = s + 1
 
-	# We give the result list a more readable format
-	for i in range(0, len(result)):
-		result[i] = int(result[i]) 
-
 	return result 
 
 
+def _hopsToSamplesLevel(hops, first_amp, n_samples, max_sample, min_sample, max_hop1, min_hop1):
+	"""hopsToSamples for a hop1 interval which is not the default one (see
+	iterHopsToSamples)."""
+
+	for result in iterHopsToSamples([hops[0:n_samples]], first_amp, max_sample, min_sample, max_hop1, min_hop1):
+		return result
+
+	return array.array("h")
+
+
+#*******************************************************************************#
+#	Function iterHopsToSamples: This is hopsToSamples for hops which come in    #
+#	chunks. The decoder state (last amplitude, last hop, hop1 and               #
+#	last_small_hop) goes on from one chunk to the next one, as in iterHops.     #
+#	Input: Iterable of hops arrays, first amplitude value, maximum and minimum  #
+#	sample value and hop1 interval (optional).                                  #
+#	Output: Generator of samples arrays, one per chunk                          #
+#*******************************************************************************#
+
+def iterHopsToSamples(hops_chunks, first_amp, max_sample, min_sample, max_hop1=MAX_HOP1, min_hop1=MIN_HOP1):
+	"""Yields the samples of every chunk of hops, as hopsToSamples would
+	give them for the whole hops list.
+
+	hop1 is an index in its states, as in iterHops, and the amplitudes
+	come from the threshold table of the hop1 interval (getLevelTable).
+
+	Parameters: Iterable of hops arrays (indexes in HOP_ORDER), first
+	amplitude value, maximum and minimum sample value, maximum and minimum
+	hop1 (the interval the encoder used, see getHops).
+
+	Exceptions: This function will throw a ValueError if the hop1 interval
+	is not valid.
+
+	"""
+
+	states = getHop1States(max_hop1, min_hop1)
+	table = getLevelTable(max_hop1, min_hop1)
+	unpack_row = THRESHOLD_ROW.unpack_from
+	row_size = THRESHOLD_ROW.size
+	n_states = len(states)
+	table_offset = len(THRESHOLD_TABLE_MAGIC) + 32768 * n_states * row_size
+	min_small, max_small = SMALL_HOPS
+
+	state = n_states / 2 # We start in the center of the hop1 interval
+	last_small_hop = False
+	last_hop = None # Last hop, None before the first sample
+	last_result = 0
+
+	for hops in hops_chunks:
+
+		n_samples = len(hops)
+		result = array.array("h", [0]) * n_samples
+
+		for s in xrange(0, n_samples):
+
+			hop_number = hops[s]
+
+			# HOP0 PREDICTION #
+			if (last_hop is not None):
+				hop0 = last_result + HOP_PREDICTION[last_hop]
+				if (hop0 < min_sample):
+					hop0 = min_sample
+				if (hop0 > max_sample):
+					hop0 = max_sample
+			else:
+				hop0 = first_amp
+
+			if (hop0 < -32768 or hop0 > 32767):
+				last_result = calculateHopsRow(hop0, states[state])[hop_number] # Not in the table
+			else:
+				last_result = unpack_row(table, table_offset + (hop0 * n_states + state) * row_size)[hop_number]
+			result[s] = last_result
+			last_hop = hop_number
+
+			# H1 ADAPTATION #
+			small_hop = (hop_number >= min_small and hop_number <= max_small)
+			if (small_hop and last_small_hop):
+				if (state < n_states - 1):
+					state = state + 1
+			else:
+				state = 0
+			last_small_hop = small_hop
+
+		yield result
+
+
+#*******************************************************************************#
+#	Function writeAudio: This writes some samples into a .wav file (or file     #
+#	object) in a single write, with their number of channels and sample rate.   #
+#	Input: Samples, output file or file object, number of channels and sample   #
+#	rate (optional)                                                             #
+#	Output: None, just writes the audio                                         #
+#*******************************************************************************#
+
+def writeAudio(samples, output, n_channels=None, sample_rate=SAMPLE_RATE):
+	"""Writes a 16 bits .wav file with the given samples. An array of
+	signed 16 bits integers (as decode_samples gives them) is written as
+	it is, without any copy.
+
+	Parameters: Samples (numpy array with a row per frame and a column per
+	channel, or interleaved samples: list, array('h'), numpy array or
+	string of signed 16 bits little endian integers), output file name or
+	file object opened in binary mode (which is not closed), number of 
+	channels (the columns of a samples array by default, 1 otherwise) and
+	sample rate (Hz).
+
+	Exceptions: This function will throw a ValueError if the samples are
+	not whole frames, and an exception if the file can not be written.
+
+	"""
+
+	if isinstance(samples, (str, buffer, bytearray)):
+		samples = np.frombuffer(samples, "<i2")
+	elif isinstance(samples, array.array):
+		samples = np.frombuffer(samples, samples.typecode)
+	samples = np.asarray(samples)
+
+	if (n_channels is None):
+		n_channels = samples.shape[1] if (samples.ndim == 2) else 1
+	samples = np.ascontiguousarray(samples, "<i2")
+	if (samples.size % n_channels != 0):
+		raise ValueError("%d samples are not whole frames of %d channels" % (samples.size, n_channels))
+
+	# The header is written before the samples, so the file does not need
+	# to be seekable (a pipe or a socket will do)
+	fp = open(output, 'wb') if isinstance(output, basestring) else output
+	try:
+		fp.write(wavio.getWavHeader(samples.size / n_channels, n_channels, sample_rate))
+		fp.write(buffer(samples))
+	finally:
+		if (fp is not output):
+			fp.close()
+
+
 #*******************************************************************************#
 #	Function getAudio: This gets and saves an audio in .wav format based on the #
 #	samples given.                                                              #
-#	Input: samples list                                                         #
+#	Input: samples list, number of channels, sample rate and output audio file  #
+#	(optional)                                                                  #
 #	Output: None, just saves the audio in the output_lhe/audio subfolder        #
 #*******************************************************************************#
 
-def getAudio(samples):
-	"""Saves the new audio in the specified subfolder given its samples values.
+def getAudio(samples, n_channels=1, sample_rate=SAMPLE_RATE, filename='output_lhe/audio/output_audio.wav'):
+	"""Saves the new audio in the specified subfolder given its samples values
+	(see writeAudio).
 
-	Parameters: Samples values list
+	Parameters: Samples values (interleaved frames if there are several
+	channels, see writeAudio), number of channels, sample rate (Hz) and
+	output audio file.
 
 	Exceptions: This function will throw an exception if the specified folder
 	does not exist.
 
 	"""
 
-	output = wave.open('output_lhe/audio/output_audio.wav', 'w')
-	output.setparams((2, 2, 48000, 0, 'NONE', 'not compressed')) # 2 channels, 2 values per sample, 48000 Hz
-
-	values = [] # Decodified amplitude values
-
-	for i in range(0, len(samples)):
-		sample = struct.pack('h', samples[i])
-		values.append(sample) # Left channel
-		values.append(sample) # Right channel
-
-	value_str = ''.join(values)
-	output.writeframes(value_str)
-
-	output.close()
\ No newline at end of file
+	writeAudio(samples, filename, n_channels, sample_rate)
@@ -7,12 +7,50 @@ This module gets the symbols lists from the .lhe file of the coded audio.
 # Author: Eduardo Rodes Pastor
 
 import Auxiliary.huff as huff
-import struct, math, os
+import Auxiliary.rangecoder as rangecoder
+import functools, struct
+import numpy as np
+
+from binary_enc import LHE_BASIC, LHE_BLOCKS, LHE_CHANNELS, LHE_RATE_BLOCKS, LHE_FRAMES, ONE, X, STATIC_TABLES
+
+# Entropy decoders, by the first byte of their payload (see CODERS)
+DECODERS = {
+	huff.CANONICAL: huff.Decoder,
+	huff.LEGACY: huff.Decoder,
+	huff.CONTEXT: huff.ContextDecoder,
+	huff.STATIC: functools.partial(huff.StaticDecoder, STATIC_TABLES),
+	rangecoder.RANGE: rangecoder.Decoder,
+	rangecoder.CONTEXT: rangecoder.Decoder}
 
 # ---------------#
 # BINARY DECODER #
 # ---------------#
 
+#*****************************************************************************#
+#	Function getType: This reads the type of a .lhe file (first byte of its   #
+#	header).                                                                  #
+#	Input: .lhe file                                                          #
+#	Output: LHE type (LHE_BASIC, LHE_BLOCKS, LHE_CHANNELS, LHE_RATE_BLOCKS or #
+#	LHE_FRAMES)                                                               #
+#*****************************************************************************#
+
+def getType(lhe_file):
+	"""Returns the type of a .lhe file, LHE_BASIC, LHE_BLOCKS, LHE_CHANNELS
+	or LHE_RATE_BLOCKS.
+
+	Parameters: .lhe file (string)
+
+	Exceptions: This will throw an exception if the .lhe file does not exist.
+
+	"""
+
+	fp = open(lhe_file, "rb")
+	lhe_type = struct.unpack("B", fp.read(1))[0]
+	fp.close()
+
+	return lhe_type
+
+
 #*****************************************************************************#
 #	Function getData: This reads some data from the .lhe file header. Since   #
 #	we know the size each number has, we can identify where 4 bytes will be   #
@@ -71,6 +109,180 @@ def getData(lhe_file):
 	return header[1], header[2], header[3], header[4], header[5]
 
 
+#*****************************************************************************#
+#	Function readData: This is getData for a .lhe file which is already in    #
+#	memory.                                                                   #
+#	Input: .lhe file content                                                  #
+#	Output: Data, as in getData                                               #
+#*****************************************************************************#
+
+def readData(data):
+	"""Returns the values of a basic .lhe file header, as getData does.
+
+	Parameters: .lhe file content (string)
+
+	Exceptions: This will throw an exception if the content is shorter than
+	the header, or a ValueError if its payload can not have its samples.
+
+	"""
+
+	header = struct.unpack("=Biiiii", data[0:21])
+	checkSymbols(data[21:], header[1], header[3])
+	return header[1], header[2], header[3], header[4], header[5]
+
+
+#*****************************************************************************#
+#	Function checkSymbols: This checks the number of symbols and samples of   #
+#	a payload in a .lhe header against what the payload can hold, so a        #
+#	corrupt (or hostile) header does not make the decoder work for samples    #
+#	which are not there.                                                      #
+#	Input: Payload, number of symbols, number of samples                      #
+#	Output: None                                                              #
+#*****************************************************************************#
+
+def checkSymbols(payload, n_sym, n_samples):
+	"""Checks that a payload can give the number of symbols and samples of
+	its header: every symbol is one sample at least, the symbols of 'X'
+	chains expand to n_sym * (n_sym + 7) samples at most (the i-th 'X' is
+	8 + 2i samples at most) and a Huffman code is one bit at least.
+
+	Parameters: Payload (string), number of symbols, number of samples.
+
+	Exceptions: This will throw a ValueError if the counts are not
+	possible.
+
+	"""
+
+	if (n_sym < 0 or n_samples < n_sym or n_samples > n_sym * (n_sym + 7)):
+		raise ValueError("corrupt .lhe file: %d symbols can not be %d samples" % (n_sym, n_samples))
+	if (payload[0:1] not in (rangecoder.RANGE, rangecoder.CONTEXT) and n_sym > 8 * len(payload)):
+		raise ValueError("corrupt .lhe file: %d symbols in a %d bytes payload" % (n_sym, len(payload)))
+
+
+#*****************************************************************************#
+#	Function expandRuns: This is the dynamic decompressor. It changes every   #
+#	'X' symbol for the '1' chain it represents. We only loop over the groups  #
+#	of 'X' and '1' symbols, not over the symbols.                             #
+#	Input: Symbols array (bytes)                                              #
+#	Output: Symbols array (bytes), without 'X' symbols                        #
+#*****************************************************************************#
+
+def expandRuns(sym, limit=None):
+	"""Returns the symbols array with every 'X' symbol changed for the '1'
+	chain it represents.
+
+	Parameters: Symbols array (uint8, the characters of the symbols) and
+	maximum number of symbols to return (all of them by default), so a few
+	'X' symbols never make a huge array.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	return _expandRuns(sym, 8, limit)[0]
+
+
+def _expandRuns(sym, x_length=8, limit=None):
+	"""expandRuns for symbols whose first '1' chain comes after others
+	(x_length is the one after them). Returns the symbols (the first limit
+	ones) and the x_length after them."""
+
+	n = len(sym)
+	is_x = (sym == X)
+	in_group = np.zeros(n + 2, np.int8)
+	in_group[1:n + 1] = is_x | (sym == ONE)
+
+	# Groups of 'X' and '1' symbols, their number of 'X' symbols and whether
+	# they start with '1' (after a symbol which is not 'X' or '1')
+	edges = np.diff(in_group)
+	starts = np.flatnonzero(edges == 1)
+	ends = np.flatnonzero(edges == -1)
+	x_before = np.zeros(n + 1, np.int64)
+	np.cumsum(is_x, out=x_before[1:])
+	n_x = x_before[ends] - x_before[starts]
+	n_one = (ends - starts) - n_x
+	first_one = (sym[starts] == ONE)
+
+	# Length of the '1' chain of every group
+	lengths = [0] * len(starts)
+	for i, (k, ones, first) in enumerate(zip(n_x.tolist(), n_one.tolist(), first_one.tolist())):
+		if first:
+			x_length = (x_length + 9) // 2 # First '1' we get: we decrease x_length
+		# Every 'X' is x_length '1' symbols, and x_length grows by two after it
+		lengths[i] = k * x_length + k * (k - 1) + ones
+		x_length = x_length + 2 * k
+
+	# The first symbol of every group becomes its chain, and the rest go away
+	values = sym.copy()
+	counts = np.ones(n, np.int64)
+	counts[in_group[1:n + 1] == 1] = 0
+	values[starts] = ONE
+	counts[starts] = lengths
+
+	if (limit is not None and counts.sum() > limit):
+		# The symbols after the first limit ones are not made
+		ends = np.cumsum(counts)
+		last = np.searchsorted(ends, limit)
+		values, counts = values[0:last + 1], counts[0:last + 1]
+		counts[last] -= ends[last] - limit
+
+	return np.repeat(values, counts), x_length
+
+
+#*****************************************************************************#
+#	Function iterExpandRuns: This is expandRuns for symbols which come in     #
+#	chunks whose '1' chains are finished in them, as the frame encoder writes #
+#	them (see compressRuns). x_length goes on from one chunk to the next one. #
+#	Input: Iterable of symbols arrays                                         #
+#	Output: Generator of symbols arrays, without 'X' symbols                  #
+#*****************************************************************************#
+
+def iterExpandRuns(sym_chunks):
+	"""Yields the symbols of every chunk with its 'X' symbols changed for
+	the '1' chains they represent.
+
+	Parameters: Iterable of symbols arrays (uint8, the characters of the
+	symbols), each one ending where the encoder finished a '1' chain.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	x_length = 8 # 'X' starts meaning eight '1' symbols
+
+	for sym in sym_chunks:
+		sym, x_length = _expandRuns(sym, x_length)
+		yield sym
+
+
+#*****************************************************************************#
+#	Function expandSymbols: This applies the dynamic decompressor to the      #
+#	symbols string given by the Huffman decoder.                              #
+#	Input: Symbols string (Huffman decoded), number of symbols in it, number  #
+#	of samples of the audio                                                   #
+#	Output: Symbols array                                                     #
+#*****************************************************************************#
+
+def expandSymbols(sym, n_sym, n_samples):
+	"""Returns the symbols array of the audio (uint8, the characters of the
+	symbols), changing the 'X' symbols for the '1' chains they represent.
+
+	Parameters: Symbols string, as the Huffman decoder gives it, number of 
+	symbols in it, number of samples of the audio.
+
+	Exceptions: This will throw a ValueError if the symbols are fewer than
+	the samples (a corrupt .lhe file).
+
+	"""
+
+	sym = expandRuns(np.frombuffer(sym[0:n_sym], np.uint8), n_samples)
+
+	if (len(sym) < n_samples):
+		raise ValueError("corrupt .lhe file: %d samples expected, the symbols only have %d" % (n_samples, len(sym)))
+
+	return sym
+
+
 #*****************************************************************************#
 #	Function getSymbolsLists: This returns the amplitude list of symbols      #
 #	given a .lhe file. It also detects the 'X' value, since it also is the    #
@@ -78,90 +290,244 @@ def getData(lhe_file):
 #	Input: .lhe file, number of symbols of the list, number of samples of the #
 #	audio (this is not equal to the number of symbols because of the symbol   #
 #	'X')                                                                      #
-#	Output: Symbols list                                                      #
+#	Output: Symbols array                                                     #
 #*****************************************************************************#
 
 def getSymbolsList(lhe_file, n_sym, n_samples):
-	"""Returns the codified symbols lists of a given .lhe file.
+	"""Returns the symbols array of a given .lhe file.
 
 	Parameters: .lhe file (string), number of symbols of the audio (integer),
 	number of samples of the audio (this is not equal to the number of symbols 
 	because of the symbol 'X').
 
-	Exceptions: This will throw an exception if the .lhe file is not in the 
-	output_lhe folder.
+	Exceptions: This will throw an exception if the .lhe file does not exist.
 
 	"""
 
-	# -- AMPLITUDE FILE -- #
-
-	# We discard the header 
-	with open(lhe_file, "rb", 0) as fp:
-		fp.seek(21)
-		data = fp.read(n_sym)
+	# We discard the header and decode the Huffman payload in memory
+	fp = open(lhe_file, "rb")
+	fp.seek(21)
+	data = fp.read()
 	fp.close()
 
- 	# Get the file with the Huffman codified amplitude
-	fp = open("output_lhe/out-huffman_audio.lhe", "wb")
-	fp.write(data)
+	return decodeSymbols(data, n_sym, n_samples)
+
+
+#*****************************************************************************#
+#	Function getBlocks: This reads the header and the blocks of a .lhe file   #
+#	made of independent blocks.                                               #
+#	Input: .lhe file                                                          #
+#	Output: Number of samples, maximum and minimum sample value, block size   #
+#	and blocks list (number of symbols, first amplitude and Huffman payload   #
+#	of every block)                                                           #
+#*****************************************************************************#
+
+def getBlocks(lhe_file):
+	"""Returns the header values and the blocks of a block .lhe file.
+
+	Parameters: .lhe file (string)
+
+	Output: In order: number of samples, maximum and minimum sample value,
+	number of samples per block and a list with a tuple (number of symbols,
+	first amplitude, Huffman payload and, in LHE_RATE_BLOCKS files, maximum
+	and minimum hop1) per block.
+
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or it is not a block .lhe file.
+
+	"""
+
+	fp = open(lhe_file, "rb")
+	data = fp.read()
 	fp.close()
 
-	# We decode with Huffman
-	dec = huff.Decoder("output_lhe/out-huffman_audio.lhe")
-	dec.decode_as("output_lhe/out-audio.lhe")
+	return readBlocks(data)
+
+
+#*****************************************************************************#
+#	Function readBlocks: This is getBlocks for a .lhe file which is already   #
+#	in memory.                                                                #
+#	Input: .lhe file content                                                  #
+#	Output: Number of samples, maximum and minimum sample value, block size   #
+#	and blocks list                                                           #
+#*****************************************************************************#
+
+def readBlocks(data):
+	"""Returns the header values and the blocks of a block .lhe file
+	content, as getBlocks does.
+
+	The blocks of LHE_RATE_BLOCKS files have their hop1 interval (maximum
+	and minimum hop1) after the payload in their tuples.
+
+	Parameters: .lhe file content (string)
+
+	Exceptions: This will throw a ValueError if it is not a block .lhe file,
+	or its blocks can not have its samples (see checkSymbols).
+
+	"""
+
+	lhe_type, n_samples, max_sample, min_sample, block_size, n_blocks = struct.unpack("=Biiiii", data[0:21])
+	if (lhe_type != LHE_BLOCKS and lhe_type != LHE_RATE_BLOCKS):
+		raise ValueError("not a block .lhe file")
+	if (block_size <= 0 or n_samples < 0 or n_blocks != (n_samples + block_size - 1) // block_size):
+		raise ValueError("corrupt .lhe file: %d blocks of %d samples for %d samples" % (n_blocks, block_size, n_samples))
+
+	blocks = [None] * n_blocks
+	i = 21 # Position in the file
+	for k in range(0, n_blocks):
+		if (lhe_type == LHE_RATE_BLOCKS):
+			n_sym, first_amp, max_hop1, min_hop1, payload_size = struct.unpack("=iiHHi", data[i:i + 16])
+			blocks[k] = (n_sym, first_amp, data[i + 16:i + 16 + payload_size], max_hop1, min_hop1)
+			i = i + 16 + payload_size
+		else:
+			n_sym, first_amp, payload_size = struct.unpack("=iii", data[i:i + 12])
+			blocks[k] = (n_sym, first_amp, data[i + 12:i + 12 + payload_size])
+			i = i + 12 + payload_size
+		checkSymbols(blocks[k][2], n_sym, min(block_size, n_samples - k * block_size))
+
+	return n_samples, max_sample, min_sample, block_size, blocks
+
+
+#*****************************************************************************#
+#	Function getChannels: This reads a multi-channel .lhe file and returns    #
+#	its header values and the .lhe content of every channel.                  #
+#	Input: .lhe file                                                          #
+#	Output: Number of samples per channel, sample rate and channels list      #
+#*****************************************************************************#
+
+def getChannels(lhe_file):
+	"""Returns the header values and the channels of a multi-channel .lhe 
+	file.
+
+	Parameters: .lhe file (string)
+
+	Output: In order: number of samples per channel, sample rate (Hz) and a
+	list with the .lhe content (basic or block one) of every channel.
+
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or it is not a multi-channel .lhe file.
 
-	# And we get the symbols of the file
-	f = open("output_lhe/out-audio.lhe", "rb")
-	sym = f.read()
-	f.close()
+	"""
+
+	fp = open(lhe_file, "rb")
+	data = fp.read()
+	fp.close()
 
-	# We create the lists we are going to work with
-	prov_sym = [0] * len(sym) # Provisional amplitude list (joined string)
-	final_sym = [0] * n_samples # Final amplitude list
+	return readChannels(data)
 
-	# -- DYNAMIC DECOMPRESSOR -- #
 
-	# We apply the necessary changes to the 'X' symbol
-	# Remember it means a variable group of '1' symbols
-	x_length = 8 # Starting x_length
+#*****************************************************************************#
+#	Function readChannels: This is getChannels for a .lhe file which is       #
+#	already in memory.                                                        #
+#	Input: .lhe file content                                                  #
+#	Output: Number of samples per channel, sample rate and channels list      #
+#*****************************************************************************#
 
-	# The following variable means we are in a chain which some of their symbols already were
-	# compressed with 'X'. We dont reduce x_length
-	in_chain = "false"
+def readChannels(data):
+	"""Returns the header values and the channels of a multi-channel .lhe
+	file content, as getChannels does.
 
-	for i in range(0, n_sym):
+	Parameters: .lhe file content (string)
 
-		# If we get 'X', we change it for the correct number of '1' symbols in a row 
-		if sym[i] == 'X':
-			in_chain = "true" # 'X' is just a group of '1'
-			chain = ''.join(['1'] * x_length) # We create the '1' chain
-			prov_sym[i] = chain # And save it in the list
-			x_length = x_length + 2 # Finally, we increase x_length for the next 'X'
+	Exceptions: This will throw a ValueError if it is not a multi-channel
+	.lhe file, or a channel does not have its samples.
 
-		# If we get '1', we save it and decrease x_length if it's the first '1' we get
-		elif (sym[i] == '1'):
-			prov_sym[i] = '1'
-			if (in_chain == "false"): # '1' after a symbol which is not 'X' or '1'
-				x_length = int(math.ceil(float((x_length) + 8)/2))
-			in_chain = "true"
+	"""
 
-		# Otherwise, save the symbol and we stop being in a '1' chain
+	lhe_type, n_channels, sample_rate, n_samples = struct.unpack("=Biii", data[0:13])
+	if (lhe_type != LHE_CHANNELS):
+		raise ValueError("not a multi-channel .lhe file")
+
+	channels = [None] * n_channels
+	i = 13 # Position in the file
+	for k in range(0, n_channels):
+		size = struct.unpack("=i", data[i:i + 4])[0]
+		channels[k] = data[i + 4:i + 4 + size]
+		i = i + 4 + size
+
+		# Every channel is a basic or block .lhe file with all the samples
+		channel_type = channels[k][0:1]
+		if (channel_type == chr(LHE_BASIC)):
+			channel_samples = readData(channels[k])[2]
+		elif (channel_type in (chr(LHE_BLOCKS), chr(LHE_RATE_BLOCKS))):
+			channel_samples = readBlocks(channels[k])[0]
 		else:
-			prov_sym[i] = sym[i]
-			in_chain = "false" 
+			raise ValueError("corrupt .lhe file: channel %d is not a .lhe file" % k)
+		if (channel_samples != n_samples):
+			raise ValueError("corrupt .lhe file: %d samples in channel %d, %d expected" % (channel_samples, k, n_samples))
+
+	return n_samples, sample_rate, channels
+
+
+#*****************************************************************************#
+#	Function readFrames: This reads the frames of a frame stream (.lhe file   #
+#	content written by a LHEframes.Encoder).                                  #
+#	Input: .lhe file content                                                  #
+#	Output: First amplitude, Huffman table and frames list                    #
+#*****************************************************************************#
+
+def readFrames(data):
+	"""Returns the first amplitude, the Huffman table and the frames of a
+	frame stream.
+
+	Parameters: .lhe file content (string).
+
+	Output: First amplitude, number of the Huffman table in STATIC_TABLES
+	and a list with a tuple (number of samples, number of code bits and
+	Huffman codes) per frame.
+
+	Exceptions: This will throw a ValueError if it is not a frame stream or
+	its last frame is not complete.
+
+	"""
+
+	lhe_type, first_amp, table = struct.unpack("=BiB", data[0:6])
+	if (lhe_type != LHE_FRAMES):
+		raise ValueError("not a frame stream")
+
+	frames = []
+	i = 6 # Position in the stream
+	while (i < len(data)):
+		if (i + 4 > len(data)):
+			raise ValueError("truncated frame stream")
+		n_samples, code_bits = struct.unpack("=HH", data[i:i + 4])
+		size = (code_bits + 7) // 8
+		if (i + 4 + size > len(data)):
+			raise ValueError("truncated frame stream")
+		frames.append((n_samples, code_bits, data[i + 4:i + 4 + size]))
+		i = i + 4 + size
+
+	return first_amp, table, frames
+
+
+#*****************************************************************************#
+#	Function decodeSymbols: This decodes a Huffman (or another entropy coder) #
+#	payload which is already in memory and applies the dynamic decompressor.  #
+#	Input: Payload, number of symbols, number of samples                      #
+#	Output: Symbols array                                                     #
+#*****************************************************************************#
+
+def decodeSymbols(payload, n_sym, n_samples):
+	"""Returns the symbols array of a Huffman (or another entropy coder)
+	payload, without writing any file.
+
+	Parameters: Payload (string), number of symbols in it, number of 
+	samples it represents.
+
+	Exceptions: This will throw a ValueError if the payload was not written
+	by a known entropy coder or its symbols are fewer than the samples.
+
+	"""
 
-	# We join the lists so we can work with them
-	prov_sym = ''.join(prov_sym)
+	if (n_sym == 0):
+		return np.zeros(0, np.uint8) # Empty audio
 
-	# Amplitude saving
-	for i in range(0, len(prov_sym)):
-		try:
-			final_sym[i] = int(prov_sym[i])
-		except:
-			final_sym[i] = prov_sym[i]
+	if (payload[0:1] not in DECODERS):
+		raise ValueError("unknown entropy coder")
 
-	# We delete the files we won't use anymore.
-	os.remove("output_lhe/out-huffman_audio.lhe")
-	os.remove("output_lhe/out-audio.lhe")
+	dec = DECODERS[payload[0:1]]()
+	dec.loads(payload)
+	if (getattr(dec, "n_sym", n_sym) > n_sym): # Range coder payloads keep their number of symbols
+		raise ValueError("corrupt .lhe file: %d symbols in the payload, %d expected" % (dec.n_sym, n_sym))
 
-	return final_sym
\ No newline at end of file
+	return expandSymbols(dec.decode(), n_sym, n_samples)
@@ -7,142 +7,515 @@ This module writes a .lhe file with some data, given the hops lists of the audio
 # Author: Eduardo Rodes Pastor
 
 import Auxiliary.huff as huff
-import struct, math, os
+import Auxiliary.rangecoder as rangecoder
+import array, struct, functools
+import numpy as np
+
+from LHEquantizer import MAX_HOP1, MIN_HOP1
+
+# Types of .lhe files (first byte of the header)
+LHE_BASIC = 0 # One Huffman payload for the whole audio
+LHE_BLOCKS = 1 # Independent blocks, each one with its own Huffman payload
+LHE_CHANNELS = 2 # Several channels, each one coded as a basic or block .lhe file
+LHE_RATE_BLOCKS = 3 # Independent blocks, each one with its own hop1 interval (rate control)
+LHE_FRAMES = 4 # Frames of a live stream, coded one by one with a static Huffman table (see LHEframes)
+
+# Symbols of the small hops (null hop, the hops next to it and chains of null
+# hops). The context coders keep a code (or model) for every previous symbol
+# and whether the one before it is small, as hop1 gets smaller after two small
+# hops in a row.
+SMALL_SYMBOLS = "123X"
+
+# Symbol (character code) of every hop, by its index in HOP_ORDER: hop 0 is
+# '9', hop 1 is '7'... and the null hop is '1'. Hops 'A' to 'D' are themselves.
+HOP_SYMBOLS = np.frombuffer("AB975312468CD", np.uint8)
+ONE, X = ord('1'), ord('X') # Null hop symbol and '1' chains symbol
+
+# Static Huffman tables: the code length of every symbol, trained on the
+# symbols of some audios (the getSymbols ones, whose distribution is much
+# the same for most audios). A payload only keeps the number of its table,
+# so the tables must never change: new ones go at the end.
+STATIC_TABLES = [
+	# 0, general: both audios of input_audio, in frames of 256 samples
+	{"1": 2, "2": 3, "3": 2, "4": 4, "5": 4, "6": 4, "7": 4, "8": 5, "9": 5, "A": 7, "B": 6, "C": 5, "D": 8, "X": 8},
+	# 1, quiet: silence.wav
+	{"1": 1, "2": 3, "3": 2, "4": 5, "5": 5, "6": 5, "7": 6, "8": 7, "9": 8, "A": 12, "B": 9, "C": 10, "D": 12, "X": 11},
+	# 2, music: track1.wav
+	{"1": 3, "2": 3, "3": 3, "4": 3, "5": 3, "6": 3, "7": 4, "8": 4, "9": 4, "A": 7, "B": 6, "C": 5, "D": 8, "X": 8},
+	# 3, speech: LHEbench "speech" signal
+	{"1": 2, "2": 2, "3": 2, "4": 4, "5": 4, "6": 5, "7": 4, "8": 6, "9": 7, "A": 9, "B": 9, "C": 9, "D": 10, "X": 10},
+	# 4, tonal: LHEbench "sine" signal
+	{"1": 4, "2": 3, "3": 3, "4": 3, "5": 2, "6": 3, "7": 3, "8": 5, "9": 6, "A": 8, "B": 9, "C": 8, "D": 9, "X": 8},
+	# 5, noise: LHEbench "noise" signal
+	{"1": 6, "2": 6, "3": 6, "4": 8, "5": 7, "6": 6, "7": 6, "8": 5, "9": 5, "A": 2, "B": 4, "C": 5, "D": 1, "X": 8}]
+STATIC_TABLE_NAMES = ["general", "quiet", "music", "speech", "tonal", "noise"]
+
+# Entropy coders of the symbols, by name. Every one gives an encoder like the
+# Huffman one (see huff.Encoder), and the first byte of its payload tells the
+# decoder which one wrote it (see binary_dec.DECODERS).
+CODERS = {
+	"huffman": huff.Encoder,
+	"range": rangecoder.Encoder,
+	"huffman-context": functools.partial(huff.ContextEncoder, SMALL_SYMBOLS),
+	"range-context": functools.partial(rangecoder.ContextEncoder, SMALL_SYMBOLS),
+	"huffman-static": functools.partial(huff.StaticEncoder, STATIC_TABLES)}
 
 # ---------------#
 # BINARY ENCODER #
 # ---------------#
 
 #******************************************************************************#
-#	Function getSymbols: This converts a hops list into a symbol list. We will #
-#	use a list called distribution, so we know which symbol we need based on   #
-#	the actual hop. It will also include a symbol compressor; we will use a    #
-#	symbol 'X' which means a variable '1' (null hops) chain each time, based   #
-#	on the length of '1' chains we got before.                                 #
-#	Input: Hops list                                                           #
-#	Output: Symbols list                                                       #
+#	Function compressRuns: This is the dynamic compressor. It changes the '1'  #
+#	chains (null hops) of a symbols array for 'X' symbols, each one meaning a  #
+#	'1' chain of x_length symbols. x_length grows by two after every 'X' and   #
+#	goes back towards eight after a chain which was too short for any 'X'.     #
+#	We only loop over the chains, not over the symbols.                        #
+#	Input: Symbols array (bytes), x_length and length of the '1' chain before  #
+#	them (optional), whether there are no more symbols after them (optional).  #
+#	Output: Compressed symbols array, x_length and length of the last chain    #
+#	if it was kept back for the next symbols                                   #
+#******************************************************************************#
+
+def compressRuns(sym, x_length=8, pending=0, final=True):
+	"""Returns the symbols array with its '1' chains compressed with 'X'
+	symbols, the x_length after them and the length of the '1' chain at the
+	end, which is kept back (not written) if final is False.
+
+	Parameters: Symbols array (uint8, the characters of the symbols), x_length
+	and length of the '1' chain right before them (for symbols which come in
+	chunks), whether these are the last symbols.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	n = len(sym)
+
+	# Chains of '1' symbols: where they start and end in the symbols, after a
+	# slot for the chain before them (the slot of every symbol is its index + 1)
+	is_one = np.zeros(n + 3, np.int8)
+	is_one[1] = (pending > 0)
+	is_one[2:n + 2] = (sym == ONE)
+	edges = np.diff(is_one)
+	starts = np.flatnonzero(edges == 1)
+	ends = np.flatnonzero(edges == -1)
+	lengths = ends - starts
+	if (pending > 0):
+		lengths[0] = lengths[0] + pending - 1 # Its slot stands for all of them
+
+	# The last chain is kept back if there are more symbols after it
+	last = len(starts)
+	if (last > 0 and ends[-1] == n + 1 and not final):
+		last = last - 1
+		pending = int(lengths[last])
+	else:
+		pending = 0
+
+	# Number of 'X' symbols of every chain and '1' symbols after them
+	n_x = [0] * len(starts)
+	n_one = [0] * len(starts)
+	for i, length in enumerate(lengths[0:last].tolist()):
+		while (length >= x_length):
+			length = length - x_length
+			x_length = x_length + 2
+			n_x[i] = n_x[i] + 1
+		n_one[i] = length
+		if (n_x[i] == 0):
+			x_length = (x_length + 9) // 2 # We reduce the length of the symbol 'X'
+
+	# Every symbol is repeated once, except the chains: the slot of their first
+	# symbol becomes the 'X' symbols and the '1' symbols, and the rest go away
+	values = np.zeros((n + 1, 2), np.uint8)
+	values[1:, 0] = sym
+	values[:, 1] = ONE
+	counts = np.zeros((n + 1, 2), np.int64)
+	counts[1:, 0] = (sym != ONE)
+	values[starts, 0] = X
+	counts[starts, 0] = n_x
+	counts[starts, 1] = n_one
+
+	return np.repeat(values.ravel(), counts.ravel()), x_length, pending
+
+
+#******************************************************************************#
+#	Function hopsToSymbols: This converts a hops array into an array with the  #
+#	symbol of every hop, using the HOP_SYMBOLS array (hop 0 is '9', hop 1 is   #
+#	'7'...). The null hop is '1'.                                              #
+#	Input: Hops array                                                          #
+#	Output: Symbols array (bytes)                                              #
+#******************************************************************************#
+
+def hopsToSymbols(hops):
+	"""Returns an array with the symbol (character code) of every hop.
+
+	Parameters: Hops array (indexes in HOP_ORDER, array('b'), NumPy array
+	or list).
+
+	Exceptions: This function will throw an IndexError if a hop is unknown.
+
+	"""
+
+	if isinstance(hops, array.array):
+		hops = np.frombuffer(hops, np.int8) # Without copying them
+	return HOP_SYMBOLS[np.asarray(hops, np.int8)]
+
+
+#******************************************************************************#
+#	Function getSymbols: This converts a hops array into a symbols array. We   #
+#	will use an array called HOP_SYMBOLS, so we know which symbol we need      #
+#	based on the actual hop. It will also include a symbol compressor; we will #
+#	use a symbol 'X' which means a variable '1' (null hops) chain each time,   #
+#	based on the length of '1' chains we got before.                           #
+#	Input: Hops array                                                          #
+#	Output: Symbols array                                                      #
 #******************************************************************************#
 
 def getSymbols(hops):
-	"""Returns a list of symbols given their respective hops list.
+	"""Returns an array of symbols (uint8, the characters of the symbols)
+	given their respective hops array.
 
 	This function also uses the dynamic compressor: we have a 'X' symbol which
 	will mean a variable '1' chain of symbols.
 
-	Parameters: Hops list (integers from 0 to 8).
+	Parameters: Hops array (indexes in HOP_ORDER, as getHops gives them).
 
 	Exceptions: This function does not throw an exception.
 
 	"""
 
-	n_samples = len(hops)
-	sym = [0] * n_samples # Symbols list
+	return compressRuns(hopsToSymbols(hops))[0]
+
+
+#******************************************************************************#
+#	Function iterSymbols: This is getSymbols for hops which come in chunks.    #
+#	The dynamic compressor state goes on from one chunk to the next one, so    #
+#	the symbols are the same ones getSymbols would give for the whole list.    #
+#	'1' symbols are kept back while they could still become part of an 'X'.    #
+#	Input: Iterable of hops arrays                                             #
+#	Output: Generator of symbols strings                                       #
+#******************************************************************************#
+
+def iterSymbols(hops_chunks):
+	"""Yields the symbols of every chunk of hops as a string, as 
+	getSymbols would give them for the whole hops list.
+
+	Parameters: Iterable of hops arrays (as iterHops gives them).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
 
-	# Dynamic compressor variables
-	cnt = 0 # Counter for '1' chains
 	x_length = 8 # 'X' will start meaning eight '1' symbols
+	pending = 0 # '1' chain at the end of the last chunk, not written yet
 
-	# The following variable means we are in a chain which some of their symbols already were
-	# compressed with 'X'. We dont reduce x_length
-	in_chain = "false" 
+	for hops in hops_chunks:
+		sym, x_length, pending = compressRuns(hopsToSymbols(hops), x_length, pending, False)
+		yield sym.tostring()
 
-	distribution = [9, 7, 5, 3, 1, 2, 4, 6, 8] # Symbols distribution: Hop 0 is '9', hop 1 is '7', hop 2 is '5'...
+	# The last chain was not finished by any other symbol
+	if (pending != 0):
+		yield compressRuns(np.zeros(0, np.uint8), x_length, pending)[0].tostring()
 
-	# We will use the symbol 'X' to represent '1' chains. The length of these chains will be saved in an array
-	for k in range(0, n_samples):
 
-		# If the hop is null, write '1' or 'X' depending on how many null hops are behind this one
-		if (hops[k] == 4): 
-			cnt = cnt + 1 # We increase the length of the chain
-			if (cnt < x_length): 
-				sym[k] = 1 # This symbol '1' will be removed if the chain has a length >= x_length
-			else:
-				sym[k-(x_length-1)] = 'X' # If chain length reaches 8, we write 'X'
-				cnt = 0 # Reseting counter
-				in_chain = "true" # We keep analyzing the chain
-				for p in range(0, x_length-1): 
-					sym[k-p] = 0 # We clear all the symbols '1' we wrote in this chain
-				x_length = x_length + 2 # We increase the length for next chain				
-			continue
+#******************************************************************************#
+#	Function buildFile: This builds the content of a .lhe file in memory. It   #
+#	contains some data for the decoder and the amplitude symbols with Huffman  #
+#	coding.                                                                    #
+#	Input: Symbol lists, amplitude value for the first sample, maximum and     #
+#	minimum sample value of the audio.                                         #
+#	Output: .lhe file content (string)                                         #
+#******************************************************************************#
+
+def buildFile(sym, first_amp, n_samples, max_sample, min_sample, coder="huffman", stats=None):
+	"""Returns the content of a .lhe file with some data for the decoder.
+
+	Parameters: Symbols array (see getSymbols), amplitude value for the 
+	first sample, maximum and minimum sample value of the audio (signed 16 bits
+	integers), entropy coder (a name in CODERS), stats object which counts
+	the header and payload bytes (optional, see LHEstats).
+
+	Exceptions: This function does not throw an exception.
 
-		# If the hop is not null, we check the distribution list
-		else:
-			if type(hops[k]) is int:
-				sym[k] = distribution[hops[k]]
-			else:
-				sym[k] = hops[k]
-			if (cnt != 0): # If we get a != '1' symbol, we reset the counter and save it in an array
-				cnt = 0 # Reset
-				if (in_chain == "false"): 
-					x_length = int(math.ceil(float((x_length) + 8)/2)) # We reduce the length of the symbol 'X'
-			in_chain = "false" # We are not anymore in a chain
-			continue
+	"""
+
+	# -- HEADER -- #
+
+	header = [
+		struct.pack("B", LHE_BASIC), # We are in basic LHE, so we write a '00000000' byte
+		struct.pack("i", len(sym)), # Length of the samples symbols list (4 bytes)
+		struct.pack("i", first_amp), # First amplitude value, so the decoder has a reference (4 bytes)
+		struct.pack("i", n_samples), # Number of total samples of the audio (4 bytes)
+		struct.pack("i", max_sample), # Number of maximum sample of the audio (4 bytes)
+		struct.pack("i", min_sample)] # Number of minimum sample of the audio (4 bytes)
+		# Total header length: 21 bytes.
 
-	sym = [x for x in sym if x != 0] # This removes all '0' symbols that are remaining.
+	if (stats is not None):
+		stats.add("header_bytes", 21)
 
-	return sym
+	# -- PAYLOAD -- #
+
+	return ''.join(header) + encodeSymbols(sym, coder, stats) # We codify the amplitude with Huffman (or another coder)
 
 
 #******************************************************************************#
 #	Function writeFile: This will create a .lhe file which will contain some   #
-#	data for the decoder and the amplitude symbols with Huffman coding. I know #
-#	creating and deleting files can be a bit slow, but I think it's the        #
-#	easiest way to understand what this method is doing.                       #
+#	data for the decoder and the amplitude symbols with Huffman coding.        #
 #	Input: Symbol lists, amplitude value for the first sample, maximum and     #
-#	minimum sample value of the audio.                                         #
+#	minimum sample value of the audio, .lhe file path (optional).              #
 #	Output: None, this function just creates the file.                         #
 #******************************************************************************#
 
-def writeFile(sym, first_amp, n_samples, max_sample, min_sample):
+def writeFile(sym, first_amp, n_samples, max_sample, min_sample, filename="output_lhe/lhe_file.lhe", coder="huffman", stats=None):
 	"""Writes a .lhe file with some data for the decoder.
 
-	Parameters: Symbol lists (integers from 1 to 9), amplitude value for the 
+	Parameters: Symbols array (see getSymbols), amplitude value for the 
 	first sample, maximum and minimum sample value of the audio (signed 16 bits
-	integers)
+	integers), .lhe file path, entropy coder (a name in CODERS), stats object
+	(optional, see buildFile).
 
-	Exceptions: This function does not throw an exception.
+	Exceptions: This function will throw an exception if the file can not 
+	be written.
 
 	"""
 
-	# -- PAYLOAD -- #
+	data = buildFile(sym, first_amp, n_samples, max_sample, min_sample, coder, stats)
+
+	f = open(filename, "wb")
+	f.write(data)
+	f.close()
+
+
+#******************************************************************************#
+#	Function encodeSymbols: This codifies a symbol list with Huffman (or       #
+#	another entropy coder), without writing any file.                          #
+#	Input: Symbols array, entropy coder (optional)                             #
+#	Output: Codified symbols (string)                                          #
+#******************************************************************************#
+
+def encodeSymbols(sym, coder="huffman", stats=None):
+	"""Returns the codified symbols (code table included).
+
+	Parameters: Symbols array (see getSymbols) or string, entropy coder (a
+	name in CODERS), stats object which counts the symbols, code bits, and
+	table and code bytes (optional, see LHEstats).
+
+	Exceptions: This function will throw a KeyError if the coder is unknown.
+
+	"""
+
+	if (len(sym) == 0):
+		return '' # Empty audio, nothing to codify
+
+	enc = CODERS[coder]()
+	enc.long_str = sym
+	payload = enc.dumps()
+
+	if (stats is not None):
+		table_bytes = len(enc.dumps_header())
+		stats.add("symbols", len(sym))
+		stats.add("code_bits", enc.bitslen)
+		stats.add("table_bytes", table_bytes)
+		stats.add("code_bytes", len(payload) - table_bytes)
 
-	f = open("output_lhe/" + "payload" + ".lhe", "wb")
+	return payload
 
-	# We write the not codified amplitude
-	for item in sym:
-  		f.write(str(item))
 
-  	f.close()
+#******************************************************************************#
+#	Function estimateBits: This estimates the size of the codified symbols     #
+#	(see encodeSymbols) from their counts, without coding them.                #
+#	Input: Symbols array, entropy coder (optional)                             #
+#	Output: Number of bits                                                     #
+#******************************************************************************#
+
+def estimateBits(sym, coder="huffman"):
+	"""Returns the number of bits encodeSymbols would give for a symbols
+	array, code table included. The Huffman codes only depend on the symbol
+	counts, so their size is exact (but for the last byte). The adaptive
+	range coders are estimated by the entropy of the symbols (given the
+	previous symbol for the context one).
+
+	Parameters: Symbols array (see getSymbols) or string, entropy coder (a
+	name in CODERS).
+
+	Exceptions: This function will throw a KeyError if the coder is unknown.
+
+	"""
+
+	if (len(sym) == 0):
+		return 0
+
+	enc = CODERS[coder]()
+	enc.count_chunk(sym)
+	enc.set_freq()
+	table_bits = 8 * len(enc.dumps_header())
+
+	if isinstance(enc, huff.Encoder):
+		return table_bits + enc.bitslen
+
+	# Symbol counts, a row per context (the previous symbol, or a single one)
+	sym = np.frombuffer(sym, np.uint8) if not isinstance(sym, np.ndarray) else sym
+	if (enc.small is None):
+		counts = np.bincount(sym, minlength=256).reshape(1, 256)
+	else:
+		counts = np.bincount(sym[:-1].astype(np.int64) * 256 + sym[1:], minlength=256 * 256).reshape(256, 256)
+
+	totals = np.repeat(counts.sum(axis=1), 256).reshape(counts.shape)
+	counts, totals = counts[counts > 0].astype(np.float64), totals[counts > 0]
+	return table_bits + int(np.ceil(-(counts * np.log2(counts / totals)).sum()))
+
+
+#******************************************************************************#
+#	Function buildBlocksFile: This builds the content of a .lhe file with      #
+#	independent blocks in memory. Every block has its own header (number of    #
+#	symbols, first amplitude and payload size) and Huffman payload. Blocks     #
+#	with their own hop1 interval (rate control) also keep it in their header.  #
+#	Input: Blocks list (number of symbols, first amplitude and Huffman payload #
+#	of every block), number of samples, maximum and minimum sample value of    #
+#	the audio and block size                                                   #
+#	Output: .lhe file content (string)                                         #
+#******************************************************************************#
 
-	enc = huff.Encoder("output_lhe/payload.lhe") # We codify the amplitude with Huffman 
-	enc.write("output_lhe/" + "payload_huff" + ".lhe") # We save the codified amplitude
+def buildBlocksFile(blocks, n_samples, max_sample, min_sample, block_size, stats=None):
+	"""Returns the content of a .lhe file made of independent blocks.
+
+	If the blocks have a hop1 interval (maximum and minimum hop1 after the
+	payload in their tuples, see LHEcodec.encodeBlock), it is an 
+	LHE_RATE_BLOCKS file and every block header keeps it (4 more bytes).
+
+	Parameters: Blocks list (tuples with the number of symbols, first 
+	amplitude and Huffman payload of every block, and its hop1 interval if
+	any), number of samples, maximum and minimum sample value of the audio,
+	number of samples per block and stats object which counts the header
+	bytes (optional, see LHEstats; the payloads are counted by 
+	encodeSymbols).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	rate = any(len(block) > 3 for block in blocks) # Blocks with their own hop1 interval
 
 	# -- HEADER -- #
 
-	f = open("output_lhe/header.lhe", "wb")
+	data = [
+		struct.pack("B", LHE_RATE_BLOCKS if rate else LHE_BLOCKS), # Block LHE
+		struct.pack("i", n_samples), # Number of total samples of the audio (4 bytes)
+		struct.pack("i", max_sample), # Number of maximum sample of the audio (4 bytes)
+		struct.pack("i", min_sample), # Number of minimum sample of the audio (4 bytes)
+		struct.pack("i", block_size), # Number of samples per block (4 bytes)
+		struct.pack("i", len(blocks))] # Number of blocks (4 bytes). Total header length: 21 bytes.
+
+	if (stats is not None):
+		stats.add("header_bytes", 21 + (16 if rate else 12) * len(blocks))
+
+	# -- BLOCKS -- #
+
+	for block in blocks:
+		n_sym, first_amp, payload = block[0:3]
+		data.append(struct.pack("i", n_sym)) # Length of the block symbols list (4 bytes)
+		data.append(struct.pack("i", first_amp)) # First amplitude value of the block (4 bytes)
+		if rate:
+			max_hop1, min_hop1 = block[3:5] if len(block) > 3 else (MAX_HOP1, MIN_HOP1)
+			data.append(struct.pack("HH", max_hop1, min_hop1)) # Hop1 interval of the block (2 + 2 bytes)
+		data.append(struct.pack("i", len(payload))) # Huffman payload size (4 bytes)
+		data.append(payload)
+
+	return ''.join(data)
+
+
+#******************************************************************************#
+#	Function writeBlocksFile: This creates a .lhe file with independent        #
+#	blocks (see buildBlocksFile).                                              #
+#	Input: Blocks list (number of symbols, first amplitude and Huffman payload #
+#	of every block), number of samples, maximum and minimum sample value of    #
+#	the audio, block size and .lhe file path (optional)                        #
+#	Output: None, this function just creates the file.                         #
+#******************************************************************************#
 
-	f.write(struct.pack("B", 0)) # We are in basic LHE, so we write a '00000000' byte. This wont be used in this codec
-	f.write(struct.pack("i", len(sym))) # Length of the samples symbols list (4 bytes)
-	f.write(struct.pack("i", first_amp)) # First amplitude value, so the decoder has a reference (4 bytes)
-	f.write(struct.pack("i", n_samples)) # Number of total samples of the audio (4 bytes)
-	f.write(struct.pack("i", max_sample)) # Number of maximum sample of the audio (4 bytes)
-	f.write(struct.pack("i", min_sample)) # Number of minimum sample of the audio (4 bytes)
-	f.close() # Total header length: 21 bytes.
+def writeBlocksFile(blocks, n_samples, max_sample, min_sample, block_size, filename="output_lhe/lhe_file.lhe", stats=None):
+	"""Writes a .lhe file made of independent blocks.
 
-	f = open("output_lhe/lhe_file.lhe", "wb") # This is the final lhe file
+	Parameters: Blocks list (tuples with the number of symbols, first 
+	amplitude and Huffman payload of every block), number of samples, 
+	maximum and minimum sample value of the audio, number of samples per 
+	block, .lhe file path and stats object (optional, see buildBlocksFile).
 
-	# -- WRITING FILE -- #
+	Exceptions: This function will throw an exception if the file can not 
+	be written.
 
-	f2 = open("output_lhe/header.lhe", "rb") # Writing header
-	f.write(f2.read())
-	f2.close()
-	f2 = open("output_lhe/" + "payload_huff" + ".lhe", "rb") # Writing payload
-	f.write(f2.read())
-	f2.close()
+	"""
+
+	data = buildBlocksFile(blocks, n_samples, max_sample, min_sample, block_size, stats)
+
+	f = open(filename, "wb")
+	f.write(data)
 	f.close()
 
-	# -- REMOVING OTHER FILES -- #
 
-	os.remove("output_lhe/header.lhe")
-	os.remove("output_lhe/payload.lhe")
-	os.remove("output_lhe/payload_huff.lhe")
\ No newline at end of file
+#******************************************************************************#
+#	Function buildChannelsFile: This builds the content of a multi-channel     #
+#	.lhe file in memory. Every channel is coded on its own, as a basic or      #
+#	block .lhe file, and they follow the header (number of channels, sample    #
+#	rate and number of samples per channel).                                   #
+#	Input: Channels list (.lhe file content of every channel), number of       #
+#	samples per channel and sample rate of the audio                           #
+#	Output: .lhe file content (string)                                         #
+#******************************************************************************#
+
+def buildChannelsFile(channels, n_samples, sample_rate, stats=None):
+	"""Returns the content of a multi-channel .lhe file.
+
+	Parameters: Channels list (basic or block .lhe file content of every 
+	channel, see buildFile and buildBlocksFile), number of samples per 
+	channel, sample rate of the audio (Hz) and stats object which counts
+	the header bytes (optional, see LHEstats).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+
+	# -- HEADER -- #
+
+	data = [
+		struct.pack("B", LHE_CHANNELS), # Multi-channel LHE
+		struct.pack("i", len(channels)), # Number of channels (4 bytes)
+		struct.pack("i", sample_rate), # Sample rate of the audio, in Hz (4 bytes)
+		struct.pack("i", n_samples)] # Number of samples per channel (4 bytes). Total header length: 13 bytes.
+
+	if (stats is not None):
+		stats.add("header_bytes", 13 + 4 * len(channels))
+
+	# -- CHANNELS -- #
+
+	for channel in channels:
+		data.append(struct.pack("i", len(channel))) # Channel .lhe content size (4 bytes)
+		data.append(channel)
+
+	return ''.join(data)
+
+
+#******************************************************************************#
+#	Function writeChannelsFile: This creates a multi-channel .lhe file (see    #
+#	buildChannelsFile).                                                        #
+#	Input: Channels list (.lhe file content of every channel), number of       #
+#	samples per channel, sample rate and .lhe file path (optional)             #
+#	Output: None, this function just creates the file.                         #
+#******************************************************************************#
+
+def writeChannelsFile(channels, n_samples, sample_rate, filename="output_lhe/lhe_file.lhe", stats=None):
+	"""Writes a multi-channel .lhe file.
+
+	Parameters: Channels list (basic or block .lhe file content of every
+	channel), number of samples per channel, sample rate of the audio (Hz),
+	.lhe file path and stats object (optional, see buildChannelsFile).
+
+	Exceptions: This function will throw an exception if the file can not 
+	be written.
+
+	"""
+
+	data = buildChannelsFile(channels, n_samples, sample_rate, stats)
+
+	f = open(filename, "wb")
+	f.write(data)
+	f.close()
@@ -12,7 +12,9 @@ from LHEquantizer import *
 from binary_enc import *
 from binary_dec import *
 from audio_dec import *
+from LHEcodec import *
 from Auxiliary.psnr import *
+from Auxiliary.wavio import readWav
 
 # ------------------------#
 # CODING/DECODING EXAMPLE #
@@ -35,22 +37,23 @@ if __name__=='__main__':
 		# Input audio path
 		using = "input_audio/insomnia.wav"
 
-		# LHE Quantizer
-		samples, n_samples, max_sample, min_sample = getSamples(using)
+		# All the channels of the audio and its sample rate
+		samples, info = readWav(using)
 
-		hops, result = getHops(samples, n_samples, max_sample, min_sample)
+		# LHE Quantizer and binary encoder, every channel on its own and in parallel
+		channels = encodeChannels(samples)
 
-		# We get the audio PSNR
-		print ""
-		calculatePSNR(result, samples, n_samples)
-		print ""
-
-		# Binary encoder
-		sym = getSymbols(hops)
-
-		writeFile(sym, samples[0], n_samples, max_sample, min_sample)
+		writeChannelsFile(channels, len(samples), info.sample_rate)
 		print ".lhe file created."
 
+		# We get the PSNR of every channel
+		decoded = decodeChannels(channels, len(samples))
+		for c in range(0, info.n_channels):
+			print ""
+			print "Channel", c + 1
+			calculatePSNR(decoded[:, c].tolist(), samples[:, c].tolist(), len(samples))
+		print ""
+
 	# --- DECODER --- #
 
 	elif function == "dec":
@@ -58,15 +61,29 @@ if __name__=='__main__':
 		# Lhe file path
 		path = "output_lhe/lhe_file.lhe"
 
-		# Binary decoder
-		n_sym, first_amp, n_samples, max_sample, min_sample = getData(path)
-		sym = getSymbolsList(path, n_sym, n_samples)
+		lhe_type = getType(path)
+
+		if (lhe_type == LHE_CHANNELS):
+			# Every channel on its own, decoded in parallel
+			n_samples, sample_rate, channels = getChannels(path)
+			samples = decodeChannels(channels, n_samples)
+
+			getAudio(samples, samples.shape[1], sample_rate)
+		else:
+			if (lhe_type == LHE_BLOCKS or lhe_type == LHE_RATE_BLOCKS):
+				# Independent blocks, decoded in parallel
+				samples = decodeFile(path)
+			else:
+				# Binary decoder
+				n_sym, first_amp, n_samples, max_sample, min_sample = getData(path)
+				sym = getSymbolsList(path, n_sym, n_samples)
+
+				# Audio decoder
+				hops = symbolsToHops(sym)
 
-		# Audio decoder
-		hops = symbolsToHops(sym)
+				samples = hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample)
 
-		samples = hopsToSamples(hops, first_amp, n_samples, max_sample, min_sample)
-		getAudio(samples)
+			getAudio(samples)
 		print "Output audio file created."
 
 	# --- EXIT --- #
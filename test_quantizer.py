@@ -0,0 +1,107 @@
+"""
+
+Tests of the quantizers: the hop table must give exactly the rows of
+calculateHopsRow (getHopRow), and the threshold quantizer exactly the hops
+of the exhaustive one, for single samples (nextHop against searchHop) and
+for whole audios (getHops).
+
+  python -m unittest -v test_quantizer
+
+"""
+# LHE Codec for Audio
+
+import glob, os, random, unittest
+import numpy as np
+
+from LHEquantizer import (getSamples, getHops, getHopRow, getThresholdTable, calculateHopsRow, nextHop, searchHop,
+	HOP1_STATES, NULL_HOP, THRESHOLD_TABLE_MAGIC)
+
+INPUT_AUDIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input_audio")
+RANDOM_CASES = 200000
+
+
+def _exhaustiveHop(acs, prs, hop1, hop_number, emin):
+	"""The hop and amplitude nextHop must give: the hop table row is
+	computed again and searched one hop at a time."""
+
+	row = calculateHopsRow(prs, hop1)
+	hop_number = searchHop(acs, prs, row, hop_number, emin)
+	return hop_number, row[hop_number]
+
+
+class HopRowTest(unittest.TestCase):
+
+	def assertSameRow(self, prs, hop1):
+		self.assertEqual(list(getHopRow(prs, hop1)), list(calculateHopsRow(prs, hop1)), "hop0 %d, hop1 %d" % (prs, hop1))
+
+	def test_random_rows(self):
+		rand = random.Random(3)
+		for _ in xrange(RANDOM_CASES // 10):
+			self.assertSameRow(rand.randint(-32768, 32767), rand.choice(HOP1_STATES))
+
+	def test_limits(self):
+		# Rows at the limits of the 16 bits range, for every hop1 state
+		for prs in (-32768, -32767, -32766, -1, 0, 1, 32766, 32767):
+			for hop1 in HOP1_STATES:
+				self.assertSameRow(prs, hop1)
+
+
+class NextHopTest(unittest.TestCase):
+
+	def assertSameHop(self, acs, prs, hop1, hop_number, emin):
+		self.assertEqual(nextHop(acs, prs, hop1, hop_number, emin), _exhaustiveHop(acs, prs, hop1, hop_number, emin),
+			"sample %d, hop0 %d, hop1 %d, pre-selected hop %d, emin %d" % (acs, prs, hop1, hop_number, emin))
+
+	def test_random_states(self):
+		rand = random.Random(1)
+		for _ in xrange(RANDOM_CASES):
+			acs = rand.randint(-32768, 32767)
+			prs = rand.randint(-32768, 32767)
+			if (rand.random() < 0.5): # Samples close to the prediction, as in real audios
+				acs = max(-32768, min(32767, prs + rand.randint(-2000, 2000)))
+			hop_number = NULL_HOP if rand.random() < 0.9 else rand.randint(0, 12)
+			emin = 32767 if rand.random() < 0.9 else rand.randint(1, 32767)
+			self.assertSameHop(acs, prs, rand.choice(HOP1_STATES), hop_number, emin)
+
+	def test_thresholds(self):
+		# Samples on every hop amplitude and decision threshold (ties)
+		rand = random.Random(2)
+		for _ in xrange(2000):
+			prs = rand.randint(-32768, 32767)
+			hop1 = rand.choice(HOP1_STATES)
+			row = calculateHopsRow(prs, hop1)
+			for j in range(12):
+				middle = (row[j] + row[j + 1]) // 2
+				for acs in (row[j], middle - 1, middle, middle + 1):
+					self.assertSameHop(max(-32768, min(32767, acs)), prs, hop1, NULL_HOP, 32767)
+
+	def test_non_monotone_rows(self):
+		# Rows whose amplitudes are not strictly increasing use searchHop
+		table = np.frombuffer(getThresholdTable(), "<i4", offset=len(THRESHOLD_TABLE_MAGIC)).reshape(-1, 26)
+		rows = np.nonzero(table[:, 25] == 0)[0]
+		self.assertTrue(len(rows) > 0)
+
+		for index in rows[::7]:
+			prs = int(index // len(HOP1_STATES)) - 32768
+			hop1 = HOP1_STATES[index % len(HOP1_STATES)]
+			self.assertEqual(list(table[index, 0:13]), calculateHopsRow(prs, hop1))
+			for acs in set([-32768, 32767, prs] + [int(amplitude) for amplitude in table[index, 0:13]]):
+				self.assertSameHop(acs, prs, hop1, NULL_HOP, 32767)
+
+
+class GetHopsTest(unittest.TestCase):
+
+	def test_input_audio(self):
+		filenames = sorted(glob.glob(os.path.join(INPUT_AUDIO, "*.wav")))
+		self.assertTrue(filenames, "no audio in %s" % INPUT_AUDIO)
+
+		for filename in filenames:
+			samples, n_samples, max_sample, min_sample = getSamples(filename)
+			exhaustive = getHops(samples, n_samples, max_sample, min_sample, "exhaustive")
+			threshold = getHops(samples, n_samples, max_sample, min_sample, "threshold")
+			self.assertEqual(threshold[0], exhaustive[0], "%s: other hops" % filename)
+			self.assertEqual(threshold[1], exhaustive[1], "%s: other amplitudes" % filename)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,152 @@
+"""
+
+Tests of the dynamic compressor of '1' chains: compressRuns and the
+decompressors must give exactly the symbols of the original loops, for
+whole hops lists, for hops which come in chunks and for a .lhe file
+written by the original encoder.
+
+  python -m unittest -v test_runs
+
+"""
+# LHE Codec for Audio
+
+import hashlib, os, random, unittest
+import numpy as np
+
+from binary_enc import compressRuns, getSymbols, hopsToSymbols, iterSymbols
+from binary_dec import DECODERS, expandRuns, iterExpandRuns, readData
+from LHEcodec import decode_bytes
+from LHEquantizer import NULL_HOP
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output_lhe", "lhe_file.lhe")
+FIXTURE_MD5 = "f9476169ecef5ffe39562094d66aca76" # Samples the original decoder gives
+RANDOM_CASES = 300
+
+
+def _compressLoop(sym):
+	"""The symbols of the original getSymbols loop, one symbol at a time:
+	every x_length '1' symbols in a chain become an 'X'."""
+
+	sym = list(sym)
+	cnt = 0
+	x_length = 8
+	in_chain = False
+
+	for k in range(len(sym)):
+		if (sym[k] == '1'):
+			cnt = cnt + 1
+			if (cnt == x_length):
+				sym[k - (x_length - 1)] = 'X'
+				for p in range(x_length - 1):
+					sym[k - p] = None
+				cnt = 0
+				in_chain = True
+				x_length = x_length + 2
+		else:
+			if (cnt != 0):
+				cnt = 0
+				if (not in_chain):
+					x_length = (x_length + 9) // 2
+			in_chain = False
+
+	return "".join(s for s in sym if s is not None)
+
+
+def _expandLoop(sym):
+	"""The symbols of the original getSymbolsList loop, one symbol at a
+	time: every 'X' becomes x_length '1' symbols."""
+
+	out = []
+	x_length = 8
+	in_chain = False
+
+	for s in sym:
+		if (s == 'X'):
+			out.append('1' * x_length)
+			x_length = x_length + 2
+			in_chain = True
+		elif (s == '1'):
+			if (not in_chain):
+				x_length = (x_length + 9) // 2
+			out.append(s)
+			in_chain = True
+		else:
+			out.append(s)
+			in_chain = False
+
+	return "".join(out)
+
+
+def _randomHops(rand):
+	"""Hops with null hop chains of any length, from a few hops to much more
+	than x_length, so x_length goes up and down."""
+
+	hops = []
+	while (len(hops) < 3000):
+		if (rand.random() < 0.5):
+			hops.extend([NULL_HOP] * rand.choice([rand.randint(1, 12), rand.randint(1, 60), rand.randint(50, 400)]))
+		hops.extend(rand.choice([h for h in range(13) if h != NULL_HOP]) for _ in range(rand.randint(1, 4)))
+	if (rand.random() < 0.5): # The audio may end in a chain
+		hops.extend([NULL_HOP] * rand.randint(1, 100))
+	return np.array(hops, np.uint8)
+
+
+def _split(rand, array):
+	"""The array cut at random places, with some empty chunks."""
+
+	cuts = sorted(rand.randint(0, len(array)) for _ in range(rand.randint(0, 12)))
+	return [array[a:b] for a, b in zip([0] + cuts, cuts + [len(array)])]
+
+
+class RunsTest(unittest.TestCase):
+
+	def test_whole_hops(self):
+		rand = random.Random(1)
+		for case in xrange(RANDOM_CASES):
+			hops = _randomHops(rand)
+			sym = hopsToSymbols(hops).tostring()
+			compressed = _compressLoop(sym)
+			self.assertEqual(getSymbols(hops).tostring(), compressed, "case %d" % case)
+			self.assertEqual(expandRuns(np.frombuffer(compressed, np.uint8)).tostring(), sym, "case %d" % case)
+			self.assertEqual(_expandLoop(compressed), sym, "case %d" % case)
+
+	def test_hops_chunks(self):
+		# The compressor state goes on from one chunk to the next one
+		rand = random.Random(2)
+		for case in xrange(RANDOM_CASES):
+			hops = _randomHops(rand)
+			compressed = _compressLoop(hopsToSymbols(hops).tostring())
+			self.assertEqual("".join(iterSymbols(_split(rand, hops))), compressed, "case %d" % case)
+
+	def test_frames(self):
+		# Every frame finishes its chains, and x_length goes on
+		rand = random.Random(3)
+		for case in xrange(RANDOM_CASES):
+			sym = hopsToSymbols(_randomHops(rand))
+			frames = []
+			x_length = 8
+			for chunk in _split(rand, sym):
+				compressed, x_length, _ = compressRuns(chunk, x_length)
+				frames.append(compressed)
+			self.assertEqual("".join(s.tostring() for s in iterExpandRuns(frames)), sym.tostring(), "case %d" % case)
+
+	def test_fixture(self):
+		# A file written by the original encoder
+		with open(FIXTURE, "rb") as fp:
+			data = fp.read()
+		n_sym, first_amp, n_samples, max_sample, min_sample = readData(data)
+
+		dec = DECODERS[data[21:22]]()
+		dec.loads(data[21:])
+		compressed = np.frombuffer(dec.decode()[0:n_sym], np.uint8)
+		sym = expandRuns(compressed)
+		self.assertEqual(len(sym), n_samples)
+		self.assertEqual(sym.tostring(), _expandLoop(compressed.tostring()))
+		self.assertEqual(compressRuns(sym)[0].tostring(), compressed.tostring())
+
+		samples = decode_bytes(data)
+		self.assertEqual(hashlib.md5(samples).hexdigest(), FIXTURE_MD5)
+
+
+if __name__ == "__main__":
+	unittest.main()